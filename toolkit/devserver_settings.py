@@ -25,6 +25,10 @@ LOGGING['root'] = {
 
 EMAIL_UNSUBSCRIBE_HOST = "localhost:8000"
 
+# Don't pre-render the programme to static files (the devserver doesn't use
+# them):
+STATIC_PROGRAMME_ROOT = None
+
 # Enable Debug mode, add in Django toolbar:
 DEBUG = True
 
@@ -0,0 +1,102 @@
+"""Process-level cache of the lists of roles, event tags and event templates
+used for the choices in the diary forms (see forms.CachedChoicesMixin and
+forms.rota_form_factory)
+
+The lists are needed to render every edit popup, and every row of the event
+template editor, but they change very rarely. Each process keeps a copy of
+each list along with the version number it was loaded at. The current
+version numbers are kept in the shared Django cache and bumped (by the signal
+handlers below) whenever a role, tag or template is saved or deleted, so
+other processes notice that their copy is stale on their next lookup without
+needing a database query. As the version is bumped before the change is
+committed, copies are also reloaded after LOCAL_TIMEOUT seconds regardless.
+"""
+import time
+import logging
+import threading
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from toolkit.diary.models import Role, EventTag, EventTemplate
+from toolkit.diary.page_cache import get_versions, bump_versions
+from toolkit.util.bulk_formset import bulk_updated
+
+logger = logging.getLogger(__name__)
+
+# Prefix used for all keys stored by this module:
+KEY_PREFIX = 'choices'
+
+# Maximum number of seconds for which a list is used without reloading it:
+LOCAL_TIMEOUT = 5 * 60
+
+# Model -> function loading its list (as a tuple, so it can be compared and
+# used as a dict key):
+_LOADERS = {
+    Role: lambda: tuple(Role.objects.order_by('name')
+                                    .values_list('id', 'name', 'standard')),
+    EventTag: lambda: tuple(EventTag.objects.order_by('name')
+                                            .values_list('id', 'name')),
+    EventTemplate: lambda: tuple(EventTemplate.objects.order_by('name')
+                                                      .values_list('id', 'name')),
+}
+
+# Model -> (version, load time, list):
+_local = {}
+_local_lock = threading.Lock()
+
+
+def _version_key(model):
+    return u"{0}:version:{1}".format(KEY_PREFIX, model._meta.object_name.lower())
+
+
+def _get(model):
+    version = get_versions([_version_key(model)])[0]
+    with _local_lock:
+        entry = _local.get(model)
+    if (entry is not None and entry[0] == version
+            and entry[1] >= time.time() - LOCAL_TIMEOUT):
+        return entry[2]
+    choices = _LOADERS[model]()
+    with _local_lock:
+        _local[model] = (version, time.time(), choices)
+    return choices
+
+
+def roles():
+    """Return tuple of (id, name, standard) for all roles, ordered by name"""
+    return _get(Role)
+
+
+def role_choices():
+    return tuple((pk, name) for pk, name, _ in roles())
+
+
+def tag_choices():
+    """Return tuple of (id, name) for all event tags, ordered by name"""
+    return _get(EventTag)
+
+
+def template_choices():
+    """Return tuple of (id, name) for all event templates, ordered by name"""
+    return _get(EventTemplate)
+
+
+def invalidate(model):
+    logger.debug(u"Invalidating cached {0} choices".format(model._meta.object_name))
+    with _local_lock:
+        _local.pop(model, None)
+    bump_versions([_version_key(model)])
+
+
+def clear_local():
+    with _local_lock:
+        _local.clear()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(bulk_updated)
+def _choices_changed(sender, **kwargs):
+    if sender in _LOADERS:
+        invalidate(sender)
@@ -0,0 +1,147 @@
+"""Support for conditional GET (ETag / Last-Modified) on the public diary views
+
+Each page gets an ETag that's calculated from a single aggregate query over
+the showings that the page covers, so if a browser / feed reader already has
+the current version of a page a 304 can be returned without running the main
+query or rendering the template. (The programme pages instead use the key
+they're cached under, see page_cache.py, which changes whenever anything on
+the page does, so checking it doesn't need any queries at all.)
+
+The ETag covers everything, including deleted showings (which change the
+count). There's no Last-Modified time, as deleting a showing doesn't leave
+anything with a later modification time, so a client that only sent
+If-Modified-Since would keep getting 304s for a page that still listed it.
+"""
+import hashlib
+import calendar
+import datetime
+import logging
+
+from django.db.models import Count, Max, Min
+from django.views.decorators.http import condition
+import django.utils.timezone as timezone
+
+from toolkit.diary.models import Showing, Event, MediaItem
+import toolkit.diary.page_cache as page_cache
+from toolkit.diary.daterange import get_date_range
+from toolkit.diary.feeds import BasicWhatsOnFeed
+
+logger = logging.getLogger(__name__)
+
+
+def _make_etag(*parts):
+    return hashlib.md5(repr(parts)).hexdigest()
+
+
+def _latest(*times):
+    times = [t for t in times if t is not None]
+    return max(times) if times else None
+
+
+def _showing_stats(showings):
+    """Return tuple of count, earliest start, latest start, latest update of
+    any of the showings or their events"""
+    stats = showings.aggregate(Count('id'), Min('start'), Max('start'),
+                               Max('updated_at'), Max('event__updated_at'))
+    return (
+        stats['id__count'],
+        stats['start__min'],
+        stats['start__max'],
+        _latest(stats['updated_at__max'], stats['event__updated_at__max']),
+    )
+
+
+def conditional(fingerprint_func):
+    """Decorator for views that enables conditional GET.
+
+    fingerprint_func is called with the same arguments as the view, and should
+    return a tuple (etag, last_modified); either may be None (and
+    last_modified should only be given if every change to the page makes it
+    later). It's called at most once per request."""
+    def get_fingerprint(request, *args, **kwargs):
+        if not hasattr(request, '_diary_fingerprint'):
+            request._diary_fingerprint = fingerprint_func(request, *args, **kwargs)
+        return request._diary_fingerprint
+
+    def etag_func(request, *args, **kwargs):
+        return get_fingerprint(request, *args, **kwargs)[0]
+
+    def last_modified_func(request, *args, **kwargs):
+        return get_fingerprint(request, *args, **kwargs)[1]
+
+    return condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+
+def programme_fingerprint(request, year=None, month=None, day=None, event_type=None):
+    """Fingerprint for public_views.view_diary"""
+    query_days_ahead = request.GET.get('daysahead', None)
+    startdate, days_ahead = get_date_range(year, month, day, query_days_ahead)
+    if startdate is None:
+        # Let the view deal with the error:
+        return (None, None)
+
+    # The page cache key includes the date (the page highlights the current
+    # date, so changes at midnight) and the version numbers of every month on
+    # the page, which are bumped when any showing, event, media item or
+    # printed programme in the month changes:
+    cache_key = page_cache.page_key(datetime.date.today(), startdate, days_ahead, event_type)
+    return (_make_etag(cache_key), None)
+
+
+def event_fingerprint(request, event_id=None, legacy_id=None):
+    """Fingerprint for public_views.view_event"""
+    if event_id:
+        events = Event.objects.filter(id=event_id)
+    else:
+        events = Event.objects.filter(legacy_id=legacy_id)
+    # One row per (showing, media item) of the event. The media details are
+    # included as editing a media item doesn't change the event's updated_at:
+    rows = list(events.order_by('showings__id', 'media__id')
+                      .values_list('updated_at', 'showings__id', 'showings__updated_at',
+                                   'media__id', 'media__media_file', 'media__mimetype',
+                                   'media__content_hash', 'media__credit', 'media__caption'))
+    if not rows:
+        # No such event; let the view raise the 404
+        return (None, None)
+
+    etag = _make_etag(event_id, legacy_id, rows)
+    return (etag, None)
+
+
+def archive_fingerprint(request, year=None, month=None):
+    """Fingerprint for the ArchiveIndex, ArchiveYear and ArchiveMonth views"""
+    # The archive views only show showings that have already started, so
+    # showings "arrive" in the archive as time goes by (which is reflected in
+    # the count and latest start time).
+    showings = Showing.objects.filter(start__lte=timezone.now())
+    try:
+        if year:
+            year = int(year)
+            first_month, last_month = (int(month), int(month)) if month else (1, 12)
+            start = datetime.datetime(year, first_month, 1)
+            end = (datetime.datetime(year, last_month, calendar.monthrange(year, last_month)[1])
+                   + datetime.timedelta(days=1))
+            current_tz = timezone.get_current_timezone()
+            showings = showings.filter(start__gte=current_tz.localize(start),
+                                       start__lt=current_tz.localize(end))
+    except ValueError:
+        return (None, None)
+    count, _, latest_start, last_update = _showing_stats(showings)
+    # As for event_fingerprint; editing a media item doesn't change its
+    # events' updated_at:
+    media = list(MediaItem.objects.filter(event__showings__in=showings)
+                                  .distinct().order_by('id')
+                                  .values_list('id', 'media_file', 'mimetype', 'content_hash',
+                                               'credit', 'caption'))
+
+    etag = _make_etag(year, month, count, latest_start, last_update, media)
+    return (etag, None)
+
+
+def feed_fingerprint(request):
+    """Fingerprint for feeds.BasicWhatsOnFeed"""
+    startdate = timezone.now()
+    enddate = startdate + datetime.timedelta(days=BasicWhatsOnFeed.DAYS_AHEAD)
+    stats = _showing_stats(Showing.objects.start_in_range(startdate, enddate))
+
+    return (_make_etag(*stats), None)
@@ -2,9 +2,8 @@ import json
 import datetime
 import logging
 
-from toolkit.util.ordereddict import OrderedDict
-
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.http import (HttpResponse, StreamingHttpResponse, Http404,
+                         HttpResponseRedirect)
 from django.shortcuts import get_object_or_404, render
 from django.core.urlresolvers import reverse
 from django.conf import settings
@@ -24,7 +23,10 @@ from toolkit.diary.models import (Showing, Event, DiaryIdea, MediaItem,
                                   PrintedProgramme)
 import toolkit.diary.forms as diary_forms
 import toolkit.diary.edit_prefs as edit_prefs
+import toolkit.diary.reports as reports
 import toolkit.members.tasks
+from toolkit.util.bulk_formset import bulk_modelformset_factory
+from toolkit.util.db import commit_on_success
 
 # Shared utility method:
 from toolkit.diary.daterange import get_date_range
@@ -62,14 +64,79 @@ def cancel_edit(request):
     return _return_to_editindex(request)
 
 
+# Maximum number of days in each chunk of the edit list (the list is sent a
+# calendar month at a time, with later months loaded as the page is scrolled)
+EDIT_LIST_MAX_CHUNK_DAYS = 31
+
+
+def _edit_list_chunk_end(start, end):
+    # Return the (exclusive) end date for the chunk of the edit list starting
+    # at the given date: the start of the next month, or end if that's sooner
+    if start.month == 12:
+        next_month = datetime.date(start.year + 1, 1, 1)
+    else:
+        next_month = datetime.date(start.year, start.month + 1, 1)
+    return min(next_month, end, start + datetime.timedelta(days=EDIT_LIST_MAX_CHUNK_DAYS))
+
+
+def _edit_list_rows(start, end, first_chunk):
+    # Return list of dicts, one per date from start up to (not including)
+    # end, with the showings (and the ideas for the month, for the first row
+    # and the 1st of each month) to be listed for that date.
+    #
+    # Dates are listed even if they don't have any showings, so that events
+    # can be added to them. The showings and ideas are fetched with one query
+    # each, and only the values needed for the list are loaded.
+    current_tz = timezone.get_current_timezone()
+    showings = (Showing.objects.start_in_range(
+                    current_tz.localize(datetime.datetime.combine(start, datetime.time())),
+                    current_tz.localize(datetime.datetime.combine(end, datetime.time())))
+                               .order_by('start')
+                               .values('pk', 'start', 'booked_by', 'confirmed', 'cancelled',
+                                       'discounted', 'event_id', 'event__name',
+                                       'event__private', 'event__outside_hire'))
+    showings_by_date = {}
+    for showing in showings:
+        showing['start'] = timezone.localtime(showing['start'])
+        showings_by_date.setdefault(showing['start'].date(), []).append(showing)
+
+    # The ideas for the month containing start are shown against start:
+    ideas_by_month = dict(
+        DiaryIdea.objects.filter(month__range=[start.replace(day=1), end])
+                         .values_list('month', 'ideas'))
+
+    rows = []
+    day = start
+    while day < end:
+        row = {
+            'date': day,
+            'showings': showings_by_date.get(day, []),
+            'new_year': (first_chunk and day == start) or (day.month == 1 and day.day == 1),
+            'new_month': day == start or day.day == 1,
+        }
+        if row['new_month']:
+            row['ideas'] = ideas_by_month.get(day.replace(day=1)) or u""
+        rows.append(row)
+        day += datetime.timedelta(days=1)
+    return rows
+
+
+def _edit_list_chunk_url(start, end):
+    return u"{0}?end={1}".format(
+        reverse('edit-list-chunk', kwargs={
+            'year': start.year, 'month': start.month, 'day': start.day}),
+        end.isoformat()
+    )
+
+
 @login_required
 def edit_diary_list(request, year=None, day=None, month=None):
     # Basic "edit" list view. Logic about processing of year/month/day
     # parameters is basically the same as for the public diary view.
     #
-    # The logic is a bit twisty, from the requirement to show list all dates
-    # and 'ideas' fields in the range, even if they don't have any events in
-    # them, yet.
+    # Only the first month (or part month) of the range is included in the
+    # page; the rest is fetched from edit_diary_list_chunk as the page is
+    # scrolled.
 
     context = {}
     # Sort out date range to display
@@ -87,9 +154,9 @@ def edit_diary_list(request, year=None, day=None, month=None):
 
     # utility function, shared with public diary view
     startdatetime, days_ahead = get_date_range(year, month, day, query_days_ahead, default_days_ahead)
-    startdate = startdatetime.date()
     if startdatetime is None:
         raise Http404(days_ahead)
+    startdate = startdatetime.date()
 
     # Don't allow viewing of dates before today, to avoid editing of the past:
     local_now = timezone.localtime(timezone.now())
@@ -106,52 +173,13 @@ def edit_diary_list(request, year=None, day=None, month=None):
         return HttpResponseRedirect(new_url)
 
     enddatetime = startdatetime + datetime.timedelta(days=days_ahead)
+    enddate = enddatetime.date()
+
+    chunk_end = _edit_list_chunk_end(startdate, enddate)
+    context['rows'] = _edit_list_rows(startdate, chunk_end, first_chunk=True)
+    if chunk_end < enddate:
+        context['next_chunk_url'] = _edit_list_chunk_url(chunk_end, enddate)
 
-    # Get all showings in the date range
-    showings = (Showing.objects.start_in_range(startdatetime, enddatetime)
-                               .order_by('start').select_related())
-    # Build two dicts, to hold the showings and the ideas. These dicts are
-    # initially empty, and get filled in if there are actually showings or
-    # ideas for those dates.
-    # This is done so that if dates don't have ideas/showings they still get
-    # shown in the list
-    dates = OrderedDict()
-    ideas = {startdate: ''}  # Actually, I lied: start of visible list is not
-                             # neccesarily the 1st of the month, so make sure
-                             # that it gets an 'IDEAS' link shown
-    for days in xrange(days_ahead):
-        # Iterate through every date in the visible range, creating a dict
-        # entry for each
-        day_in_range = startdatetime + datetime.timedelta(days=days)
-        dates[day_in_range.date()] = []
-        # If it's the 1st of the month, make sure there's an ideas entry
-        if day_in_range.day == 1:
-            ideas[day_in_range.date()] = ''
-    # Now insert all the showings into the 'dates' dict
-    for showing in showings:
-        dates[showing.start.date()].append(showing)
-    # Dates without a showing will still be in the dates dict, so will still
-    # be shown
-
-    # Now get all 'ideas' in date range. Fiddle the date range to be from the
-    # start of the month in startdate, so the idea for that month gets
-    # included:
-    idea_startdate = datetime.date(day=1, month=startdate.month, year=startdate.year)
-    idea_list = (DiaryIdea.objects.filter(month__range=[idea_startdate, enddatetime])
-                                  .order_by('month').select_related())
-    # Assemble into the idea dict, with keys that will match the keys in the
-    # showings dict
-    for idea in idea_list:
-        ideas[idea.month] = idea.ideas
-    # Fiddle so that the idea for the first month is displayed, even if
-    # startdate is after the first day of the month:
-    if (idea_startdate not in showings
-            and len(idea_list) > 0
-            and idea_list[0].month.month == startdate.month):
-        ideas[startdate] = idea_list[0].ideas
-
-    context['ideas'] = ideas
-    context['dates'] = dates
     # Page title:
     context['event_list_name'] = u"Diary for {0} to {1}".format(
         startdatetime.strftime("%d-%m-%Y"),
@@ -163,6 +191,34 @@ def edit_diary_list(request, year=None, day=None, month=None):
     return render(request, 'edit_event_index.html', context)
 
 
+@login_required
+def edit_diary_list_chunk(request, year, month, day):
+    # Return the rows of the edit list for the month (at most) starting at the
+    # given date, and not going past the date in the "end" parameter, as JSON
+    # {"html": <table rows>, "next": <URL of the next chunk, or null>}
+    try:
+        start = datetime.date(int(year), int(month), int(day))
+        end = datetime.datetime.strptime(request.GET.get('end', ''), "%Y-%m-%d").date()
+    except ValueError:
+        return HttpResponse("Invalid date", status=400, content_type="text/plain")
+
+    # As for edit_diary_list, don't list dates before today (e.g. if the page
+    # was loaded yesterday):
+    start = max(start, timezone.localtime(timezone.now()).date())
+    if start >= end:
+        return HttpResponse(json.dumps({'html': u"", 'next': None}),
+                            mimetype="application/json")
+
+    chunk_end = _edit_list_chunk_end(start, end)
+    html = django.template.loader.render_to_string(
+        'edit_event_index_rows.html',
+        {'rows': _edit_list_rows(start, chunk_end, first_chunk=False)})
+    next_url = _edit_list_chunk_url(chunk_end, end) if chunk_end < end else None
+
+    return HttpResponse(json.dumps({'html': html, 'next': next_url}),
+                        mimetype="application/json")
+
+
 @login_required
 def set_edit_preferences(request):
     # Store user preferences as specified in the request's GET variables,
@@ -175,18 +231,7 @@ def set_edit_preferences(request):
     return HttpResponse(json.dumps(prefs), mimetype="application/json")
 
 
-@login_required
-@require_POST
-def add_showing(request, event_id):
-    # Add a showing to an existing event. Must be called via POST. Uses POSTed
-    # data to create a new showing.
-    # Must be called with a "copy_from" GET parameter. Showing options that
-    # are not specified on the form (rota entries, confirmed/cancelled/etc) are
-    # copied from the showing with the given ID.
-    #
-    # If add was successful, calls _return_to_editindex. On error goes to
-    # form_showing.html
-
+def _get_clone_source_showing(request, event_id):
     # Although the data was POSTed, the copy_from is passed in the qyery:
     copy_from = request.GET.get('copy_from', None)
 
@@ -202,6 +247,23 @@ def add_showing(request, event_id):
         logger.error("Cloned showing event ID != URL event id")
         raise Http404("Requested source showing not associated with given event id")
 
+    return source_showing
+
+
+@login_required
+@require_POST
+def add_showing(request, event_id):
+    # Add a showing to an existing event. Must be called via POST. Uses POSTed
+    # data to create a new showing.
+    # Must be called with a "copy_from" GET parameter. Showing options that
+    # are not specified on the form (rota entries, confirmed/cancelled/etc) are
+    # copied from the showing with the given ID.
+    #
+    # If add was successful, calls _return_to_editindex. On error goes to
+    # form_showing.html
+
+    source_showing = _get_clone_source_showing(request, event_id)
+
     # Create form using submitted data:
     clone_showing_form = diary_forms.CloneShowingForm(request.POST)
     if clone_showing_form.is_valid():
@@ -227,16 +289,69 @@ def add_showing(request, event_id):
     else:
         # For now, assume this is being called from "edit showing"
         # form, and return that
-        showing = get_object_or_404(Showing, pk=copy_from)
-        showing_form = diary_forms.ShowingForm(instance=showing)
+        showing_form = diary_forms.ShowingForm(instance=source_showing)
         context = {
-            'showing': showing,
+            'showing': source_showing,
             'form': showing_form,
             'clone_showing_form': clone_showing_form,
+            'series_form': _series_form_for(source_showing),
         }
         return render(request, 'form_showing.html', context)
 
 
+@login_required
+@require_POST
+def add_showing_series(request, event_id):
+    # Add a series of showings to an existing event, from a recurrence rule
+    # (see forms.ShowingSeriesForm). Must be called via POST, with a
+    # "copy_from" GET parameter, as for add_showing; the showings' details and
+    # rota are copied from that showing. Dates on which the event already has
+    # a showing at the same time are skipped.
+    #
+    # If add was successful, calls _return_to_editindex. On error goes to
+    # form_showing.html
+    source_showing = _get_clone_source_showing(request, event_id)
+    event = source_showing.event
+
+    series_form = diary_forms.ShowingSeriesForm(request.POST)
+    if series_form.is_valid():
+        starts = list(series_form.get_starts())
+        existing = set(event.showings.filter(start__range=(starts[0], starts[-1]))
+                                     .values_list('start', flat=True))
+        new_starts = [start for start in starts if start not in existing]
+
+        with commit_on_success():
+            new_showings = event.add_showings(
+                new_starts, copy_from=source_showing,
+                booked_by=series_form.cleaned_data['booked_by'])
+
+        message = u"Added {0} showings for event '{1}'".format(len(new_showings), event.name)
+        if len(new_starts) < len(starts):
+            message += u" (skipped {0} that already existed)".format(len(starts) - len(new_starts))
+        messages.add_message(request, messages.SUCCESS, message)
+
+        return _return_to_editindex(request)
+    else:
+        context = {
+            'showing': source_showing,
+            'form': diary_forms.ShowingForm(instance=source_showing),
+            'clone_showing_form': diary_forms.CloneShowingForm(),
+            'series_form': series_form,
+        }
+        return render(request, 'form_showing.html', context)
+
+
+def _series_form_for(showing):
+    # Form for adding a series of showings based on the given showing,
+    # initially set to weekly for a month:
+    start = showing.start + datetime.timedelta(days=7)
+    return diary_forms.ShowingSeriesForm(initial={
+        'series_start': start,
+        'until': (timezone.localtime(start) + datetime.timedelta(days=28)).date(),
+        'weekdays': [timezone.localtime(start).weekday()],
+    })
+
+
 @permission_required('toolkit.write')
 @require_http_methods(["GET", "POST"])
 def add_event(request):
@@ -251,29 +366,30 @@ def add_event(request):
         # days from form. Uses template to set rota roles and tags.
         form = diary_forms.NewEventForm(request.POST)
         if form.is_valid():
-            new_event = Event(name=form.cleaned_data['event_name'],
-                              template=form.cleaned_data['event_template'],
-                              duration=form.cleaned_data['duration'],
-                              outside_hire=form.cleaned_data['outside_hire'],
-                              private=form.cleaned_data['private'])
-            # Set event tags to those from its template:
-            new_event.save()
-            new_event.reset_tags_to_default()
-            # create number_of_days showings, each offset by one more from the
-            # date/time given in start parameter, and each with rota roles from
-            # the template
-            start = form.cleaned_data['start']
-            for day_count in range(0, form.cleaned_data['number_of_days']):
-                day_offset = datetime.timedelta(days=day_count)
-                new_showing = Showing(event=new_event,
-                                      start=(start + day_offset),
-                                      discounted=form.cleaned_data['discounted'],
-                                      confirmed=form.cleaned_data['confirmed'],
-                                      booked_by=form.cleaned_data['booked_by'],
-                                      )
-                new_showing.save()
-                # Set showing roles to those from its template:
-                new_showing.reset_rota_to_default()
+            # Create the event, its tags, showings and rota in one
+            # transaction, so nothing is left half created if it fails:
+            with commit_on_success():
+                new_event = Event(name=form.cleaned_data['event_name'],
+                                  template=form.cleaned_data['event_template'],
+                                  duration=form.cleaned_data['duration'],
+                                  outside_hire=form.cleaned_data['outside_hire'],
+                                  private=form.cleaned_data['private'])
+                # Set event tags to those from its template:
+                new_event.save()
+                new_event.reset_tags_to_default()
+                # create number_of_days showings, each offset by one more from
+                # the date/time given in start parameter, and each with rota
+                # roles from the template
+                start = form.cleaned_data['start']
+                starts = [start + datetime.timedelta(days=day_count)
+                          for day_count in range(0, form.cleaned_data['number_of_days'])]
+                new_showings = new_event.add_showings(
+                    starts,
+                    discounted=form.cleaned_data['discounted'],
+                    confirmed=form.cleaned_data['confirmed'],
+                    booked_by=form.cleaned_data['booked_by'],
+                )
+                new_showing = new_showings[-1]
 
             messages.add_message(
                 request, messages.SUCCESS, u"Added event '{0}' with showing on {1}".format(
@@ -313,9 +429,10 @@ def add_event(request):
 @permission_required('toolkit.write')
 @require_http_methods(["GET", "POST"])
 def edit_showing(request, showing_id=None):
-    showing = get_object_or_404(Showing, pk=showing_id)
+    # (Event is needed to save the showing, see Showing.set_is_public)
+    showing = get_object_or_404(Showing.objects.select_related('event'), pk=showing_id)
 
-    RotaForm = diary_forms.rota_form_factory(showing)
+    RotaForm = diary_forms.rota_form_factory()
 
     if request.method == 'POST':
         form = diary_forms.ShowingForm(request.POST, instance=showing)
@@ -338,7 +455,7 @@ def edit_showing(request, showing_id=None):
             return _return_to_editindex(request)
     else:
         form = diary_forms.ShowingForm(instance=showing)
-        rota_form = RotaForm()
+        rota_form = RotaForm(initial=RotaForm.initial_for(showing))
 
     # Also create a form for "cloning" the showing (ie. adding another one),
     # but initialise it with values from existing event, but a day later...
@@ -352,6 +469,7 @@ def edit_showing(request, showing_id=None):
         'showing': showing,
         'form': form,
         'clone_showing_form': clone_showing_form,
+        'series_form': _series_form_for(showing),
         'rota_form': rota_form,
         'max_role_assignment_count': settings.MAX_COUNT_PER_ROLE,
     }
@@ -407,7 +525,7 @@ class EditEventView(View):
         # records need to be updated.
 
         # Event object
-        event = get_object_or_404(Event, pk=event_id)
+        event = get_object_or_404(Event.objects.with_main_mediaitem(), pk=event_id)
 
         # Get the event's media item, or start a new one:
         media_item = event.get_main_mediaitem() or MediaItem()
@@ -432,7 +550,7 @@ class EditEventView(View):
         return render(request, 'form_event.html', context)
 
     def get(self, request, event_id):
-        event = get_object_or_404(Event, pk=event_id)
+        event = get_object_or_404(Event.objects.with_main_mediaitem(), pk=event_id)
         # For now only support a single media item:
         media_item = event.get_main_mediaitem() or MediaItem()
 
@@ -501,7 +619,11 @@ def delete_showing(request, showing_id):
                 showing.event.name, showing.start.strftime("%d/%m/%y")
             )
         )
-        showing.delete()
+        # (Django commits deletes after sending post_delete, so without this
+        # the cached pages would be invalidated before the delete commits;
+        # see util.db.after_commit)
+        with commit_on_success():
+            showing.delete()
 
     return _return_to_editindex(request)
 
@@ -513,7 +635,13 @@ def view_event_field(request, field, year, month, day):
     #
     # This method gets the list of events for the given date range (using the
     # same shared logic for parsing the parameters as the public list / edit
-    # list) and then uses the appropriate template to render the results.
+    # list) and then uses the appropriate templates to render the results
+    # (see reports.py).
+    #
+    # Reports for more than settings.STREAMED_REPORT_MIN_DAYS are streamed
+    # (rendered as they're sent) rather than built in memory first; the
+    # "stream" parameter ("1" or "0") overrides this. The rota is also
+    # available as CSV, with format=csv.
 
     logger.debug(u"view_event_field: field {0}".format(field))
     assert field in ('copy', 'terms', 'rota', 'copy_summary')
@@ -526,10 +654,10 @@ def view_event_field(request, field, year, month, day):
     showings = (Showing.objects.not_cancelled()
                                .confirmed()
                                .start_in_range(start_date, end_date)
-                               .order_by('start')
-                               # following prefetch is for the rota view
-                               .prefetch_related('rotaentry_set__role')
-                               .select_related())
+                               .order_by('start', 'pk')
+                               .select_related('event'))
+    if field == 'rota':
+        showings = showings.prefetch_related('rotaentry_set__role')
 
     search = request.GET.get('search')
     if search:
@@ -541,16 +669,33 @@ def view_event_field(request, field, year, month, day):
             | Q(event__name__icontains=search)
         )
 
+    chunk_size = settings.STREAMED_REPORT_CHUNK_SIZE
+
+    if field == 'rota' and request.GET.get('format') == 'csv':
+        response = StreamingHttpResponse(reports.rota_csv(showings, chunk_size),
+                                         content_type="text/csv; charset=utf-8")
+        response['Content-Disposition'] = u'attachment; filename="{0}"'.format(
+            reports.rota_csv_filename(start_date, days_ahead))
+        return response
+
     context = {
         'start_date': start_date,
         'end_date': end_date,
         'days_ahead': days_ahead,
-        'showings': showings,
         'event_field': field,
         'search': search,
     }
 
-    return render(request, u'view_{0}.html'.format(field), context)
+    stream = request.GET.get('stream')
+    if stream is None:
+        stream = days_ahead > settings.STREAMED_REPORT_MIN_DAYS
+    else:
+        stream = stream == '1'
+
+    content = reports.render_report(request, field, showings, context, chunk_size)
+    if stream:
+        return StreamingHttpResponse(content)
+    return HttpResponse(u"".join(content))
 
 
 @permission_required('toolkit.write')
@@ -559,7 +704,8 @@ def edit_event_templates(request):
     # GET: Render multiple forms (using a formset)
     # POST: Update formset
 
-    event_template_formset = modelformset_factory(EventTemplate, can_delete=True)
+    event_template_formset = bulk_modelformset_factory(
+        EventTemplate, diary_forms.EventTemplateForm, can_delete=True)
 
     if request.method == 'POST':
         formset = event_template_formset(request.POST)
@@ -597,36 +743,47 @@ def edit_event_tags(request):
     # Ensure keys are all integers
     deleted_tag_keys = [int(k) for k in deleted_tag_keys]
 
-    # process new tags:
-    for new_tag in new_tag_names:
-        tag_form = diary_forms.TagForm({'name': new_tag, 'readonly': False})
-        if tag_form.is_valid():
-            logger.info(u"Creating new tag {0}".format(
-                tag_form.cleaned_data['name']))
-            tag_form.save()
-        else:
-            errors[new_tag] = [
-                u",".join(msg) for msg in tag_form.errors.itervalues()
-            ]
-
-    if errors:
-        # Bail out before deleting anything
+    # Validate all the new tags together (so the names are checked for
+    # clashes with one query) then create them:
+    TagFormset = bulk_modelformset_factory(EventTag, diary_forms.TagForm, extra=0)
+    data = {
+        'form-TOTAL_FORMS': len(new_tag_names),
+        'form-INITIAL_FORMS': 0,
+        'form-MAX_NUM_FORMS': len(new_tag_names),
+    }
+    for index, new_tag in enumerate(new_tag_names):
+        data['form-{0}-name'.format(index)] = new_tag
+    tag_formset = TagFormset(data, queryset=EventTag.objects.none())
+
+    if not tag_formset.is_valid():
+        for new_tag, tag_form in zip(new_tag_names, tag_formset.forms):
+            if tag_form.errors:
+                errors[new_tag] = [
+                    u",".join(msg) for msg in tag_form.errors.itervalues()
+                ]
+        # Bail out before creating or deleting anything
         return HttpResponse(
             json.dumps({'failed': True, 'errors': errors}),
             mimetype="application/json"
         )
 
-    # process deleted tags
-    for deleted_key in deleted_tag_keys:
-        try:
-            tag = EventTag.objects.get(id=deleted_key)
-        except EventTag.DoesNotExist:
-            err = "Tag with key {0} can't be deleted: not found".format(deleted_key)
-            errors.setdefault('delete', []).append(err)
-            logger.error(err)
-        else:
+    with commit_on_success():
+        for tag in tag_formset.save():
+            logger.info(u"Created new tag {0}".format(tag.name))
+
+        # process deleted tags, with one query to find them and one to delete
+        # them
+        found_tags = EventTag.objects.in_bulk(deleted_tag_keys) if deleted_tag_keys else {}
+        for deleted_key in deleted_tag_keys:
+            if deleted_key not in found_tags:
+                err = "Tag with key {0} can't be deleted: not found".format(deleted_key)
+                errors.setdefault('delete', []).append(err)
+                logger.error(err)
+        deleted_tags = [tag for tag in found_tags.itervalues() if tag.delete_allowed()]
+        for tag in deleted_tags:
             logger.info(u"Deleting tag {0} (key {1})".format(tag.name, tag.pk))
-            tag.delete()
+        if deleted_tags:
+            EventTag.objects.filter(pk__in=[tag.pk for tag in deleted_tags]).delete()
 
     return HttpResponse(
         json.dumps({'failed': bool(errors), 'errors': errors}),
@@ -636,11 +793,9 @@ def edit_event_tags(request):
 
 @permission_required('toolkit.write')
 def edit_roles(request):
-    # This is pretty slow,but it's not a commonly used bit of the UI...
-    # (To be precise, save involves >120 queries. This is because I've been
-    # lazy and used the formset save method)
-
-    RoleFormset = modelformset_factory(Role, diary_forms.RoleForm, can_delete=True)
+    # (Uses a bulk formset, as a plain model formset needs several queries
+    # per role to validate and save)
+    RoleFormset = bulk_modelformset_factory(Role, diary_forms.RoleForm, can_delete=True)
 
     if request.method == 'POST':
         formset = RoleFormset(request.POST)
@@ -1,5 +1,6 @@
 import datetime
 import calendar
+import itertools
 
 from django import forms
 import django.db.models
@@ -10,11 +11,45 @@ from toolkit.diary.form_widgets import (HtmlTextarea, JQueryDateTimePicker,
                                         ChosenSelectMultiple)
 
 import toolkit.diary.models
+import toolkit.diary.choice_cache as choice_cache
+from toolkit.diary.recurrence import recurring_starts
 from toolkit.util.ordereddict import OrderedDict
 
 from toolkit.diary.validators import validate_in_future
 
 
+class _CachedChoices(object):
+    # Choices which are taken from the choice cache when they're iterated over
+    # (i.e. when the field is rendered), so that forms which are only
+    # validated never need them
+    def __init__(self, get_choices, empty_label=None):
+        self.get_choices = get_choices
+        self.empty_label = empty_label
+
+    def __iter__(self):
+        if self.empty_label is not None:
+            yield (u"", self.empty_label)
+        for choice in self.get_choices():
+            yield choice
+
+
+class CachedChoicesMixin(object):
+    # Takes the choices for model choice fields from the choice cache rather
+    # than querying for them each time the form is rendered. Set
+    # cached_choice_fields to a dict mapping field name -> choice_cache
+    # function. (Submitted values are still checked against the database.)
+    cached_choice_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super(CachedChoicesMixin, self).__init__(*args, **kwargs)
+        for name, get_choices in self.cached_choice_fields.iteritems():
+            field = self.fields[name]
+            # (Not using the choices property, which would build the list
+            # straight away)
+            field._choices = field.widget.choices = _CachedChoices(
+                get_choices, getattr(field, 'empty_label', None))
+
+
 class RoleForm(forms.ModelForm):
     class Meta(object):
         model = toolkit.diary.models.Role
@@ -26,7 +61,9 @@ class DiaryIdeaForm(forms.ModelForm):
         model = toolkit.diary.models.DiaryIdea
 
 
-class EventForm(forms.ModelForm):
+class EventForm(CachedChoicesMixin, forms.ModelForm):
+
+    cached_choice_fields = {'tags': choice_cache.tag_choices}
 
     class Meta(object):
         model = toolkit.diary.models.Event
@@ -68,48 +105,61 @@ class ShowingForm(forms.ModelForm):
         }
 
 
-def rota_form_factory(showing):
-    # Dynamically generate a form to edit the rota for the given showing
+# The last generated RotaForm class, and the roles it was generated for:
+_rota_form = (None, None)
+
+
+def rota_form_factory():
+    # Return a form class to edit the rota for a showing, with a field for
+    # each standard role and a multiple choice for the others. Use
+    # RotaForm.initial_for(showing) to get the initial data for a showing.
+    #
+    # As the roles rarely change the class is kept and reused until they do.
+    global _rota_form
+
+    # All available roles (ordered by name):
+    roles = choice_cache.roles()
+    generated_for, form_class = _rota_form
+    if generated_for == roles:
+        return form_class
 
     # Members for RotaForm class:
     members = OrderedDict()
 
-    # All available roles:
-    roles = toolkit.diary.models.Role.objects.order_by('name')
-
     # list of role IDs, to get stored in form and used to build rota from
     # submitted form data (as submitted data won't include IDs where rota
     # count is 0)
     _role_ids = []
 
-    # Get all rota entries for showing, annotated with the maximum value of "rank" for the role
-    rota_entries = (toolkit.diary.models.Role
-                                        .objects.filter(rotaentry__showing_id=showing.pk)
-                                                .annotate(max_rank=django.db.models.Max('rotaentry__rank')))
-
-    # Build dict mapping role ID to max_rank
-    rota_entry_count_by_role = dict((role.pk, role.max_rank) for role in rota_entries)
-
-    for role in roles:
-        _role_ids.append(role.pk)
-        if role.standard:
+    for role_id, name, standard in roles:
+        _role_ids.append(role_id)
+        if standard:
             # For each "standard" role, add an Integer field;
-            members[u"role_{0}".format(role.pk)] = (
-                forms.IntegerField(min_value=0, max_value=settings.MAX_COUNT_PER_ROLE, required=True, label=role.name,
-                                   initial=rota_entry_count_by_role.get(role.pk, 0),
-                                   widget=forms.TextInput(attrs={'class': 'rota_count'}))
+            members[u"role_{0}".format(role_id)] = (
+                forms.IntegerField(min_value=0, max_value=settings.MAX_COUNT_PER_ROLE, required=True, label=name,
+                                   initial=0, widget=forms.TextInput(attrs={'class': 'rota_count'}))
             )
 
     # Add a MultipleChoiceField for all roles that aren't "standard"
     members['other_roles'] = forms.MultipleChoiceField(
-        ((role.pk, role.name) for role in roles if not role.standard),
+        [(role_id, name) for role_id, name, standard in roles if not standard],
         # Don't have to have anything selected:
         required=False,
-        # List of IDs which should be selected:
-        initial=(entry.pk for entry in rota_entries),
         help_text='Hold down "Control", or "Command" on a Mac, to select more than one.'
     )
 
+    def initial_for(cls, showing):
+        # Get the maximum value of "rank" for each role in the showing's rota
+        max_rank_by_role = dict(
+            toolkit.diary.models.RotaEntry.objects.filter(showing_id=showing.pk)
+                                                  .values_list('role_id')
+                                                  .annotate(django.db.models.Max('rank')))
+        initial = dict((u"role_{0}".format(role_id), max_rank)
+                       for role_id, max_rank in max_rank_by_role.iteritems())
+        # List of IDs which should be selected:
+        initial['other_roles'] = max_rank_by_role.keys()
+        return initial
+
     def get_rota(self):
         # Build a dict mapping role_id: number from submitted cleaned
         # data
@@ -127,9 +177,12 @@ def rota_form_factory(showing):
         return result
 
     members['_role_ids'] = _role_ids
+    members['initial_for'] = classmethod(initial_for)
     members['get_rota'] = get_rota
 
-    return type("RotaForm", (forms.Form,), members)
+    form_class = type("RotaForm", (forms.Form,), members)
+    _rota_form = (roles, form_class)
+    return form_class
 
 
 class CloneShowingForm(forms.Form):
@@ -140,7 +193,65 @@ class CloneShowingForm(forms.Form):
     booked_by = forms.CharField(min_length=1, max_length=128, required=True)
 
 
-class NewEventForm(forms.Form):
+class ShowingSeriesForm(forms.Form):
+    # For adding a series of showings (cloned from an existing showing) using
+    # a recurrence rule
+
+    # Maximum number of showings that can be added at once:
+    MAX_SHOWINGS = 100
+
+    series_start = forms.DateTimeField(required=True, validators=[validate_in_future],
+                                       widget=JQueryDateTimePicker())
+    until = forms.DateField(required=True)
+    weekdays = forms.TypedMultipleChoiceField(
+        choices=list(enumerate(calendar.day_name)), coerce=int, required=False,
+        widget=forms.CheckboxSelectMultiple, help_text="Weekly on these days...")
+    interval_days = forms.IntegerField(min_value=1, max_value=365, required=False,
+                                       label="Every N days", help_text="...or every N days")
+    exclude_dates = forms.CharField(required=False, help_text="Dates to skip, e.g. 25/12/2013, 1/1/2014")
+    booked_by = forms.CharField(min_length=1, max_length=64, required=True)
+
+    def clean_exclude_dates(self):
+        date_field = forms.DateField()
+        dates = []
+        for text in self.cleaned_data['exclude_dates'].replace(',', ' ').split():
+            try:
+                dates.append(date_field.clean(text))
+            except forms.ValidationError:
+                raise forms.ValidationError(u"Invalid date '{0}'".format(text))
+        return dates
+
+    def clean(self):
+        cleaned_data = super(ShowingSeriesForm, self).clean()
+        if self._errors:
+            return cleaned_data
+
+        if bool(cleaned_data.get('weekdays')) == bool(cleaned_data.get('interval_days')):
+            raise forms.ValidationError("Choose either days of the week or a number of days")
+
+        # Only need to look at enough of the series to tell if it's too long:
+        count = len(list(itertools.islice(self.get_starts(), self.MAX_SHOWINGS + 1)))
+        if count == 0:
+            raise forms.ValidationError("No dates match")
+        elif count > self.MAX_SHOWINGS:
+            raise forms.ValidationError(
+                u"Can't add more than {0} showings at once".format(self.MAX_SHOWINGS))
+
+        return cleaned_data
+
+    def get_starts(self):
+        """Return iterator over the start times of the series (only valid
+        once the form has been validated)"""
+        return recurring_starts(self.cleaned_data['series_start'],
+                                self.cleaned_data['until'],
+                                weekdays=self.cleaned_data['weekdays'],
+                                interval_days=self.cleaned_data['interval_days'],
+                                exclude_dates=self.cleaned_data['exclude_dates'])
+
+
+class NewEventForm(CachedChoicesMixin, forms.Form):
+    cached_choice_fields = {'event_template': choice_cache.template_choices}
+
     start = forms.DateTimeField(required=True, validators=[validate_in_future], widget=JQueryDateTimePicker())
     duration = forms.TimeField(required=True, initial=datetime.time(hour=1))
     number_of_days = forms.IntegerField(min_value=1, max_value=31, required=True, initial=1)
@@ -214,6 +325,16 @@ class NewPrintedProgrammeForm(forms.ModelForm):
         return cleaned_data
 
 
+class EventTemplateForm(CachedChoicesMixin, forms.ModelForm):
+    cached_choice_fields = {
+        'roles': choice_cache.role_choices,
+        'tags': choice_cache.tag_choices,
+    }
+
+    class Meta(object):
+        model = toolkit.diary.models.EventTemplate
+
+
 class TagForm(forms.ModelForm):
     class Meta(object):
         model = toolkit.diary.models.EventTag
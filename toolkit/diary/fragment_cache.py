@@ -0,0 +1,177 @@
+"""Cache for the rendered details of each event on the public programme pages
+(event_fragment.html, used via the {% cached_event_fragment %} tag)
+
+The same event appears on lots of different programme pages (the default view,
+each day/month/year view, tag views and its own page), so when a whole page
+isn't in the page cache (see page_cache.py) most of the events on it can
+still be taken from here rather than re-rendering the copy, thumbnail, etc.
+
+Each fragment is cached under a key made from the event id, its updated_at
+time, a fingerprint of the showings being listed, the main media item and the
+thumbnail alias options, plus a per-event version number that is bumped (by
+the signal handlers below) whenever anything shown in the fragment changes,
+including things that don't change the event's updated_at (e.g. the image
+credit, or media being attached/detached).
+
+If settings.EVENT_FRAGMENT_CACHE_STATS is set, hits and misses are counted in
+the cache, see stats() and the "event_fragment_stats" management command. It's
+off by default, as each count is another cache write (and with the file based
+cache, incr isn't atomic, so the counts are only approximate).
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from toolkit.diary.models import Showing, Event, MediaItem, showings_bulk_created
+from toolkit.diary.page_cache import get_versions, bump_versions
+from toolkit.util.thumbnail_queue import thumbnails_generated
+
+logger = logging.getLogger(__name__)
+
+# Prefix used for all keys stored by this module:
+KEY_PREFIX = 'event_fragment'
+
+# Thumbnail alias used for the event image in the fragment:
+THUMBNAIL_ALIAS = 'std'
+
+# Keys (and lifetime) of the hit / miss counters:
+HITS_KEY = u"{0}:stats:hits".format(KEY_PREFIX)
+MISSES_KEY = u"{0}:stats:misses".format(KEY_PREFIX)
+STATS_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def _version_key(event_id):
+    return u"{0}:version:{1}".format(KEY_PREFIX, event_id)
+
+
+def load_versions(events):
+    """Fetch the current fragment version numbers for all the given events in
+    one go, to save a cache lookup per event when they're rendered"""
+    events = list(events)
+    versions = get_versions([_version_key(event.pk) for event in events])
+    for event, version in zip(events, versions):
+        event._fragment_version = version
+
+
+def _get_version(event):
+    if not hasattr(event, '_fragment_version'):
+        load_versions([event])
+    return event._fragment_version
+
+
+def fragment_key(event, showings):
+    """Return the cache key for the fragment for event, listing the given
+    showings"""
+    showing_parts = [(showing.pk, showing.start, showing.updated_at,
+                      showing.cancelled, showing.discounted)
+                     for showing in showings]
+    media_item = event.get_main_mediaitem()
+    media_parts = None
+    if media_item:
+        media_parts = (media_item.pk, media_item.media_file.name, media_item.credit)
+    thumbnail_options = sorted(
+        settings.THUMBNAIL_ALIASES['diary.MediaItem'][THUMBNAIL_ALIAS].items())
+
+    raw_key = repr((event.updated_at, _get_version(event), showing_parts,
+                    media_parts, THUMBNAIL_ALIAS, thumbnail_options,
+                    settings.MEDIA_URL))
+    return u"{0}:{1}:{2}".format(KEY_PREFIX, event.pk, hashlib.md5(raw_key).hexdigest())
+
+
+def get_fragment(key):
+    """Return cached fragment for the given key, or None"""
+    content = cache.get(key)
+    _count(MISSES_KEY if content is None else HITS_KEY)
+    return content
+
+
+def set_fragment(key, content):
+    cache.set(key, content, settings.EVENT_FRAGMENT_CACHE_TIMEOUT)
+
+
+# Hit / miss counters:
+
+def _count(key):
+    if not settings.EVENT_FRAGMENT_CACHE_STATS:
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Key wasn't in the cache (if two processes get here at once then a
+        # count may be lost, which doesn't matter):
+        if not cache.add(key, 1, STATS_TIMEOUT):
+            cache.incr(key)
+
+
+def stats():
+    """Return dict with the number of cache hits and misses (since the last
+    reset_stats())"""
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        'hits': counts.get(HITS_KEY, 0),
+        'misses': counts.get(MISSES_KEY, 0),
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+# Invalidation:
+
+def invalidate_events(event_ids):
+    """Invalidate the cached fragments for the given events"""
+    event_ids = list(event_ids)
+    if event_ids:
+        logger.debug(u"Invalidating event fragments for events {0}".format(event_ids))
+        bump_versions([_version_key(event_id) for event_id in event_ids])
+
+
+@receiver(post_save, sender=Showing)
+@receiver(post_delete, sender=Showing)
+def _showing_changed(sender, instance, **kwargs):
+    invalidate_events([instance.event_id])
+
+
+@receiver(showings_bulk_created, sender=Showing)
+def _showings_created(sender, showings, **kwargs):
+    invalidate_events(set(showing.event_id for showing in showings))
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def _event_changed(sender, instance, **kwargs):
+    invalidate_events([instance.pk])
+
+
+@receiver(post_save, sender=MediaItem)
+@receiver(post_delete, sender=MediaItem)
+def _mediaitem_changed(sender, instance, **kwargs):
+    if instance.pk is not None:
+        invalidate_events(instance.event_set.values_list('pk', flat=True))
+
+
+@receiver(thumbnails_generated)
+def _thumbnails_generated(sender, source_name, **kwargs):
+    # (Fragments rendered before then show the placeholder image)
+    invalidate_events(Event.objects.filter(media__media_file=source_name)
+                                   .values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Event.media.through)
+def _event_media_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_events([instance.pk])
+    elif action == 'pre_clear':
+        # instance is a MediaItem, and the affected events can't be found
+        # after the clear:
+        instance._fragment_event_ids = list(instance.event_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidate_events(getattr(instance, '_fragment_event_ids', ()))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_events(pk_set or ())
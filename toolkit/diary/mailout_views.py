@@ -1,9 +1,12 @@
 import json
+import time
 import datetime
 import logging
 
 import celery.result
+from celery.utils import uuid
 
+from django.conf import settings
 from django.http import HttpResponse
 from django.shortcuts import render
 import django.template
@@ -13,14 +16,20 @@ from django.contrib.auth.decorators import permission_required
 from django.views.decorators.http import require_GET, require_POST, require_http_methods
 
 from toolkit.diary.models import Showing
+from toolkit.members.models import Mailout
 import toolkit.diary.forms as diary_forms
 import toolkit.members.tasks
+import toolkit.members.mailout_progress as progress_store
 
 # Shared utility method:
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Seconds between checks of the progress store while waiting for a mailout's
+# progress to change:
+MAILOUT_PROGRESS_POLL_INTERVAL = 0.25
+
 
 def _render_mailout_body(days_ahead):
     # Render default mail contents;
@@ -97,22 +106,97 @@ def exec_mailout(request):
         }
         return HttpResponse(json.dumps(response), mimetype="application/json")
 
-    result = toolkit.members.tasks.send_mailout.delay(form.cleaned_data['subject'],
-                                                      form.cleaned_data['body'])
+    # (Set up the progress store before the task starts, so it can't
+    # overwrite anything the task records)
+    task_id = uuid()
+    progress_store.start(task_id)
+    mailout = Mailout.objects.create(subject=form.cleaned_data['subject'],
+                                     body=form.cleaned_data['body'],
+                                     task_id=task_id)
+    toolkit.members.tasks.send_mailout.apply_async((mailout.pk,), task_id=task_id)
 
     response = HttpResponse(
-        json.dumps({'status': 'ok', 'task_id': result.task_id, 'progress': 0}),
+        json.dumps({'status': 'ok', 'task_id': task_id, 'progress': 0}),
         mimetype="application/json"
     )
 
     return response
 
 
+def _stored_mailout_state(task_id, last_progress):
+    """Return (state, result, changed) for the mailout task from the progress
+    store (see members.mailout_progress), or None if there's nothing stored
+    for it.
+
+    If last_progress (the percentage the page last saw) is given, waits (for up
+    to settings.MAILOUT_PROGRESS_LONG_POLL_TIMEOUT seconds) until the progress
+    changes, or the mailout finishes, before returning. changed is False if it
+    gave up waiting."""
+    deadline = time.time() + settings.MAILOUT_PROGRESS_LONG_POLL_TIMEOUT
+    while True:
+        progress = progress_store.get(task_id)
+        if progress is None:
+            return None
+        if progress['result'] is not None:
+            return "SUCCESS", progress['result'], True
+        percent = progress_store.percent(progress)
+        changed = last_progress is None or percent != last_progress
+        if changed or time.time() >= deadline:
+            if progress['total'] is None:
+                return "PENDING", None, changed
+            return 'PROGRESS{0:03}'.format(percent), None, changed
+        time.sleep(MAILOUT_PROGRESS_POLL_INTERVAL)
+
+
+def _batched_mailout_state(task_ids):
+    """Return (state, result) for a mailout that's been split into batches,
+    given the ids of the tasks that were started (see
+    members.tasks.send_mailout). Until the report task has finished the state
+    is PROGRESSnnn, with the progress over all the batches."""
+    report_result = celery.result.AsyncResult(id=task_ids['report'])
+    if report_result.state in ("SUCCESS", "FAILURE"):
+        return report_result.state, report_result.result
+
+    sent = 0
+    for batch_id in task_ids['batches']:
+        batch_result = celery.result.AsyncResult(id=batch_id)
+        # (Only counts batches that have finished, as batches record their
+        # progress in mailout_progress rather than the result backend)
+        info = batch_result.result
+        if isinstance(info, dict):
+            sent += info.get('sent', 0)
+    progress = int((100.0 * sent) / task_ids['total']) if task_ids['total'] else 0
+    return 'PROGRESS{0:03}'.format(progress), None
+
+
 @permission_required('toolkit.write')
 @require_GET
 def mailout_progress(request):
-    async_result = celery.result.AsyncResult(id=request.GET['task_id'])
-    state = async_result.state
+    task_id = request.GET['task_id']
+    try:
+        last_progress = int(request.GET['progress'])
+    except (KeyError, ValueError):
+        last_progress = None
+
+    stored_state = _stored_mailout_state(task_id, last_progress)
+    if stored_state:
+        state, result, changed = stored_state
+        if not changed:
+            # Nothing's happened for a while, so check that the worker
+            # running send_mailout didn't die before it could record anything
+            # (which would leave the progress stuck):
+            async_result = celery.result.AsyncResult(id=task_id)
+            if async_result.state == "FAILURE":
+                state, result = async_result.state, async_result.result
+    else:
+        # Not in the progress store (e.g. it's been cleared), so fall back to
+        # the celery result backend:
+        async_result = celery.result.AsyncResult(id=task_id)
+        state = async_result.state
+        result = async_result.result
+        if state == "SUCCESS" and isinstance(result, dict):
+            # Mailout was split into batches, which are still being sent:
+            state, result = _batched_mailout_state(result)
     progress = 0
     complete = False
     # Following values are set if complete:
@@ -130,10 +214,10 @@ def mailout_progress(request):
         elif state == "SUCCESS":
             progress = 100
             complete = True
-            if (async_result.result
-                    and isinstance(async_result.result, tuple)
-                    and len(async_result.result) == 3):
-                error, sent_count, error_msg = async_result.result
+            if (result
+                    and isinstance(result, (tuple, list))
+                    and len(result) == 3):
+                error, sent_count, error_msg = result
             else:
                 error = True
                 sent_count = 0
@@ -141,8 +225,8 @@ def mailout_progress(request):
         elif state == "FAILURE":
             complete = True
             error = True
-            if async_result.result:
-                error_msg = unicode(async_result.result)
+            if result:
+                error_msg = unicode(result)
             else:
                 error_msg = "Failed: Unknown error"
         elif state == "PENDING":
@@ -152,7 +236,7 @@ def mailout_progress(request):
 
     return HttpResponse(
         json.dumps({
-            'task_id': async_result.task_id,
+            'task_id': task_id,
             'complete': complete,
             'progress': progress,
             'error': error,
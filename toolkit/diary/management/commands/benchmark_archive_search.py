@@ -0,0 +1,64 @@
+import timeit
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from toolkit.diary.models import Showing
+import toolkit.diary.search as search
+
+
+class Command(BaseCommand):
+    args = '<search term> [<search term> ...]'
+    help = ('Compare the time taken to search the archive using the search '
+            'index with the old "icontains" search')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--descriptions',
+                    action='store_true',
+                    dest='descriptions',
+                    default=False,
+                    help='Also search event descriptions (copy)'),
+        make_option('--repeat',
+                    type='int',
+                    dest='repeat',
+                    default=10,
+                    help='Number of times to run each search (default 10)'),
+    )
+
+    requires_model_validation = True
+
+    def _icontains_search(self, term, descriptions):
+        showings = Showing.objects.public().select_related()
+        if descriptions:
+            showings = showings.filter(Q(event__name__icontains=term) | Q(event__copy__icontains=term))
+        else:
+            showings = showings.filter(event__name__icontains=term)
+        # (Evaluate the queryset)
+        return len(showings)
+
+    def _index_search(self, term, descriptions):
+        event_scores = search.search_events(term, descriptions)
+        if event_scores is None:
+            return 0
+        results = search.RankedShowings(Showing.objects.public(), event_scores)
+        # Load a page's worth of results, as the view does:
+        results[:50]
+        return len(results)
+
+    def _time(self, func, term, descriptions, repeat):
+        results = func(term, descriptions)
+        seconds = min(timeit.repeat(lambda: func(term, descriptions), number=1, repeat=repeat))
+        return results, seconds
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError("No search terms supplied")
+
+        for term in args:
+            term = term.decode('utf-8')
+            for name, func in (("icontains", self._icontains_search),
+                               ("index", self._index_search)):
+                results, seconds = self._time(func, term, options['descriptions'], options['repeat'])
+                self.stdout.write(u"{0:>10}: '{1}': {2} results, best of {3}: {4:.2f}ms".format(
+                    name, term, results, options['repeat'], seconds * 1000))
@@ -0,0 +1,74 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from easy_thumbnails.files import get_thumbnailer
+
+from toolkit.diary.models import MediaItem
+import toolkit.util.media_store as media_store
+import toolkit.util.thumbnail_queue as thumbnail_queue
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Move media item files that were uploaded before they were '
+            'stored by content hash over to content-addressed names, so that '
+            'media items with the same content share one file, and delete '
+            'the old copies')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help="Report what would be done, but don't change anything"),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+        dry_run = options['dry_run']
+        storage = MediaItem._meta.get_field('media_file').storage
+
+        moved = 0
+        old_names = set()
+        items = (MediaItem.objects.exclude(media_file='')
+                                  .exclude(media_file=None)
+                                  .order_by('pk'))
+        for item in items:
+            old_name = item.media_file.name
+            if media_store.hash_from_name(old_name):
+                continue
+            try:
+                digest = media_store.content_hash(item.media_file)
+            except (IOError, OSError) as err:
+                self.stderr.write(u"Skipping {0}: {1}".format(item, err))
+                continue
+            item.media_file.close()
+            new_name = item.media_file.field.generate_filename(
+                item, media_store.content_name(digest, old_name))
+
+            self.stdout.write(u"{0} -> {1}".format(old_name, new_name))
+            moved += 1
+            old_names.add(old_name)
+            if dry_run:
+                continue
+
+            if not storage.exists(new_name):
+                with storage.open(old_name) as old_file:
+                    storage.save(new_name, old_file)
+            item.media_file.name = new_name
+            item.save()
+            thumbnail_queue.queue_aliases(item.media_file)
+
+        deleted = 0
+        for old_name in sorted(old_names):
+            if dry_run or MediaItem.objects.filter(media_file=old_name).exists():
+                continue
+            get_thumbnailer(MediaItem(media_file=old_name).media_file).delete_thumbnails()
+            storage.delete(old_name)
+            deleted += 1
+
+        self.stdout.write(u"Done ({0} files moved, {1} old files deleted)".format(moved, deleted))
@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+import toolkit.diary.fragment_cache as fragment_cache
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Show hit/miss counts for the cached event details on the programme pages'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--reset',
+                    action='store_true',
+                    dest='reset',
+                    default=False,
+                    help='Reset the counts to zero after showing them'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+
+        if not settings.EVENT_FRAGMENT_CACHE_STATS:
+            self.stdout.write("Not counting (settings.EVENT_FRAGMENT_CACHE_STATS is off)")
+
+        stats = fragment_cache.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = (100.0 * stats['hits'] / total) if total else 0.0
+        self.stdout.write("Hits: {0}  Misses: {1}  Hit rate: {2:.1f}%".format(
+            stats['hits'], stats['misses'], ratio))
+
+        if options['reset']:
+            fragment_cache.reset_stats()
+            self.stdout.write("Counts reset")
@@ -0,0 +1,43 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from toolkit.diary.models import Event
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Generate the stored HTML and plain text renderings of event copy '
+            'for events that don\'t have them (or for all events, with --all)')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+                    action='store_true',
+                    dest='all',
+                    default=False,
+                    help='Re-render copy for all events, not just those with no stored rendering'),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+
+        events = Event.objects.all()
+        if not options['all']:
+            events = events.filter(rendered_copy_html__isnull=True)
+
+        self.stdout.write("Rendering copy for {0} events".format(events.count()))
+
+        count = 0
+        for event in events.iterator():
+            event.render_copy()
+            # Use update() rather than save(), so that the event's updated_at
+            # time isn't changed (and nothing else is touched):
+            Event.objects.filter(pk=event.pk).update(
+                rendered_copy_html=event.rendered_copy_html,
+                rendered_copy_plaintext=event.rendered_copy_plaintext)
+            count += 1
+
+        self.stdout.write("Done ({0} events)".format(count))
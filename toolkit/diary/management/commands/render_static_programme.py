@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+import toolkit.diary.static_programme as static_programme
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Render the public programme to static files in '
+            'settings.STATIC_PROGRAMME_ROOT, for Apache to serve directly')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--current',
+                    action='store_true',
+                    dest='current',
+                    default=False,
+                    help=('Only render pages that change with the date (the '
+                          'default view, this/next month, tags, RSS...), as '
+                          'celerybeat does daily')),
+    )
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+        if not static_programme.enabled():
+            raise CommandError("settings.STATIC_PROGRAMME_ROOT is not set")
+
+        if options['current']:
+            paths = static_programme.current_paths()
+        else:
+            paths = static_programme.all_paths()
+
+        self.stdout.write("Rendering {0} pages to {1}".format(
+            len(paths), settings.STATIC_PROGRAMME_ROOT))
+        written = static_programme.render_pages(paths)
+        self.stdout.write("Done ({0} pages written)".format(written))
@@ -12,6 +12,7 @@ import django.core.exceptions
 from django.utils.safestring import mark_safe
 from django.db.models.query import QuerySet
 from django.utils.text import slugify
+import django.dispatch
 
 from south.modelsinspector import add_introspection_rules
 
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 
 from toolkit.diary.validators import validate_in_future
 import toolkit.util.image as imagetools
+import toolkit.util.media_store as media_store
 
 
 class FutureDateTimeField(models.DateTimeField):
@@ -33,6 +35,11 @@ class FutureDateTimeField(models.DateTimeField):
 # anything special when creating/applying database migrations:
 add_introspection_rules([], [r"^toolkit\.diary\.models\.FutureDateTimeField"])
 
+# Sent (with sender=Showing) after showings have been created with
+# Event.add_showings, as the bulk insert doesn't send post_save for each one.
+# "showings" is the list of new showings:
+showings_bulk_created = django.dispatch.Signal(providing_args=['showings'])
+
 
 class Role(models.Model):
     name = models.CharField(max_length=64, unique=True)
@@ -56,16 +63,23 @@ class Role(models.Model):
         # read only roles
         self._original_name = self.name
 
+    # (These are also used by util.bulk_formset, which bypasses save/delete)
+    def save_allowed(self):
+        return not (self.read_only and self._original_name != self.name)
+
+    def delete_allowed(self):
+        # Don't allow read_only roles to be deleted
+        return not (self.pk and self.read_only)
+
     def save(self, *args, **kwargs):
-        if self.read_only and self._original_name != self.name:
+        if not self.save_allowed():
             logger.error(u"Tried to edit read-only role {0}".format(self.name))
             return
         else:
             return super(Role, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Don't allow read_only roles to be deleted
-        if self.pk and self.read_only:
+        if not self.delete_allowed():
             logger.error(u"Tried to delete read-only role {0}".format(self.name))
             return False
         else:
@@ -78,6 +92,9 @@ class MediaItem(models.Model):
 
     media_file = models.FileField(upload_to="diary", max_length=256, null=True, blank=True, verbose_name='Image file')
     mimetype = models.CharField(max_length=64, editable=False)
+    # SHA-1 of the file's content (see toolkit.util.media_store):
+    content_hash = models.CharField(max_length=40, blank=True, default='',
+                                    editable=False, db_index=True)
 
     credit = models.CharField(max_length=256, null=True, blank=True,
                               default="Internet scavenged", verbose_name='Image credit')
@@ -89,17 +106,49 @@ class MediaItem(models.Model):
     def __unicode__(self):
         return u"{0}: {1}".format(self.pk, self.media_file)
 
-    # Overloaded Django ORM method:
+    # Overloaded Django ORM methods:
+
+    def __init__(self, *args, **kwargs):
+        super(MediaItem, self).__init__(*args, **kwargs)
+        # Store current file name so that, at save, changes can be detected:
+        self.__original_file_name = self.media_file.name
 
     def save(self, *args, **kwargs):
-        # Before saving, update mimetype field:
-        # (do this even if file name has stayed the same, as file may have been
-        # overwritten)
-        self.autoset_mimetype()
+        # Before saving, update the content hash and, if the content has
+        # changed, the mimetype field. New uploads are stored under their
+        # content hash (or not stored at all, if that content has been
+        # uploaded before):
+        if self._update_content_hash():
+            self.autoset_mimetype()
 
-        return super(MediaItem, self).save(*args, **kwargs)
+        result = super(MediaItem, self).save(*args, **kwargs)
+        self.__original_file_name = self.media_file.name
+        return result
 
     # Extra, custom methods:
+    def _update_content_hash(self):
+        # Set content_hash for the current file, returning True if it's
+        # changed (or couldn't be worked out)
+        old_hash = self.content_hash
+        if not self.media_file:
+            self.content_hash = u""
+        elif not self.media_file._committed:
+            self.content_hash = media_store.content_hash(self.media_file.file)
+            media_store.use_content_name(self.media_file, self.content_hash)
+        else:
+            digest = media_store.hash_from_name(self.media_file.name)
+            if digest is None:
+                if self.content_hash and self.media_file.name == self.__original_file_name:
+                    # Same file as last time; files aren't overwritten
+                    return False
+                try:
+                    digest = media_store.content_hash(self.media_file)
+                except (IOError, OSError, ValueError):
+                    logger.error(u"Failed reading file {0}".format(self.media_file.name))
+                    digest = u""
+            self.content_hash = digest
+        return not self.content_hash or self.content_hash != old_hash
+
     def autoset_mimetype(self):
         # See lib/python2.7/site-packages/django/forms/fields.py for how to do
         # basic validation of PNGs / JPEGs
@@ -130,20 +179,51 @@ class EventTag(models.Model):
         # Generate slug:
         self.slug = slugify(self.name)
 
+    # (Also used by util.bulk_formset, which bypasses save/delete)
+    def save_allowed(self):
+        return not (self.pk and self.read_only)
+
+    delete_allowed = save_allowed
+
     # Overloaded Django ORM methods:
     def save(self, *args, **kwargs):
-        if self.pk and self.read_only:
+        if not self.save_allowed():
             return False
         else:
             return super(EventTag, self).save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        if self.pk and self.read_only:
+        if not self.delete_allowed():
             return False
         else:
             return super(EventTag, self).delete(*args, **kwargs)
 
 
+class EventQuerySet(QuerySet):
+    """
+    Custom methods for selecting sets of Events
+    """
+    def with_main_mediaitem(self):
+        """Load the media for all the events in one query, so that
+        Event.get_main_mediaitem doesn't need a query per event"""
+        return self.prefetch_related('media')
+
+
+class EventManager(models.Manager):
+    """
+    Glue class to allow the EventQuerySet to be transparently used with the
+    Event model
+    """
+    def get_query_set(self):
+        return EventQuerySet(self.model, using=self._db)
+
+    def __getattr__(self, name):
+        try:
+            return getattr(self.__class__, name)
+        except AttributeError:
+            return getattr(self.get_query_set(), name)
+
+
 class Event(models.Model):
 
     name = models.CharField(max_length=256, blank=False)
@@ -170,22 +250,109 @@ class Event(models.Model):
     # display, regex will be applied to turn http://.* into links, etc.
     legacy_copy = models.BooleanField(default=False, null=False, editable=False)
 
+    # Cached renderings of the copy (see copy_html and copy_plaintext, below)
+    # These are regenerated when the event is saved with changed copy, and
+    # can be (re)generated for existing events with the render_event_copy
+    # management command:
+    rendered_copy_html = models.TextField(null=True, editable=False)
+    rendered_copy_plaintext = models.TextField(null=True, editable=False)
+
     terms = models.TextField(max_length=4096, default=settings.DEFAULT_TERMS_TEXT, null=True, blank=True)
     notes = models.TextField(max_length=4096, null=True, blank=True, verbose_name="Programmer's notes")
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Custom manager, with some extra methods:
+    objects = EventManager()
+
     class Meta:
         db_table = 'Events'
 
     def __unicode__(self):
         return u"{0} ({1})".format(self.name, self.id)
 
+    def __init__(self, *args, **kwargs):
+        super(Event, self).__init__(*args, **kwargs)
+        # Store original copy, so can tell if the rendered copy is out of date.
+        # (If the copy is deferred then don't load it just for this; the
+        # rendered copy is then always treated as out of date)
+        if 'copy' in self.__dict__ and 'legacy_copy' in self.__dict__:
+            self._original_copy = (self.copy, self.legacy_copy)
+        else:
+            self._original_copy = None
+        # Likewise for private, as the showings' is_public flag depends on it:
+        self._original_private = self.__dict__.get('private')
+
+    def save(self, *args, **kwargs):
+        if self._copy_changed() or self.rendered_copy_html is None:
+            self.render_copy()
+        result = super(Event, self).save(*args, **kwargs)
+        self._original_copy = (self.copy, self.legacy_copy)
+        if self._original_private != self.private:
+            self.showings.update_is_public()
+            self._original_private = self.private
+        return result
+
     def reset_tags_to_default(self):
         if self.template:
-            for tag in self.template.tags.all():
-                self.tags.add(tag)
+            self.tags.add(*self.template.tags.all())
+
+    def add_showings(self, starts, copy_from=None, **kwargs):
+        """Create a showing of this (saved) event at each of the given start
+        times. If copy_from (a Showing of this event) is given then the new
+        showings' details and rota are copied from it, otherwise they each
+        get the default rota for the event's template. Any keyword args are
+        used as attributes of the new showings. The start times must all be
+        different.
+
+        The showings and rota entries are created with bulk inserts, so the
+        number of queries doesn't depend on the number of showings. (This
+        doesn't start a transaction, so should be called in one). Returns
+        list of the new showings."""
+        if copy_from is not None:
+            attributes = copy_from.get_copied_attributes()
+            attributes.update(kwargs)
+            kwargs = attributes
+        starts = list(starts)
+        if len(set(starts)) != len(starts):
+            # (The new showings' ids are matched up by start time, below)
+            logger.error(u"Tried to add more than one showing of event {0} with the same start time".format(self.pk))
+            raise django.db.IntegrityError("Can't add more than one showing with the same start time")
+        showings = [Showing(event=self, start=start, **kwargs) for start in starts]
+        for showing in showings:
+            if showing.in_past():
+                logger.error(u"Tried to add showing of event {0} with start time {1} in the past".format(self.pk, showing.start))
+                raise django.db.IntegrityError("Can't add showings that start in the past")
+            showing.set_is_public(self.private)
+        if not showings:
+            return showings
+
+        # bulk_create doesn't set the ids of the new showings, so read them
+        # back, ignoring any showings that already existed at the same times:
+        starts = [showing.start for showing in showings]
+        existing_ids = set(self.showings.filter(start__in=starts).values_list('id', flat=True))
+        Showing.objects.bulk_create(showings)
+        new_ids = dict((start, showing_id) for showing_id, start in
+                       self.showings.filter(start__in=starts)
+                                    .exclude(id__in=existing_ids)
+                                    .values_list('id', 'start'))
+        for showing in showings:
+            showing.pk = new_ids[showing.start]
+
+        if copy_from is not None:
+            source_entries = list(copy_from.rotaentry_set.all())
+            RotaEntry.objects.bulk_create([
+                RotaEntry(showing=showing, role_id=entry.role_id,
+                          required=entry.required, rank=entry.rank)
+                for showing in showings for entry in source_entries])
+        elif self.template is not None:
+            roles = list(self.template.roles.all())
+            RotaEntry.objects.bulk_create([RotaEntry(role=role, showing=showing)
+                                           for showing in showings for role in roles])
+
+        showings_bulk_created.send(sender=Showing, showings=showings)
+        return showings
 
     def delete(self, *args, **kwargs):
         # Don't allow Events to be deleted. This doesn't block deletes on
@@ -194,11 +361,12 @@ class Event(models.Model):
 
     # Extra, custom methods:
     def clear_main_mediaitem(self):
-        if self.media.count() == 0:
+        media_item = self.get_main_mediaitem()
+        if media_item is None:
             return
-        media_item = self.media.all()[0]
         logger.info(u"Removing media file {0} from event {1}".format(media_item, self.pk))
         self.media.remove(media_item)
+        self._forget_media()
         ## If the media item isn't associated with any events, delete it:
         ## ACTUALLY: let's keep it. Disk space is cheap, etc.
         # if media_item.event_set.count() == 0:
@@ -208,11 +376,24 @@ class Event(models.Model):
         self.clear_main_mediaitem()
         logger.info(u"Adding media file {0} to event {1}".format(media_file, self.pk))
         self.media.add(media_file)
+        self._forget_media()
 
     def get_main_mediaitem(self):
-        if self.media.count() == 0:
-            return None
-        return self.media.all()[0]
+        # If the media have been loaded by prefetch_related (e.g. by
+        # EventQuerySet.with_main_mediaitem) then self.media.all() uses them
+        # and this doesn't need a query. Either way, the result is kept for
+        # subsequent calls.
+        if not hasattr(self, '_main_mediaitem'):
+            media = list(self.media.all()[:1])
+            self._main_mediaitem = media[0] if media else None
+        return self._main_mediaitem
+
+    def _forget_media(self):
+        # Throw away any media loaded by get_main_mediaitem / prefetch_related
+        # after the media have been changed:
+        if hasattr(self, '_main_mediaitem'):
+            del self._main_mediaitem
+        getattr(self, '_prefetched_objects_cache', {}).pop('media', None)
 
     # Regular expressions for mangling legacy copy:
     _wrap_re = re.compile(r'(.{70,})\n')
@@ -223,18 +404,40 @@ class Event(models.Model):
     # a smattering of TLDs:
     _link_re_2 = re.compile(r'(\s)(www\.[\w.]+\.(com|org|net|uk|de|ly|us|tk)[^\t\n\r\f\v\. ]*)')
 
+    def _copy_changed(self):
+        return self._original_copy != (self.copy, self.legacy_copy)
+
+    def render_copy(self):
+        """(Re)generate rendered_copy_html and rendered_copy_plaintext from
+        the current copy. Doesn't save the event."""
+        self.rendered_copy_html = self._render_copy_html()
+        self.rendered_copy_plaintext = self._render_copy_plaintext()
+
     @property
     def copy_html(self):
         """If self.legacy_copy == True, then try to mangle self.copy into
         sane HTML fragment. Otherwise return self.copy
         (Legacy cube copy has line breaks around the 70-80 character mark, and no
         hyperlinks)"""
+        if self.rendered_copy_html is None or self._copy_changed():
+            return mark_safe(self._render_copy_html())
+        return mark_safe(self.rendered_copy_html)
+
+    @property
+    def copy_plaintext(self):
+        """Return copy suitable for text only use (i.e. member's mailout)"""
+        if self.rendered_copy_plaintext is None or self._copy_changed():
+            return mark_safe(self._render_copy_plaintext())
+        return mark_safe(self.rendered_copy_plaintext)
+
+    def _render_copy_html(self):
+        copy = self.copy or u""
 
         if not self.legacy_copy:
-            return mark_safe(self.copy)
+            return copy
         else:
             # remove all whitespace from start and end of line:
-            result = self.copy.strip()
+            result = copy.strip()
             # Strip out carriage returns:
 
             result = result.strip().replace('\r', '')
@@ -250,40 +453,62 @@ class Event(models.Model):
             result = self._link_re_1.sub(r'<a href="\1">\1</a>', result)
             result = self._link_re_2.sub(r'\1<a href="http://\2">\2</a>', result)
 
-            return mark_safe(result)
+            return result
 
     # This RE needs to be compiled so that the flags can be specified, as the
     # flags option to re.sub() wasn't added until python 2.7
     _plaintext_re = re.compile(ur'\[(.*?)\]\((https?://.*?)\)', flags=re.DOTALL)
 
-    @property
-    def copy_plaintext(self):
-        """Return copy suitable for text only use (i.e. member's mailout)"""
+    def _render_copy_plaintext(self):
+        copy = self.copy or u""
 
         if self.legacy_copy:
             # Don't do a general HTML conversion, but convert any entities to
             # unicode:
-            text = HTMLParser.HTMLParser().unescape(self.copy)
+            text = HTMLParser.HTMLParser().unescape(copy)
         else:
             # Use html2text library to do a quick and happy conversion to
             # plain text; http://www.aaronsw.com/2002/html2text/
-            # Now let's set some options for html2text ...
-
+            # Options are set on a converter instance, rather than on the
+            # html2text module globals, so that this is thread safe:
+            converter = html2text.HTML2Text()
             # 0 for no wrapping - let the email clients do the wrapping:
-            html2text.BODY_WIDTH = 0
+            converter.body_width = 0
             # Don't try to substitute ASCII characters for unicode ones:
-            html2text.UNICODE_SNOB = True
+            converter.unicode_snob = True
             # **Bold** and _italics_ doesn't look great in members mailout, so don't do it
-            html2text.IGNORE_EMPHASIS = True
+            converter.ignore_emphasis = True
 
             # TODO Make email links render to orchestra@orchestra.cubecinema.com
             # rather than [orchestra@orchestra.cubecinema.com](mailto:orchestra@orchestra.cubecinema.com)
 
-            text = html2text.html2text(self.copy)
+            text = converter.handle(copy)
             # Convert links from markdown format to just the URL:
             text = self._plaintext_re.sub(ur'\1: \2', text)
 
-        return mark_safe(text)
+        return text
+
+
+class EventSearchTerm(models.Model):
+    """An entry in the index used by the archive search; see
+    toolkit.diary.search"""
+
+    NAME = 'name'
+    TAG = 'tag'
+    COPY = 'copy'
+
+    event = models.ForeignKey(Event, related_name='search_terms')
+    term = models.CharField(max_length=32, db_index=True)
+    # Which part of the event the term came from:
+    field = models.CharField(max_length=4, choices=((NAME, 'Name'), (TAG, 'Tag'), (COPY, 'Copy')))
+    # Relevance of the term to the event (higher is more relevant)
+    weight = models.IntegerField()
+
+    class Meta:
+        db_table = 'EventSearchTerms'
+
+    def __unicode__(self):
+        return u"{0} ({1}, event {2})".format(self.term, self.field, self.event_id)
 
 
 class ShowingQuerySet(QuerySet):
@@ -298,11 +523,11 @@ class ShowingQuerySet(QuerySet):
     def public(self):
         """
         Filters so only showings that should be visible to the general public
-        are included. (ie. exclude unconfirmed, hidden in programme)
+        are included. (ie. exclude unconfirmed, hidden in programme, private
+        events)
         """
-        return (self.filter(event__private=False)
-                    .filter(confirmed=True)
-                    .filter(hide_in_programme=False))
+        # See Showing.is_public
+        return self.filter(is_public=True)
 
     def not_cancelled(self):
         """Filter out cancelled showings"""
@@ -312,6 +537,13 @@ class ShowingQuerySet(QuerySet):
         """Filter out unconfirmed showings"""
         return self.filter(confirmed=True)
 
+    def update_is_public(self):
+        """Recalculate the is_public flag for all showings in the queryset,
+        (e.g. after their event has been made private) without loading them"""
+        self.update(is_public=False)
+        (self.filter(event__private=False, confirmed=True, hide_in_programme=False)
+             .update(is_public=True))
+
 
 class ShowingManager(models.Manager):
     """
@@ -344,6 +576,13 @@ class Showing(models.Model):
     cancelled = models.BooleanField(default=False)
     discounted = models.BooleanField(default=False)
 
+    # Denormalised flag that's True if the showing is confirmed, not hidden
+    # in the programme and its event isn't private, so that public listings
+    # (see ShowingQuerySet.public) don't need a join to the events table and
+    # can use the (is_public, start) index. This is set when the showing is
+    # saved, and when the event's private flag changes (see Event.save).
+    is_public = models.BooleanField(default=False, editable=False)
+
     # sales tables?
 
     # Rota entries
@@ -358,6 +597,7 @@ class Showing(models.Model):
     class Meta:
         db_table = 'Showings'
         ordering = ['start']
+        index_together = [['is_public', 'start']]
 
     def __init__(self, *args, **kwargs):
         # Allow "copy_from" and "start_offset" keyword args to be supplied.
@@ -380,13 +620,17 @@ class Showing(models.Model):
             logger.info(u"Cloning showing from existing showing (id {0})".format(copy_from.pk))
             # Manually copy fields, rather than using things from copy library,
             # as don't want to copy the rota (as that would make db writes)
-            attributes_to_copy = ('event', 'start', 'booked_by', 'extra_copy', 'confirmed',
-                                  'hide_in_programme', 'cancelled', 'discounted')
-            for attribute in attributes_to_copy:
-                setattr(self, attribute, getattr(copy_from, attribute))
+            self.event = copy_from.event
+            self.start = copy_from.start
+            for attribute, value in copy_from.get_copied_attributes().iteritems():
+                setattr(self, attribute, value)
             if start_offset:
                 self.start += start_offset
 
+        # Store original start time, so that if the showing is moved any cached
+        # data for the original date can be invalidated:
+        self._original_start = self.start
+
     def __unicode__(self):
         if self.start is not None and self.id is not None and self.event is not None:
             return u"{0} - {1} ({2})".format(self.start.strftime("%H:%M %Z%z %d/%m/%y"), self.event.name, self.id)
@@ -409,7 +653,10 @@ class Showing(models.Model):
             if self.in_past() and not force:
                 logger.error(u"Tried to update showing {0} with start time {1} in the past".format(self.pk, self.start))
                 raise django.db.IntegrityError("Can't update showings that start in the past")
-        return super(Showing, self).save(*args, **kwargs)
+        self.set_is_public()
+        result = super(Showing, self).save(*args, **kwargs)
+        self._original_start = self.start
+        return result
 
     def delete(self, *args, **kwargs):
         # Don't allow showings to be deleted if they're finished. This isn't a
@@ -431,23 +678,50 @@ class Showing(models.Model):
     def in_past(self):
         return self.start < django.utils.timezone.now()
 
+    def get_copied_attributes(self):
+        """Return dict of the attributes (other than event, start and rota)
+        that are copied to new showings cloned from this one"""
+        return dict((attribute, getattr(self, attribute)) for attribute in
+                    ('booked_by', 'extra_copy', 'confirmed', 'hide_in_programme',
+                     'cancelled', 'discounted'))
+
+    def set_is_public(self, event_private=None):
+        """Set the is_public flag from the other fields (doesn't save).
+        event_private is the event's private flag; if it isn't given it's
+        taken from the event, if that's already loaded, or else looked up
+        (only if it makes a difference)"""
+        if not self.confirmed or self.hide_in_programme:
+            self.is_public = False
+            return
+        if event_private is None:
+            event = getattr(self, '_event_cache', None)
+            if event is not None and event.pk == self.event_id:
+                event_private = event.private
+            else:
+                event_private = (Event.objects.filter(pk=self.event_id)
+                                              .values_list('private', flat=True)[0])
+        self.is_public = not event_private
+
     def reset_rota_to_default(self):
         """Clear any existing rota entries. If the associated event has an event
         type defined then apply the default set of rota entries for that type"""
-
-        # Delete all existing rota entries (if any)
-        self.rotaentry_set.all().delete()
-
+        new_entries = []
         if self.event.template is not None:
             # Add a rota entry for each role in the event type:
-            for role in self.event.template.roles.all():
-                RotaEntry(role=role, showing=self).save()
+            new_entries = [RotaEntry(role=role, showing=self)
+                           for role in self.event.template.roles.all()]
+        # Delete all existing rota entries (if any)
+        self._apply_rota_changes(None, new_entries)
 
     def clone_rota_from_showing(self, source_showing):
+        """Add a copy of each of source_showing's rota entries to this
+        (saved) showing"""
         assert self.pk is not None
-        for rota_entry in source_showing.rotaentry_set.all():
-            new_entry = RotaEntry(showing=self, template=rota_entry)
-            new_entry.save()
+        logger.info(u"Cloning rota from showing {0} to showing {1}".format(source_showing.pk, self.pk))
+        new_entries = [RotaEntry(showing=self, role_id=rota_entry.role_id,
+                                 required=rota_entry.required, rank=rota_entry.rank)
+                       for rota_entry in source_showing.rotaentry_set.all()]
+        self._apply_rota_changes([], new_entries)
 
     def update_rota(self, _rota):
         """Update rota from supplied dict. Dict should be a map of
@@ -455,35 +729,49 @@ class Showing(models.Model):
         If no. entries is 0, any existing RotaEntries are deleted. If it's
         greater than the number of RotaEntries, they'r added as required. If a
         role_id is not in the dict, then any RotaEntries aren't affected"""
-
-        # copy rota:
-        rota = dict(_rota)
-
+        existing = self.rotaentry_set.values_list('id', 'role_id', 'rank')
+        delete_ids, new_entries = self._plan_rota_update(existing, _rota)
+        self._apply_rota_changes(delete_ids, new_entries)
+
+    def _plan_rota_update(self, existing, rota):
+        """Work out the changes needed for update_rota, without touching the
+        database. existing should be an iterable of (id, role_id, rank)
+        tuples for the current rota entries. Returns tuple of (list of ids of
+        entries to delete, list of new (unsaved) RotaEntry objects)"""
         # Build map of rota entries by role id
-        rota_entries_by_id = {}
-        for rota_entry in self.rotaentry_set.select_related():
-            rota_entries_by_id.setdefault(rota_entry.role.pk, []).append(rota_entry)
+        entries_by_role = {}
+        for entry_id, role_id, rank in existing:
+            entries_by_role.setdefault(role_id, []).append((rank, entry_id))
 
+        delete_ids = []
+        new_entries = []
         for role_id, count in rota.iteritems():
-            # Number of existing rota entries for this role_id.
-            # Remove from dict, so anything left in the dict at the end
-            # is an error...
-            existing_entries = rota_entries_by_id.pop(role_id, [])
-            # delete highest ranked instances
-            while count < len(existing_entries):
-                logger.info(u"Removing role {0} from showing {1}".format(role_id, self.pk))
-                highest_ranked = max(existing_entries, key=lambda re: re.rank)
-                highest_ranked.delete()
-                existing_entries.remove(highest_ranked)
-            # add required entries
-            while count > len(existing_entries):
-                logger.info(u"Adding role {0} to showing {1}".format(role_id, self.pk))
-                # add rotaentries
-                new_re = RotaEntry(role_id=role_id, showing=self)
-                if len(existing_entries) > 0:
-                    new_re.rank = 1 + max(existing_entries, key=lambda re: re.rank).rank
-                new_re.save()
-                existing_entries.append(new_re)
+            # Lowest ranked first:
+            entries = sorted(entries_by_role.get(role_id, []))
+            if count < len(entries):
+                # delete highest ranked instances
+                logger.info(u"Removing {0} of role {1} from showing {2}".format(
+                    len(entries) - count, role_id, self.pk))
+                delete_ids.extend(entry_id for _, entry_id in entries[count:])
+            elif count > len(entries):
+                # add required entries, ranked after the existing ones
+                logger.info(u"Adding {0} of role {1} to showing {2}".format(
+                    count - len(entries), role_id, self.pk))
+                next_rank = entries[-1][0] + 1 if entries else 1
+                for rank in xrange(next_rank, next_rank + count - len(entries)):
+                    new_entries.append(RotaEntry(role_id=role_id, showing=self, rank=rank))
+        return delete_ids, new_entries
+
+    def _apply_rota_changes(self, delete_ids, new_entries):
+        """Delete the rota entries with the given ids (or all of them, if
+        delete_ids is None) and insert new_entries, with at most one query
+        for each"""
+        if delete_ids is None:
+            self.rotaentry_set.all().delete()
+        elif delete_ids:
+            self.rotaentry_set.filter(id__in=delete_ids).delete()
+        if new_entries:
+            RotaEntry.objects.bulk_create(new_entries)
 
 
 class DiaryIdea(models.Model):
@@ -590,3 +878,13 @@ class PrintedProgramme(models.Model):
                          " of the month")
             self.month = datetime.date(self.month.year, self.month.month, 1)
         return super(PrintedProgramme, self).save(*args, **kwargs)
+
+
+# Connect signal handlers that invalidate the cached programme pages, event
+# fragments and form choices, update the search index and re-render the static programme (at
+# the end of the file, as the handlers need the models defined above):
+import toolkit.diary.page_cache
+import toolkit.diary.fragment_cache
+import toolkit.diary.choice_cache
+import toolkit.diary.search
+import toolkit.diary.static_programme
@@ -0,0 +1,245 @@
+"""Cache for the rendered public programme pages (see public_views.view_diary)
+
+Rather than trying to track which cached pages need to be thrown away when
+something changes, each page is cached under a key that includes a "version"
+number for every calendar month covered by the page. Saving / deleting
+anything that appears in the programme bumps the version number for the
+month (or months) that it appears in, so any cached pages covering that month
+will never be looked up again (and will eventually be expired by the cache)
+while pages for other months are unaffected. The version numbers are only
+bumped once the change has been committed (see util.db.after_commit), so a
+request that arrives in between can't cache the old data under the new
+version.
+
+This works with any of the Django cache backends, but if there's more than one
+server process then the backend needs to be shared between them (i.e. not the
+local-memory cache) or processes will continue serving stale pages until the
+cache timeout.
+"""
+import time
+import hashlib
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+import django.utils.timezone as timezone
+
+from toolkit.diary.models import (Showing, Event, EventTag, MediaItem,
+                                  PrintedProgramme, showings_bulk_created)
+from toolkit.util.thumbnail_queue import thumbnails_generated
+from toolkit.util.db import after_commit
+
+logger = logging.getLogger(__name__)
+
+# Prefix used for all keys stored by this module:
+KEY_PREFIX = 'programme'
+
+# Version numbers are kept for longer than the pages, so a page can't outlive
+# the version number it was stored under:
+VERSION_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def _new_version():
+    # Used when there's no existing version stored for a key. Use a time
+    # based value (rather than 0 or 1) so that if a version number has been
+    # evicted from the cache the new number won't match any old pages.
+    return int(time.time())
+
+
+def _month_of(date):
+    """Return (year, month) tuple for the given date/datetime, in local time"""
+    if hasattr(date, 'tzinfo') and date.tzinfo is not None:
+        date = timezone.localtime(date)
+    return (date.year, date.month)
+
+
+def _months_in_range(start, end):
+    """Return list of (year, month) tuples for each month between the
+    given start and end dates (inclusive)"""
+    year, month = _month_of(start)
+    end_month = _month_of(end)
+    months = []
+    while (year, month) <= end_month:
+        months.append((year, month))
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+    return months
+
+
+def _version_key(name):
+    return u"{0}:version:{1}".format(KEY_PREFIX, name)
+
+
+def _month_version_key(month):
+    return _version_key(u"{0:04d}-{1:02d}".format(*month))
+
+
+# Version number that is part of the key for every page; bumping this
+# invalidates everything:
+ALL_VERSION_KEY = _version_key(u"all")
+# Version number that is part of the key for pages filtered by tag:
+TAGS_VERSION_KEY = _version_key(u"tags")
+
+
+def get_versions(keys):
+    """Return list of the current version numbers stored under the given
+    cache keys (also used by fragment_cache)"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            # Use add() so as not to overwrite a value set by a concurrent
+            # request, then read back whatever value won:
+            cache.add(key, _new_version(), VERSION_TIMEOUT)
+            versions[key] = cache.get(key, _new_version())
+    return [versions[key] for key in keys]
+
+
+def _bump_versions_now(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Key wasn't in the cache:
+            cache.set(key, _new_version(), VERSION_TIMEOUT)
+
+
+def bump_versions(keys):
+    """Bump the version numbers stored under the given cache keys (also used
+    by fragment_cache and choice_cache) once the current transaction has
+    committed. (If they were bumped straight away, a request arriving before
+    the commit would cache the old data under the new version)"""
+    keys = list(keys)
+    after_commit(lambda: _bump_versions_now(keys))
+
+
+def page_key(today, start, days_ahead, event_type):
+    """Return the cache key for the programme page showing days_ahead days
+    from start, optionally filtered by event_type (tag slug)"""
+    end = start + datetime.timedelta(days=days_ahead)
+    version_keys = [ALL_VERSION_KEY]
+    if event_type:
+        version_keys.append(TAGS_VERSION_KEY)
+    version_keys.extend(_month_version_key(m) for m in _months_in_range(start, end))
+
+    versions = get_versions(version_keys)
+
+    # Hash the parameters, as event_type is user supplied, and the list of
+    # versions can be long:
+    raw_key = u"{0}|{1}|{2}|{3}|{4}".format(
+        today.isoformat(), start.isoformat(), days_ahead, event_type or u"",
+        u",".join(str(v) for v in versions)
+    )
+    return u"{0}:page:{1}".format(
+        KEY_PREFIX, hashlib.md5(raw_key.encode("utf-8")).hexdigest())
+
+
+def get_page(key):
+    """Return cached page content for the given key, or None"""
+    return cache.get(key)
+
+
+def set_page(key, content):
+    cache.set(key, content, settings.PROGRAMME_CACHE_TIMEOUT)
+
+
+# Invalidation:
+
+def invalidate_dates(dates):
+    """Invalidate cached pages that include any of the given dates"""
+    months = set(_month_of(date) for date in dates if date is not None)
+    if months:
+        logger.debug(u"Invalidating programme cache for months {0}".format(sorted(months)))
+        bump_versions([_month_version_key(month) for month in months])
+
+
+def invalidate_events(event_ids):
+    """Invalidate cached pages that include showings of any of the given
+    events"""
+    if not event_ids:
+        return
+    invalidate_dates(Showing.objects.filter(event_id__in=event_ids)
+                                    .values_list('start', flat=True))
+
+
+def invalidate_all():
+    logger.debug(u"Invalidating entire programme cache")
+    bump_versions([ALL_VERSION_KEY])
+
+
+@receiver(post_save, sender=Showing)
+@receiver(post_delete, sender=Showing)
+def _showing_changed(sender, instance, **kwargs):
+    # If the showing has been moved then pages for the old date need to go:
+    invalidate_dates([instance.start, getattr(instance, '_original_start', None)])
+
+
+@receiver(showings_bulk_created, sender=Showing)
+def _showings_created(sender, showings, **kwargs):
+    invalidate_dates([showing.start for showing in showings])
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def _event_changed(sender, instance, **kwargs):
+    invalidate_events([instance.pk])
+
+
+@receiver(post_save, sender=MediaItem)
+def _mediaitem_changed(sender, instance, **kwargs):
+    invalidate_events(list(instance.event_set.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=MediaItem)
+def _mediaitem_deleting(sender, instance, **kwargs):
+    # (The links to the events are gone by the time post_delete is sent)
+    instance._page_cache_event_ids = list(instance.event_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=MediaItem)
+def _mediaitem_deleted(sender, instance, **kwargs):
+    invalidate_events(getattr(instance, '_page_cache_event_ids', ()))
+
+
+@receiver(thumbnails_generated)
+def _thumbnails_generated(sender, source_name, **kwargs):
+    # Pages showing the placeholder image instead need to go:
+    invalidate_events(list(Event.objects.filter(media__media_file=source_name)
+                                        .values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=EventTag)
+@receiver(post_delete, sender=EventTag)
+def _tag_changed(sender, instance, **kwargs):
+    # Tags only affect which showings are included on the pages filtered by
+    # tag (they're not displayed anywhere)
+    bump_versions([TAGS_VERSION_KEY])
+
+
+@receiver(m2m_changed, sender=Event.tags.through)
+@receiver(m2m_changed, sender=Event.media.through)
+def _event_relation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if sender is Event.tags.through:
+        bump_versions([TAGS_VERSION_KEY])
+        # (Otherwise the tags aren't shown on the page)
+        return
+    if not reverse:
+        invalidate_events([instance.pk])
+    elif pk_set:
+        invalidate_events(list(pk_set))
+    else:
+        # A clear() from the MediaItem end; don't know which events were
+        # affected:
+        invalidate_all()
+
+
+@receiver(post_save, sender=PrintedProgramme)
+@receiver(post_delete, sender=PrintedProgramme)
+def _printed_programme_changed(sender, instance, **kwargs):
+    invalidate_dates([instance.month])
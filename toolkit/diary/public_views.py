@@ -12,17 +12,31 @@ from django.conf import settings
 from django.utils.safestring import mark_for_escaping
 import django.utils.timezone as timezone
 import django.views.generic as generic
-
-from easy_thumbnails.files import get_thumbnailer
+from django.utils.decorators import method_decorator
 
 from toolkit.diary.models import Showing, Event, PrintedProgramme
 from toolkit.diary.daterange import get_date_range
 from toolkit.diary.forms import SearchForm
+import toolkit.diary.page_cache as page_cache
+import toolkit.diary.fragment_cache as fragment_cache
+import toolkit.diary.search as search
+from toolkit.diary.conditional_get import (conditional, programme_fingerprint,
+                                           event_fingerprint,
+                                           archive_fingerprint)
+import toolkit.util.image as imagetools
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# easy_thumbnails options for the images in view_diary_json:
+JSON_THUMBNAIL_OPTIONS = {
+    'size': (0, 200),
+    'crop': 'scale',
+    'upscale': True,
+}
+
 
+@conditional(programme_fingerprint)
 def view_diary(request, year=None, month=None, day=None, event_type=None):
     # Returns public diary view, starting at specified year/month/day, filtered
     # by event type.
@@ -44,10 +58,18 @@ def view_diary(request, year=None, month=None, day=None, event_type=None):
     if startdate is None:
         raise Http404(days_ahead)
     enddate = startdate + datetime.timedelta(days=days_ahead)
+    today = datetime.date.today()
+
+    # Rendered pages are cached; the cache is invalidated when anything that
+    # appears on the page is changed (see page_cache.py)
+    cache_key = page_cache.page_key(today, startdate, days_ahead, event_type)
+    cached_content = page_cache.get_page(cache_key)
+    if cached_content is not None:
+        return HttpResponse(cached_content)
 
     # Start getting together data to send to the template...
 
-    context['today'] = datetime.date.today()
+    context['today'] = today
     context['start'] = startdate
     context['end'] = enddate
 
@@ -83,6 +105,9 @@ def view_diary(request, year=None, month=None, day=None, event_type=None):
 
     context['showings'] = showings  # Set of Showing objects for date range
     context['events'] = events  # Ordered dict mapping event -> list of showings
+    # Look up the versions of the cached event details in one go (see
+    # fragment_cache.py):
+    fragment_cache.load_versions(events.iterkeys())
     # This is prepended to filepaths from the MediaPaths table to use
     # as a location for images:
     context['media_url'] = settings.MEDIA_URL
@@ -90,7 +115,9 @@ def view_diary(request, year=None, month=None, day=None, event_type=None):
     context['printed_programmes'] = PrintedProgramme.objects.month_in_range(
         startdate, enddate)
 
-    return render(request, 'view_showing_index.html', context)
+    response = render(request, 'view_showing_index.html', context)
+    page_cache.set_page(cache_key, response.content)
+    return response
 
 
 def view_diary_json(request, year, month, day):
@@ -119,29 +146,36 @@ def view_diary_json(request, year, month, day):
     context['start'] = startdatetime
 
     # Do query. select_related() on the end encourages it to get the
-    # associated showing/event data, to reduce the number of SQL queries
-    showings = (Showing.objects.public()
-                               .start_in_range(startdatetime, enddatetime)
-                               .order_by('start')
-                               .select_related()
-                               .prefetch_related('event__media'))
+    # associated showing/event data, and the prefetch_related gets all the
+    # media and tags in one query each, so the number of SQL queries doesn't
+    # depend on the number of showings:
+    showings = list(Showing.objects.public()
+                                   .start_in_range(startdatetime, enddatetime)
+                                   .order_by('start')
+                                   .select_related()
+                                   .prefetch_related('event__media', 'event__tags'))
+
+    # Find the main media item for each event (using the prefetched data) and
+    # then look up the thumbnails for all of them in one go (leaving out any
+    # that haven't been generated yet, rather than generating them here):
+    media_items = {}
+    for showing in showings:
+        media_items[showing.event_id] = showing.event.get_main_mediaitem()
+    thumbnails = imagetools.get_thumbnail_urls(
+        (item.media_file for item in media_items.itervalues() if item),
+        JSON_THUMBNAIL_OPTIONS,
+        generate=False
+    )
+
     results = []
     # Build list of factoids to send back
     for showing in showings:
         event = showing.event
 
         thumbnail = None
-        media_item = event.get_main_mediaitem()
+        media_item = media_items[event.pk]
         if media_item:
-            try:
-                thumbnailer = get_thumbnailer(media_item.media_file)
-                thumbnail = thumbnailer.get_thumbnail({
-                    'size': (0, 200),
-                    'crop': 'scale',
-                    'upscale': True,
-                }).url
-            except Exception:
-                logger.exception("Failed getting thumbnail for event {0}".format(event))
+            thumbnail = thumbnails.get(media_item.media_file.name)
 
         results.append({
             'start': timezone.localtime(showing.start).strftime('%d/%m/%Y %H:%M'),
@@ -149,7 +183,7 @@ def view_diary_json(request, year, month, day):
             'copy': event.copy_html,
             'link': reverse("single-event-view", kwargs={'event_id': showing.event_id}),
             'image': thumbnail,
-            'tags': ", ".join(n[0] for n in event.tags.values_list('name')),
+            'tags': ", ".join(tag.name for tag in event.tags.all()),
         })
 
     return HttpResponse(json.dumps(results), mimetype="application/json")
@@ -167,14 +201,16 @@ def view_showing(request, showing_id=None):
     return view_event(request, event_id=showings[0].event_id)
 
 
+@conditional(event_fingerprint)
 def view_event(request, event_id=None, legacy_id=None):
     # Show details of an individual event, with given event_id. Also allows
     # lookup by 'legacy_id', the non-primary key id used in the old toolkit.
     context = {}
+    events = Event.objects.with_main_mediaitem()
     if event_id:
-        event = get_object_or_404(Event, id=event_id)
+        event = get_object_or_404(events, id=event_id)
     else:
-        event = get_object_or_404(Event, legacy_id=legacy_id)
+        event = get_object_or_404(events, legacy_id=legacy_id)
 
     media = event.get_main_mediaitem()
     showings = event.showings.public()
@@ -191,7 +227,15 @@ def view_event(request, event_id=None, legacy_id=None):
     return render(request, 'view_event.html', context)
 
 
-class ArchiveIndex(generic.ArchiveIndexView):
+class ConditionalArchiveMixin(object):
+    """Enable conditional GET (i.e. 304 responses) for the archive views"""
+
+    @method_decorator(conditional(archive_fingerprint))
+    def dispatch(self, request, *args, **kwargs):
+        return super(ConditionalArchiveMixin, self).dispatch(request, *args, **kwargs)
+
+
+class ArchiveIndex(ConditionalArchiveMixin, generic.ArchiveIndexView):
     # Limit to public events
     queryset = Showing.objects.public().select_related()
 
@@ -199,7 +243,7 @@ class ArchiveIndex(generic.ArchiveIndexView):
     template_name = 'showing_archive.html'
 
 
-class ArchiveYear(generic.YearArchiveView):
+class ArchiveYear(ConditionalArchiveMixin, generic.YearArchiveView):
     # Limit to public events (select_related heavily reduces query count)
     queryset = Showing.objects.public().select_related()
 
@@ -212,7 +256,7 @@ class ArchiveYear(generic.YearArchiveView):
         return super(ArchiveYear, self).get_dated_queryset(*args, **kwargs)
 
 
-class ArchiveMonth(generic.MonthArchiveView):
+class ArchiveMonth(ConditionalArchiveMixin, generic.MonthArchiveView):
     # Limit to public events (select_related heavily reduces query count)
     queryset = Showing.objects.public().select_related()
 
@@ -230,6 +274,8 @@ class ArchiveSearch(generic.list.ListView, generic.edit.FormMixin):
     model = Showing
     template_name = 'showing_archive_search.html'
     form_class = SearchForm
+    context_object_name = 'showing_list'
+    paginate_by = 50
 
     def get_form_kwargs(self):
         # Load form data from GET params. If no GET was supplied then pass
@@ -240,9 +286,13 @@ class ArchiveSearch(generic.list.ListView, generic.edit.FormMixin):
     def get_context_data(self, **kwargs):
         # Put the form in the context data sent to the template
         context = super(ArchiveSearch, self).get_context_data(**kwargs)
+        # Search parameters, for the links to other pages of results:
+        query_params = self.request.GET.copy()
+        query_params.pop('page', None)
         context.update({
             'form': self.form,
             'search_submitted': len(self.request.GET),
+            'query_params': query_params.urlencode(),
         })
         return context
 
@@ -261,7 +311,24 @@ class ArchiveSearch(generic.list.ListView, generic.edit.FormMixin):
         # Start with a queryset containing all public showings:
         queryset = Showing.objects.public().select_related()
 
-        if options['search_term']:
+        # Add extra filters if start/end date were specified:
+        if options['start_date']:
+            queryset = queryset.filter(start__gte=options['start_date'])
+        if options['end_date']:
+            queryset = queryset.filter(start__lte=options['end_date'])
+
+        if not options['search_term']:
+            return queryset
+
+        # Use the search index, if possible:
+        event_scores = search.search_events(options['search_term'],
+                                            options['search_in_descriptions'])
+        if event_scores is not None:
+            return search.RankedShowings(queryset, event_scores)
+        else:
+            # No words in the search term that can be looked up in the index
+            # (e.g. it's a single character) so fall back to a (slow) search
+            # for the string in event names / copy:
             if options['search_in_descriptions']:
                 # If a search term was provided and "search descriptions"
                 # was checked, filter on the event name and copy:
@@ -273,13 +340,7 @@ class ArchiveSearch(generic.list.ListView, generic.edit.FormMixin):
             else:
                 # Otherwise just the event name
                 queryset = queryset.filter(event__name__icontains=options['search_term'])
-        # Add extra filters if start/end date were specified:
-        if options['start_date']:
-            queryset = queryset.filter(start__gte=options['start_date'])
-        if options['end_date']:
-            queryset = queryset.filter(start__lte=options['end_date'])
-
-        return queryset
+            return queryset
 
     def get(self, request):
         self.form = self.get_form(self.form_class)
@@ -0,0 +1,34 @@
+"""Expansion of the recurrence rules used for adding a series of showings in
+one go (see forms.ShowingSeriesForm and edit_views.add_showing_series)"""
+import datetime
+
+import django.utils.timezone as timezone
+
+
+def recurring_starts(first_start, until, weekdays=None, interval_days=None,
+                     exclude_dates=()):
+    """Generate the start times of a series of showings, at the same (local)
+    time of day as first_start, from first_start up to and including the
+    date until.
+
+    If weekdays (a collection of day numbers, Monday == 0) is given then the
+    series has a showing on each of those days every week, otherwise it has
+    one every interval_days days. Dates in exclude_dates are skipped.
+
+    Start times are generated as they're needed, so this can be used to look
+    at the start of a series without working out the whole thing."""
+    if not weekdays and not interval_days:
+        raise ValueError("One of weekdays or interval_days is required")
+
+    current_tz = timezone.get_current_timezone()
+    local_start = timezone.localtime(first_start)
+    # (Keep the same local time of day across daylight saving changes)
+    time_of_day = local_start.time()
+    exclude_dates = set(exclude_dates)
+
+    date = local_start.date()
+    step = datetime.timedelta(days=1 if weekdays else interval_days)
+    while date <= until:
+        if (not weekdays or date.weekday() in weekdays) and date not in exclude_dates:
+            yield current_tz.localize(datetime.datetime.combine(date, time_of_day))
+        date += step
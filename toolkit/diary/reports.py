@@ -0,0 +1,140 @@
+"""Rendering of the copy, copy summary, terms and rota reports (see
+edit_views.view_event_field)
+
+Each report page is split into the page itself (rendered from
+view_<field>.html, in which each list of showings is a "section"
+placeholder) and the rows for each section, which are rendered from a
+separate template a chunk of showings at a time. This means that reports for
+long date ranges can be streamed to the browser as they're rendered, without
+loading every showing (and its event, and its rota) into memory first.
+
+As the rows are rendered a chunk at a time, anything that depends on the
+previous showing (e.g. only showing the month heading when the month
+changes) is worked out here and set as attributes of the showings, rather
+than with {% ifchanged %}.
+"""
+import csv
+import datetime
+
+from django.db.models import Q
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+import django.utils.timezone as timezone
+
+# For each report, list of (section name, rows template):
+SECTIONS = {
+    'rota': [('rows', 'view_rota_rows.html')],
+    'copy': [('index', 'view_copy_index_rows.html'),
+             ('copy', 'view_copy_rows.html')],
+    'copy_summary': [('index', 'view_copy_index_rows.html'),
+                     ('copy', 'view_copy_summary_rows.html')],
+    'terms': [('rows', 'view_terms_rows.html')],
+}
+
+# Column headings for the rota CSV export:
+ROTA_CSV_HEADINGS = [u"Date", u"Time", u"Event", u"Role", u"Rank", u"Required"]
+
+
+def _section_marker(name):
+    return u"<!--report section:{0}-->".format(name)
+
+
+def iter_chunks(showings, chunk_size):
+    """Generate lists of up to chunk_size showings from the showings
+    queryset, which must be ordered by ('start', 'pk'), loading each chunk
+    with a separate query (plus any prefetch_related queries) as it's needed.
+
+    Each query carries on from the last showing of the previous chunk, rather
+    than using an OFFSET, so the database doesn't have to skip over all the
+    earlier showings again for every chunk, and showings aren't skipped or
+    repeated if earlier ones are added or removed in the meantime."""
+    chunk = list(showings[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]
+        chunk = list(showings.filter(Q(start__gt=last.start)
+                                     | Q(start=last.start, pk__gt=last.pk))[:chunk_size])
+
+
+def annotate_showings(chunks):
+    """Set new_year / new_month / new_day on each showing in the chunks (an
+    iterable of lists of showings), for whether it's the first showing in that
+    year / month / day (local time), and new_copy for whether it's a public
+    showing of a different event to the previous public showing. Yields the
+    chunks."""
+    previous_start = None
+    previous_public_event_id = None
+    for chunk in chunks:
+        for showing in chunk:
+            start = timezone.localtime(showing.start)
+            showing.new_year = previous_start is None or start.year != previous_start.year
+            showing.new_month = showing.new_year or start.month != previous_start.month
+            showing.new_day = showing.new_month or start.day != previous_start.day
+            previous_start = start
+
+            public = not (showing.event.private or showing.hide_in_programme)
+            showing.new_copy = public and showing.event_id != previous_public_event_id
+            if public:
+                previous_public_event_id = showing.event_id
+        yield chunk
+
+
+def render_report(request, field, showings, context, chunk_size):
+    """Generate the HTML for the given report (one of the SECTIONS keys) for
+    the given showings queryset, as a series of strings. The page itself is
+    rendered straight away, the rows as the generator is consumed."""
+    sections = SECTIONS[field]
+    context = dict(context, sections=dict(
+        (name, mark_safe(_section_marker(name))) for name, _ in sections))
+    page = render_to_string(u'view_{0}.html'.format(field), context,
+                            context_instance=RequestContext(request))
+    return _render_sections(page, sections, showings, chunk_size)
+
+
+def _render_sections(page, sections, showings, chunk_size):
+    rest = page
+    for name, template in sections:
+        before, rest = rest.split(_section_marker(name), 1)
+        yield before
+        for chunk in annotate_showings(iter_chunks(showings, chunk_size)):
+            yield render_to_string(template, {'showings': chunk})
+    yield rest
+
+
+class _EchoBuffer(object):
+    # File-like object for csv.writer, which just returns what's written so
+    # that each row can be yielded as it's formatted
+    def write(self, value):
+        return value
+
+
+def _encode(value):
+    return unicode(value).encode("utf-8")
+
+
+def rota_csv(showings, chunk_size):
+    """Generate the rota for the given showings (queryset, which should
+    prefetch rotaentry_set__role) as CSV, one line per rota entry (or per
+    showing, for showings with an empty rota)"""
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow([_encode(heading) for heading in ROTA_CSV_HEADINGS])
+    for chunk in iter_chunks(showings, chunk_size):
+        for showing in chunk:
+            start = timezone.localtime(showing.start)
+            showing_columns = [start.date().isoformat(), start.strftime("%H:%M"),
+                               showing.event.name]
+            entries = showing.rotaentry_set.all()
+            if not entries:
+                yield writer.writerow([_encode(value) for value in showing_columns])
+            for entry in entries:
+                yield writer.writerow([_encode(value) for value in showing_columns + [
+                    entry.role.name, entry.rank, u"yes" if entry.required else u"no"]])
+
+
+def rota_csv_filename(start_date, days_ahead):
+    end_date = start_date + datetime.timedelta(days=days_ahead)
+    return u"rota-{0}-to-{1}.csv".format(start_date.date().isoformat(),
+                                        end_date.date().isoformat())
@@ -0,0 +1,238 @@
+"""Search index for the public archive search (see public_views.ArchiveSearch)
+
+Rather than doing a "LIKE '%term%'" scan over every event's name and copy, the
+words in each event's name, tags and copy are stored in the EventSearchTerm
+table, one row per (event, word, field), with a weight that's used to rank the
+results. Searching then only needs indexed "LIKE 'term%'" lookups on that
+table. This works the same way on MySQL and SQLite, so doesn't need any
+database specific full text search support.
+
+Search terms match the start of words (so "film" matches "films" and
+"filmmaker", but not "superfilm"). If there's more than one word in the search
+then events must match all of them.
+
+The index is updated whenever an event (or its tags) are saved. It's built
+for existing events by migration 0014; to rebuild the entire index, run
+"manage.py rebuild_search_index".
+"""
+import re
+import logging
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from toolkit.diary.models import Event, EventTag, EventSearchTerm, Showing
+from toolkit.util.db import commit_on_success_unless_managed
+
+logger = logging.getLogger(__name__)
+
+# Words shorter than this aren't indexed:
+MIN_TERM_LENGTH = 2
+# Words longer than this are truncated:
+MAX_TERM_LENGTH = EventSearchTerm._meta.get_field('term').max_length
+
+FIELD_WEIGHTS = {
+    EventSearchTerm.NAME: 10,
+    EventSearchTerm.TAG: 5,
+    EventSearchTerm.COPY: 1,
+}
+# Maximum number of times that a word is counted in a single field (so long
+# copy that repeats a word endlessly doesn't swamp everything else):
+MAX_OCCURRENCES = 5
+
+# Number of rows to insert at once when rebuilding the index:
+REBUILD_BATCH_SIZE = 500
+# Maximum number of ids to put in a single "IN (...)" query (SQLite has a
+# limit of 999 parameters per query):
+QUERY_CHUNK_SIZE = 500
+
+_word_re = re.compile(r'\w+', flags=re.UNICODE)
+
+
+def _chunks(sequence, size):
+    sequence = list(sequence)
+    for start in xrange(0, len(sequence), size):
+        yield sequence[start:start + size]
+
+
+def tokenise(text):
+    """Return list of (lower case) index terms in the given text"""
+    return [word[:MAX_TERM_LENGTH] for word in _word_re.findall(text.lower())
+            if len(word) >= MIN_TERM_LENGTH]
+
+
+def _event_terms(event, term_model=EventSearchTerm):
+    """Return list of term_model (EventSearchTerm) objects (unsaved) for the
+    given event"""
+    # (copy_plaintext is stored with the event, so this is cheap)
+    sources = [(EventSearchTerm.NAME, event.name or u""),
+               (EventSearchTerm.COPY, event.copy_plaintext)]
+    sources.extend((EventSearchTerm.TAG, tag.name) for tag in event.tags.all())
+
+    counts = {}
+    for field, text in sources:
+        for term in tokenise(text):
+            counts[(field, term)] = counts.get((field, term), 0) + 1
+
+    return [
+        term_model(event_id=event.pk, field=field, term=term,
+                   weight=FIELD_WEIGHTS[field] * min(count, MAX_OCCURRENCES))
+        for (field, term), count in counts.iteritems()
+    ]
+
+
+def index_event(event):
+    """Replace the index entries for the given (saved) event"""
+    with commit_on_success_unless_managed():
+        EventSearchTerm.objects.filter(event_id=event.pk).delete()
+        EventSearchTerm.objects.bulk_create(_event_terms(event))
+
+
+def build_index(events, term_model=EventSearchTerm):
+    """Add index entries for the given events (which mustn't have any yet, and
+    should have their tags prefetched). term_model is there for the South
+    migration that builds the index, which passes its frozen model. Returns
+    the number of events indexed"""
+    count = 0
+    batch = []
+    for event in events:
+        batch.extend(_event_terms(event, term_model))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            term_model.objects.bulk_create(batch)
+            batch = []
+        count += 1
+    term_model.objects.bulk_create(batch)
+    return count
+
+
+def rebuild_index():
+    """Throw away and regenerate the entire index. Returns the number of
+    events indexed"""
+    with transaction.commit_on_success():
+        EventSearchTerm.objects.all().delete()
+        count = build_index(Event.objects.all().prefetch_related('tags'))
+    logger.info(u"Rebuilt search index for {0} events".format(count))
+    return count
+
+
+def search_events(text, include_copy):
+    """Search the index for events matching all the words in text.
+
+    Returns a dict mapping event id to relevance score, or None if text
+    doesn't contain anything that could be searched for in the index (e.g.
+    it's only single characters or punctuation)"""
+    # (Preserve order while removing duplicates)
+    terms = []
+    for term in tokenise(text):
+        if term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+
+    fields = [EventSearchTerm.NAME, EventSearchTerm.TAG]
+    if include_copy:
+        fields.append(EventSearchTerm.COPY)
+
+    scores = None
+    for term in terms:
+        matches = EventSearchTerm.objects.filter(term__startswith=term, field__in=fields)
+        if scores is not None and len(scores) <= QUERY_CHUNK_SIZE:
+            # Only need to look at events that matched the previous terms:
+            matches = matches.filter(event_id__in=list(scores))
+        matches = matches.values('event').annotate(score=Sum('weight'))
+        term_scores = dict((match['event'], match['score']) for match in matches)
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = dict((event_id, score + term_scores[event_id])
+                          for event_id, score in scores.iteritems()
+                          if event_id in term_scores)
+        if not scores:
+            break
+    return scores
+
+
+class RankedShowings(object):
+    """Sequence of showings for events that matched a search, with the most
+    relevant events first (and showings of the same event in date order).
+
+    Only the ids of the showings are loaded to start with, full Showing
+    objects are loaded when the sequence is sliced, so it can be paginated
+    without loading every matching showing."""
+
+    model = Showing
+
+    def __init__(self, showings, event_scores):
+        """showings: queryset of showings to search within (e.g.
+        Showing.objects.public()) event_scores: result of search_events()"""
+        rows = []
+        for event_ids in _chunks(event_scores, QUERY_CHUNK_SIZE):
+            rows.extend(showings.filter(event_id__in=event_ids)
+                                .values_list('id', 'event_id', 'start'))
+        # Most relevant first, then most recent event first:
+        rows.sort(key=lambda row: (-event_scores[row[1]], -row[1], row[2]))
+        self._ids = [row[0] for row in rows]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0] if index >= 0 else self[len(self) + index]
+        ids = self._ids[index]
+        showings = Showing.objects.filter(id__in=ids).select_related()
+        by_id = dict((showing.id, showing) for showing in showings)
+        return [by_id[showing_id] for showing_id in ids]
+
+
+# Keep the index up to date:
+
+@receiver(post_save, sender=Event)
+def _event_saved(sender, instance, raw, **kwargs):
+    # Don't try to index while loading fixtures (the related tags may not have
+    # been loaded yet) - rebuild the index afterwards instead
+    if not raw:
+        index_event(instance)
+
+
+@receiver(m2m_changed, sender=Event.tags.through)
+def _event_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            index_event(instance)
+    elif action == 'pre_clear':
+        # instance is an EventTag, and don't know which events will be
+        # affected after the clear:
+        instance._search_event_ids = list(instance.event_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        _index_events(getattr(instance, '_search_event_ids', ()))
+    elif action in ('post_add', 'post_remove'):
+        _index_events(pk_set)
+
+
+@receiver(post_save, sender=EventTag)
+def _tag_saved(sender, instance, raw, created, **kwargs):
+    # (The tag might have been renamed)
+    if not raw and not created:
+        _index_events(instance.event_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=EventTag)
+def _tag_deleting(sender, instance, **kwargs):
+    instance._search_event_ids = list(instance.event_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=EventTag)
+def _tag_deleted(sender, instance, **kwargs):
+    _index_events(getattr(instance, '_search_event_ids', ()))
+
+
+def _index_events(event_ids):
+    for chunk in _chunks(event_ids, QUERY_CHUNK_SIZE):
+        for event in Event.objects.filter(pk__in=chunk).prefetch_related('tags'):
+            index_event(event)
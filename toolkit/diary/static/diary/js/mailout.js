@@ -67,7 +67,8 @@ var mailoutController = function (options) {
             update_progress(data.progress);
             window.setTimeout(function() {
                 jQuery.getJSON(
-                    progressURL + '?task_id=' + data.task_id,
+                    progressURL + '?task_id=' + data.task_id +
+                        '&progress=' + data.progress,
                     mail_send_progress_poll
                 );
             }, POLL_PERIOD);
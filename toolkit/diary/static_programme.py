@@ -0,0 +1,281 @@
+"""Pre-rendering of the public programme pages to static files
+
+Pages from the public programme (the default view, year/month/day views, tag
+views, event pages, archive pages and RSS feed) are rendered to files under
+settings.STATIC_PROGRAMME_ROOT, laid out by URL path, so that Apache can serve
+them directly without going anywhere near Django or the database. Anything
+that isn't there (including any request with a query string) falls through to
+the normal Django views. See serverconfig/apache-sites-available for the
+rewrite rules.
+
+The whole tree is rendered by the render_static_programme management command.
+After that, whenever a showing/event/etc. is saved the pages that it appears
+on are re-rendered by a celery task (tasks.render_static_programme_pages).
+Pages that change with the date (e.g. the default view) are re-rendered just
+after midnight each day by celerybeat (tasks.render_current_static_programme,
+which does the same as "render_static_programme --current").
+
+Pages are rendered by calling the views with a dummy request, so links on
+them are generated without any script prefix (i.e. "/programme/..." rather
+than "/toolkit/programme/...") which is fine as Apache rewrites them anyway.
+"""
+import os
+import errno
+import datetime
+import tempfile
+import logging
+
+from django.conf import settings
+from django.core.urlresolvers import reverse, resolve
+from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.http import Http404
+from django.test.client import RequestFactory
+import django.utils.timezone as timezone
+
+from toolkit.diary.models import (Showing, Event, EventTag, MediaItem,
+                                  PrintedProgramme, showings_bulk_created)
+from toolkit.util.thumbnail_queue import thumbnails_generated
+from toolkit.util.db import after_commit
+
+logger = logging.getLogger(__name__)
+
+# File name to use for pages of each content type (so that Apache will serve
+# them with the same type):
+INDEX_FILENAMES = {
+    'text/html': 'index.html',
+    'application/rss+xml': 'index.rss',
+}
+DEFAULT_INDEX_FILENAME = 'index.html'
+
+
+def enabled():
+    return settings.STATIC_PROGRAMME_ROOT is not None
+
+
+# Working out which pages to render:
+
+def _date_kwargs(date, *parts):
+    return dict((part, str(getattr(date, part))) for part in parts)
+
+
+def _date_paths(start):
+    """Paths of pages that show showings that start at the given time"""
+    date = start
+    if isinstance(date, datetime.datetime) and timezone.is_aware(date):
+        date = timezone.localtime(date)
+    return set([
+        reverse('year-view', kwargs=_date_kwargs(date, 'year')),
+        reverse('month-view', kwargs=_date_kwargs(date, 'year', 'month')),
+        reverse('day-view', kwargs=_date_kwargs(date, 'year', 'month', 'day')),
+        reverse('archive-view-year', kwargs=_date_kwargs(date, 'year')),
+        reverse('archive-view-month', kwargs=_date_kwargs(date, 'year', 'month')),
+    ])
+
+
+def _event_paths(event):
+    paths = set([reverse('single-event-view', kwargs={'event_id': event.pk})])
+    if event.legacy_id:
+        paths.add(reverse('single-event-view-legacyid', kwargs={'legacy_id': event.legacy_id}))
+    return paths
+
+
+def _tag_paths(slugs):
+    return set(reverse('type-view', kwargs={'event_type': slug}) for slug in slugs)
+
+
+def current_paths():
+    """Paths of pages that change with the current date, or that show a
+    selection of showings from all dates"""
+    paths = set([
+        reverse('default-view'),
+        reverse('archive-view-index'),
+        reverse('view-diary-rss'),
+    ])
+    paths.update(_tag_paths(EventTag.objects.values_list('slug', flat=True)))
+    # This month and next (as the pages highlight the current day)
+    today = datetime.date.today()
+    paths.update(_date_paths(today))
+    paths.update(_date_paths(today + datetime.timedelta(days=31)))
+    return paths
+
+
+def all_paths():
+    """Paths of every page in the static programme"""
+    paths = current_paths()
+    for start in Showing.objects.public().values_list('start', flat=True):
+        paths.update(_date_paths(start))
+    for event in (Event.objects.filter(private=False, showings__isnull=False)
+                               .distinct().only('id', 'legacy_id')):
+        paths.update(_event_paths(event))
+    return paths
+
+
+def paths_for_events(events):
+    """Paths of pages that show the given events (or their showings)"""
+    paths = current_paths()
+    for event in events:
+        paths.update(_event_paths(event))
+        for start in event.showings.values_list('start', flat=True):
+            paths.update(_date_paths(start))
+    return paths
+
+
+def paths_for_showing(showing):
+    paths = paths_for_events([showing.event])
+    # If the showing has been moved then pages for the old date also change:
+    original_start = getattr(showing, '_original_start', None)
+    if original_start is not None:
+        paths.update(_date_paths(original_start))
+    return paths
+
+
+# Rendering:
+
+def _filename(root, path, content_type):
+    index = INDEX_FILENAMES.get(content_type.split(';')[0].strip(), DEFAULT_INDEX_FILENAME)
+    return os.path.join(root, path.strip('/'), index)
+
+
+def _write_file(filename, content):
+    # Write to a temporary file and then rename, so Apache never serves a
+    # partially written file:
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as temp_file:
+        temp_file.write(content)
+    os.chmod(temp_filename, 0644)
+    os.rename(temp_filename, filename)
+
+
+def _remove_files(root, path):
+    for index in set(INDEX_FILENAMES.values() + [DEFAULT_INDEX_FILENAME]):
+        try:
+            os.unlink(os.path.join(root, path.strip('/'), index))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+
+def _get(path):
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    match = resolve(path)
+    try:
+        response = match.func(request, *match.args, **match.kwargs)
+    except Http404:
+        return None
+    # (For TemplateResponses returned by the class based views)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.status_code != 200:
+        return None
+    return response
+
+
+def render_pages(paths, root=None):
+    """Render the given pages to static files under root (defaults to
+    settings.STATIC_PROGRAMME_ROOT). Pages that no longer exist are removed.
+    Returns the number of pages written"""
+    root = root or settings.STATIC_PROGRAMME_ROOT
+    written = 0
+    for path in sorted(paths):
+        try:
+            response = _get(path)
+            if response is None:
+                _remove_files(root, path)
+            else:
+                _write_file(_filename(root, path, response['Content-Type']), response.content)
+                written += 1
+        except Exception:
+            # Keep going with the other pages. (If a stale page is left behind
+            # then it'll be fixed next time the page is rendered)
+            logger.exception(u"Failed rendering static page for {0}".format(path))
+    logger.info(u"Rendered {0} of {1} static programme pages".format(written, len(paths)))
+    return written
+
+
+# Re-render pages when things change:
+
+def _schedule(paths):
+    if not enabled() or not paths:
+        return
+    # Import here, as tasks imports this module:
+    from toolkit.diary.tasks import render_static_programme_pages
+    paths = sorted(paths)
+    # Only queued once the change that triggered it has been committed, so
+    # the task can't render the pages from the old data:
+    after_commit(lambda: render_static_programme_pages.apply_async(args=[paths]))
+
+
+@receiver(post_save, sender=Showing)
+@receiver(post_delete, sender=Showing)
+def _showing_changed(sender, instance, raw=False, **kwargs):
+    if enabled() and not raw:
+        _schedule(paths_for_showing(instance))
+
+
+@receiver(showings_bulk_created, sender=Showing)
+def _showings_created(sender, showings, **kwargs):
+    if enabled():
+        events = dict((showing.event_id, showing.event) for showing in showings)
+        _schedule(paths_for_events(events.values()))
+
+
+@receiver(post_save, sender=Event)
+def _event_changed(sender, instance, raw=False, **kwargs):
+    if enabled() and not raw:
+        _schedule(paths_for_events([instance]))
+
+
+@receiver(post_save, sender=MediaItem)
+def _mediaitem_changed(sender, instance, raw=False, **kwargs):
+    if enabled() and not raw:
+        _schedule(paths_for_events(instance.event_set.all()))
+
+
+@receiver(pre_delete, sender=MediaItem)
+def _mediaitem_deleting(sender, instance, **kwargs):
+    # (The links to the events are gone by the time post_delete is sent)
+    if enabled():
+        instance._static_programme_paths = paths_for_events(instance.event_set.all())
+
+
+@receiver(post_delete, sender=MediaItem)
+def _mediaitem_deleted(sender, instance, **kwargs):
+    if enabled():
+        _schedule(getattr(instance, '_static_programme_paths', ()))
+
+
+@receiver(thumbnails_generated)
+def _thumbnails_generated(sender, source_name, **kwargs):
+    if enabled():
+        _schedule(paths_for_events(Event.objects.filter(media__media_file=source_name)))
+
+
+@receiver(post_save, sender=EventTag)
+@receiver(post_delete, sender=EventTag)
+def _tag_changed(sender, instance, raw=False, **kwargs):
+    if enabled() and not raw:
+        _schedule(current_paths() | _tag_paths([instance.slug]))
+
+
+@receiver(m2m_changed, sender=Event.tags.through)
+@receiver(m2m_changed, sender=Event.media.through)
+def _event_relation_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not enabled() or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _schedule(paths_for_events([instance]))
+    elif pk_set:
+        _schedule(paths_for_events(Event.objects.filter(pk__in=pk_set)))
+
+
+@receiver(post_save, sender=PrintedProgramme)
+@receiver(post_delete, sender=PrintedProgramme)
+def _printed_programme_changed(sender, instance, raw=False, **kwargs):
+    if enabled() and not raw:
+        _schedule(current_paths() | _date_paths(instance.month))
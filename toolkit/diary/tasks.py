@@ -0,0 +1,28 @@
+from celery import task
+from celery.utils.log import get_task_logger
+
+import toolkit.diary.static_programme as static_programme
+
+logger = get_task_logger(__name__)
+
+
+@task()
+def render_static_programme_pages(paths):
+    """Re-render the given pages of the static programme (see
+    static_programme.py). Returns the number of pages written."""
+    if not static_programme.enabled():
+        logger.info("Static programme disabled; not rendering")
+        return 0
+    return static_programme.render_pages(paths)
+
+
+@task()
+def render_current_static_programme():
+    """Re-render the pages of the static programme that change with the date
+    (the default view, this/next month, etc.) Run just after midnight each
+    day by celerybeat (see CELERYBEAT_SCHEDULE in settings_common). Returns
+    the number of pages written."""
+    if not static_programme.enabled():
+        logger.info("Static programme disabled; not rendering")
+        return 0
+    return static_programme.render_pages(static_programme.current_paths())
@@ -0,0 +1,29 @@
+"""Template tag that renders event_fragment.html for an event, using the
+cached copy if there is one (see toolkit.diary.fragment_cache)"""
+
+from django import template
+from django.utils.safestring import mark_safe
+
+import toolkit.diary.fragment_cache as fragment_cache
+
+register = template.Library()
+
+FRAGMENT_TEMPLATE = "event_fragment.html"
+
+
+@register.simple_tag(takes_context=True)
+def cached_event_fragment(context, event, showings):
+    """Usage: {% cached_event_fragment event showings %}
+
+    Equivalent to {% include "event_fragment.html" %} with event and showings
+    set in the context"""
+    key = fragment_cache.fragment_key(event, showings)
+    content = fragment_cache.get_fragment(key)
+    if content is None:
+        context.update({'event': event, 'showings': showings})
+        try:
+            content = template.loader.get_template(FRAGMENT_TEMPLATE).render(context)
+        finally:
+            context.pop()
+        fragment_cache.set_fragment(key, content)
+    return mark_safe(content)
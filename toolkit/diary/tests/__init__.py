@@ -1,8 +1,12 @@
 from __future__ import absolute_import
 
+from .test_choice_cache import *
 from .test_edit_views import *
 from .test_feeds import *
+from .test_fragment_cache import *
 from .test_mailout_view import *
 from .test_models import *
 from .test_public_views import *
 from .test_printedprogramme_views import *
+from .test_search import *
+from .test_static_programme import *
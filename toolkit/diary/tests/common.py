@@ -1,6 +1,7 @@
 import pytz
 from datetime import datetime, date
 
+from django.core.cache import cache
 import django.contrib.auth.models as auth_models
 import django.contrib.contenttypes as contenttypes
 
@@ -12,6 +13,8 @@ from toolkit.members.models import Member, Volunteer
 class DiaryTestsMixin(object):
 
     def setUp(self):
+        # Don't let cached pages leak between tests:
+        cache.clear()
         self._setup_test_data()
 
         return super(DiaryTestsMixin, self).setUp()
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+
+from toolkit.diary.models import Role, EventTag, Showing
+import toolkit.diary.choice_cache as choice_cache
+import toolkit.diary.forms as diary_forms
+
+from .common import DiaryTestsMixin
+
+
+class ChoiceCacheTests(DiaryTestsMixin, TestCase):
+
+    def test_roles_cached(self):
+        roles = choice_cache.roles()
+        self.assertEqual([name for _, name, _ in roles],
+                         [u"Role 1 (standard)", u"Role 2 (nonstandard)", u"Role 3"])
+        with self.assertNumQueries(0):
+            self.assertEqual(choice_cache.roles(), roles)
+
+    def test_save_invalidates(self):
+        choice_cache.tag_choices()
+        EventTag(name=u"new tag", slug=u"new-tag").save()
+        self.assertIn(u"new tag", [name for _, name in choice_cache.tag_choices()])
+
+    def test_other_process_change_invalidates(self):
+        choice_cache.roles()
+        # Simulate another process changing the roles:
+        Role.objects.filter(name=u"Role 3").update(standard=True)
+        choice_cache.invalidate(Role)
+        choice_cache.clear_local()
+        self.assertIn(u"Role 3", [name for _, name, standard in choice_cache.roles() if standard])
+
+    def test_bulk_update_invalidates(self):
+        choice_cache.roles()
+        self.client.login(username="admin", password="T3stPassword!")
+        roles = list(Role.objects.all())
+        data = {
+            u"form-TOTAL_FORMS": len(roles),
+            u"form-INITIAL_FORMS": len(roles),
+            u"form-MAX_NUM_FORMS": 1000,
+        }
+        for index, role in enumerate(roles):
+            data[u"form-{0}-id".format(index)] = role.pk
+            data[u"form-{0}-name".format(index)] = role.name + u" renamed"
+        self.client.post(reverse("edit_roles"), data=data)
+        self.assertEqual([name for _, name, _ in choice_cache.roles()],
+                         [u"Role 1 (standard) renamed", u"Role 2 (nonstandard) renamed",
+                          u"Role 3 renamed"])
+
+    def test_rota_form_class_reused(self):
+        form_class = diary_forms.rota_form_factory()
+        self.assertIs(diary_forms.rota_form_factory(), form_class)
+
+        Role(name=u"Role 4", standard=True).save()
+        new_form_class = diary_forms.rota_form_factory()
+        self.assertIsNot(new_form_class, form_class)
+        self.assertIn(u"role_{0}".format(Role.objects.get(name=u"Role 4").pk),
+                      new_form_class.base_fields)
+
+    def test_rota_form_initial(self):
+        showing = Showing.objects.get(pk=1)
+        RotaForm = diary_forms.rota_form_factory()
+        self.assertEqual(RotaForm.initial_for(showing)['other_roles'], [2, 3])
+
+        showing = Showing.objects.get(event__name=u"Event three title")
+        initial = RotaForm.initial_for(showing)
+        self.assertEqual((initial[u"role_1"], initial['other_roles']), (6, [1]))
+
+    def test_edit_showing_query_count(self):
+        self.client.login(username="admin", password="T3stPassword!")
+        url = reverse("edit-showing", kwargs={"showing_id": 1})
+        self.client.get(url)
+        # Nothing extra is needed for the roles (or the rota form) once
+        # they're cached, however many there are:
+        Role.objects.bulk_create(Role(name=u"Extra role {0}".format(n), standard=n % 2)
+                                 for n in range(20))
+        choice_cache.invalidate(Role)
+        self.client.get(url)
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, u"Extra role 19")
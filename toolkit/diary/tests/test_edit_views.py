@@ -2,9 +2,10 @@ from __future__ import absolute_import
 import re
 import json
 import os.path
+import hashlib
 
 import pytz
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 import tempfile
 
 from mock import patch
@@ -14,8 +15,12 @@ from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
 
 from toolkit.diary.models import (Showing, Event, Role, DiaryIdea,
-                                  EventTemplate, MediaItem, EventTag)
+                                  EventTemplate, MediaItem, EventTag, RotaEntry)
 import toolkit.diary.edit_prefs
+import toolkit.diary.reports as reports
+import toolkit.diary.choice_cache as choice_cache
+import toolkit.diary.forms as diary_forms
+from toolkit.util.bulk_formset import bulk_modelformset_factory
 
 from .common import DiaryTestsMixin
 
@@ -30,11 +35,13 @@ class EditDiaryViewsLoginRequired(DiaryTestsMixin, TestCase):
             "year-edit": {"year": "2013"},
             "month-edit": {"year": "2013", "month": "1"},
             "day-edit": {"year": "2013", "month": "1", "day": "1"},
+            "edit-list-chunk": {"year": "2013", "month": "1", "day": "1"},
             "edit-event-details-view": {"pk": "1"},
             "edit-event-details": {"event_id": "1"},
             "edit-showing": {"showing_id": "1"},
             "edit-ideas": {"year": "2012", "month": "1"},
             "add-showing": {"event_id": "1"},
+            "add-showing-series": {"event_id": "1"},
             "delete-showing": {"showing_id": "1"},
             "add-event": {},
 
@@ -82,6 +89,57 @@ class EditDiaryViews(DiaryTestsMixin, TestCase):
         # self.assertIn(u'<p>Event one copy</p>', response.content)
         self.assertEqual(response.status_code, 200)
 
+    @patch('django.utils.timezone.now')
+    def test_view_list_first_chunk(self, now_patch):
+        now_patch.return_value = self._fake_now
+        url = reverse("day-edit", kwargs={"year": "2013", "month": "6", "day": "1"})
+        response = self.client.get(url, data={"daysahead": 120})
+        self.assertContains(response, u"EVENT FOUR TITL\u0112")
+        # Only June is in the page:
+        self.assertEqual(len(response.context['rows']), 30)
+        self.assertNotContains(response, u"September")
+        self.assertEqual(response.context['next_chunk_url'],
+                         u"/diary/edit/chunk/2013/7/1/?end=2013-09-29")
+
+    @patch('django.utils.timezone.now')
+    def test_view_list_chunk(self, now_patch):
+        now_patch.return_value = self._fake_now.replace(month=3)
+        url = reverse("edit-list-chunk", kwargs={"year": "2013", "month": "4", "day": "1"})
+        with self.assertNumQueries(4):
+            response = self.client.get(url, data={"end": "2014-01-01"})
+        data = json.loads(response.content)
+        # Just April:
+        self.assertIn(u"April 2013 ideas", data['html'])
+        self.assertIn(u"EVENT THREE TITLE", data['html'])
+        self.assertNotIn(u"May 2013 ideas", data['html'])
+        self.assertEqual(data['next'], u"/diary/edit/chunk/2013/5/1/?end=2014-01-01")
+
+        # Up to the end of the range:
+        response = self.client.get(url, data={"end": "2013-04-03"})
+        data = json.loads(response.content)
+        self.assertEqual(data['html'].count(u'class="row_day"'), 2)
+        self.assertEqual(data['next'], None)
+
+    @patch('django.utils.timezone.now')
+    def test_view_list_chunk_past(self, now_patch):
+        # (Now is 1st June 2013)
+        now_patch.return_value = self._fake_now
+        url = reverse("edit-list-chunk", kwargs={"year": "2013", "month": "4", "day": "1"})
+        response = self.client.get(url, data={"end": "2013-09-01"})
+        data = json.loads(response.content)
+        # Starts from today:
+        self.assertNotIn(u"EVENT THREE TITLE", data['html'])
+        self.assertIn(u"EVENT FOUR TITL\u0112", data['html'])
+        self.assertEqual(data['next'], u"/diary/edit/chunk/2013/7/1/?end=2013-09-01")
+
+        response = self.client.get(url, data={"end": "2013-05-01"})
+        self.assertEqual(json.loads(response.content), {'html': u"", 'next': None})
+
+    def test_view_list_chunk_bad_end(self):
+        url = reverse("edit-list-chunk", kwargs={"year": "2013", "month": "4", "day": "1"})
+        response = self.client.get(url, data={"end": "nonsense"})
+        self.assertEqual(response.status_code, 400)
+
     def test_view_tag_editor(self):
         url = reverse("edit_event_tags")
         response = self.client.get(url)
@@ -266,6 +324,106 @@ class AddShowingView(DiaryTestsMixin, TestCase):
         self.assert_return_to_index(response)
 
 
+class AddShowingSeriesView(DiaryTestsMixin, TestCase):
+
+    def setUp(self):
+        super(AddShowingSeriesView, self).setUp()
+        # Log in:
+        self.client.login(username="admin", password="T3stPassword!")
+        # (Has two rota entries)
+        self.url = reverse("add-showing-series", kwargs={"event_id": 2}) + "?copy_from=1"
+        self.source = Showing.objects.get(id=1)
+
+    def _new_showings(self):
+        return list(self.source.event.showings.filter(start__gt=self._fake_now))
+
+    @patch('django.utils.timezone.now')
+    def test_add_weekly(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        response = self.client.post(self.url, data={
+            "series_start": u"03/06/2013 20:00",
+            "until": u"30/06/2013",
+            "weekdays": [u"0", u"2"],  # Mondays and Wednesdays
+            "exclude_dates": u"10/06/2013, 19/6/2013",
+            "booked_by": u"Someone",
+        })
+        self.assert_return_to_index(response)
+
+        showings = self._new_showings()
+        london = pytz.timezone("Europe/London")
+        self.assertEqual([s.start for s in showings],
+                         [london.localize(datetime(2013, 6, day, 20, 0))
+                          for day in (3, 5, 12, 17, 24, 26)])
+        src_rota = [(e.role_id, e.rank) for e in self.source.rotaentry_set.all()]
+        self.assertEqual(len(src_rota), 2)
+        for showing in showings:
+            self.assertEqual(showing.booked_by, u"Someone")
+            self.assertEqual(showing.confirmed, self.source.confirmed)
+            self.assertEqual([(e.role_id, e.rank) for e in showing.rotaentry_set.all()], src_rota)
+
+    @patch('django.utils.timezone.now')
+    def test_add_every_n_days_skips_existing(self, now_patch):
+        now_patch.return_value = self._fake_now
+        existing = Showing(copy_from=self.source)
+        existing.start = pytz.utc.localize(datetime(2013, 6, 5, 19, 0))
+        existing.save()
+
+        response = self.client.post(self.url, data={
+            "series_start": u"03/06/2013 20:00",
+            "until": u"11/06/2013",
+            "interval_days": u"2",
+            "booked_by": u"Someone",
+        })
+        self.assert_return_to_index(response)
+
+        self.assertEqual([s.start.day for s in self._new_showings()], [3, 5, 7, 9, 11])
+
+    @patch('django.utils.timezone.now')
+    def test_query_count(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        # Number of queries shouldn't depend on the number of showings (as
+        # long as SQLite doesn't need to split up the insert):
+        for until in (u"04/06/2013", u"04/07/2013"):
+            with self.assertNumQueries(10):
+                response = self.client.post(self.url, data={
+                    "series_start": u"03/06/2013 20:00",
+                    "until": until,
+                    "interval_days": u"1",
+                    "booked_by": u"Someone",
+                })
+            self.assert_return_to_index(response)
+            self.source.event.showings.filter(start__gt=self._fake_now).delete()
+
+    @patch('django.utils.timezone.now')
+    def test_invalid_rule(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        data = {
+            "series_start": u"03/06/2013 20:00",
+            "until": u"30/06/2013",
+            "booked_by": u"Someone",
+        }
+        response = self.client.post(self.url, data=data)
+        self.assertFormError(response, 'series_form', None,
+                             u"Choose either days of the week or a number of days")
+
+        data["interval_days"] = u"1"
+        data["until"] = u"30/06/2014"
+        response = self.client.post(self.url, data=data)
+        self.assertFormError(response, 'series_form', None,
+                             u"Can't add more than 100 showings at once")
+
+        data["until"] = u"30/06/2013"
+        data["exclude_dates"] = u"30/02/2013"
+        response = self.client.post(self.url, data=data)
+        self.assertFormError(response, 'series_form', 'exclude_dates',
+                             u"Invalid date '30/02/2013'")
+
+        self.assertEqual(self._new_showings(), [])
+
+
 class EditShowing(DiaryTestsMixin, TestCase):
 
     def setUp(self):
@@ -565,6 +723,28 @@ class AddEventView(DiaryTestsMixin, TestCase):
             self.assertEqual(s.discounted, True)
             self.assertEqual(list(s.roles.all()), [role_1, ])
 
+    @patch('django.utils.timezone.now')
+    def test_add_event_query_count(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        # Number of queries shouldn't depend on the number of days:
+        for number_of_days in (1, 14):
+            with self.assertNumQueries(22):
+                response = self.client.post(reverse("add-event"), data={
+                    u"start": u"02/06/2013 20:00",
+                    u"duration": u"01:30:00",
+                    u"number_of_days": unicode(number_of_days),
+                    u"event_name": u"Event {0}".format(number_of_days),
+                    u"event_template": u"1",
+                    u"booked_by": u"Someone",
+                    u"confirmed": u"on",
+                })
+            self.assert_return_to_index(response)
+            event = Event.objects.get(name=u"Event {0}".format(number_of_days))
+            self.assertEqual(event.showings.count(), number_of_days)
+            self.assertEqual(RotaEntry.objects.filter(showing__event=event).count(),
+                             number_of_days)
+
     @patch('django.utils.timezone.now')
     def test_add_event_in_past(self, now_patch):
         now_patch.return_value = self._fake_now
@@ -816,9 +996,6 @@ class EditEventView(DiaryTestsMixin, TestCase):
         url = reverse("edit-event-details", kwargs={"event_id": 2})
 
         with tempfile.NamedTemporaryFile(dir="/tmp", prefix="toolkit-test-", suffix=".jpg") as temp_jpg:
-            # used for assertion:
-            temp_file_name = os.path.basename(temp_jpg.name)
-
             temp_jpg.write("Dummy jpeg")
             temp_jpg.seek(0)
             response = self.client.post(url, data={
@@ -838,8 +1015,9 @@ class EditEventView(DiaryTestsMixin, TestCase):
         self.assertEqual(media_item.mimetype, "image/jpeg")
         self.assertEqual(media_item.credit, u'All new image credit!')
         self.assertEqual(media_item.caption, None)
+        # Stored under its content hash:
         self.assertEqual(media_item.media_file.name,
-                         os.path.join("diary", temp_file_name))
+                         os.path.join("diary", hashlib.sha1("Dummy jpeg").hexdigest() + ".jpg"))
 
     @override_settings(MEDIA_ROOT="/tmp")
     @patch("toolkit.util.image.get_mimetype")
@@ -849,9 +1027,6 @@ class EditEventView(DiaryTestsMixin, TestCase):
         url = reverse("edit-event-details", kwargs={"event_id": 2})
 
         with tempfile.NamedTemporaryFile(dir="/tmp", prefix="toolkit-test-", suffix=".png") as temp_png:
-            # used for assertion:
-            temp_file_name = os.path.basename(temp_png.name)
-
             temp_png.write("Dummy png")
             temp_png.seek(0)
             response = self.client.post(url, data={
@@ -871,8 +1046,9 @@ class EditEventView(DiaryTestsMixin, TestCase):
         self.assertEqual(media_item.mimetype, "image/png")
         self.assertEqual(media_item.credit, u'All new image credit!')
         self.assertEqual(media_item.caption, None)
+        # Stored under its content hash:
         self.assertEqual(media_item.media_file.name,
-                         os.path.join("diary", temp_file_name))
+                         os.path.join("diary", hashlib.sha1("Dummy png").hexdigest() + ".png"))
 
     @override_settings(MEDIA_ROOT="/tmp")
     def test_post_edit_event_clear_media(self):
@@ -990,6 +1166,12 @@ class ViewEventFieldTests(DiaryTestsMixin, TestCase):
     def tearDown(self):
         self.time_patch.stop()
 
+    def _content(self, response):
+        # (Long reports are streamed)
+        if response.streaming:
+            return b"".join(response.streaming_content).decode("utf-8")
+        return response.content.decode("utf-8")
+
     def test_view_event_field_rota(self):
         url = reverse("view_event_field", kwargs={"field": "rota"})
         response = self.client.get(url)
@@ -1030,9 +1212,11 @@ class ViewEventFieldTests(DiaryTestsMixin, TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "view_rota.html")
+        self.assertTrue(response.streaming)
 
-        self.assertContains(response, u"Event three title")
-        self.assertContains(response, u"Event four titl\u0113")
+        content = self._content(response)
+        self.assertIn(u"Event three title", content)
+        self.assertIn(u"Event four titl\u0113", content)
 
     def test_custom_start_date_rota_less_long_time(self):
         # Now shorter date range, should find one fewer event
@@ -1043,8 +1227,9 @@ class ViewEventFieldTests(DiaryTestsMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "view_rota.html")
 
-        self.assertContains(response, u"Event three title")
-        self.assertNotContains(response, u"Event four titl\u0113")
+        content = self._content(response)
+        self.assertIn(u"Event three title", content)
+        self.assertNotIn(u"Event four titl\u0113", content)
 
     def test_custom_start_date_rota_invalid_date(self):
         # Now shorter date range, should find one fewer event
@@ -1062,8 +1247,9 @@ class ViewEventFieldTests(DiaryTestsMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "view_terms.html")
 
-        self.assertNotContains(response, u"EVENT THREE TITLE")
-        self.assertContains(response, u"EVENT FOUR TITL\u0112")
+        content = self._content(response)
+        self.assertNotIn(u"EVENT THREE TITLE", content)
+        self.assertIn(u"EVENT FOUR TITL\u0112", content)
 
     def test_custom_start_date_terms_search_no_result(self):
         url = reverse("view_event_field", kwargs={"field": "terms"})
@@ -1073,8 +1259,60 @@ class ViewEventFieldTests(DiaryTestsMixin, TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, "view_terms.html")
 
-        self.assertNotContains(response, u"EVENT THREE TITLE")
-        self.assertNotContains(response, u"EVENT FOUR TITL\u0112")
+        content = self._content(response)
+        self.assertNotIn(u"EVENT THREE TITLE", content)
+        self.assertNotIn(u"EVENT FOUR TITL\u0112", content)
+
+    @override_settings(STREAMED_REPORT_CHUNK_SIZE=1)
+    def test_streamed_copy_headings(self):
+        # Headings aren't repeated (or missed) at the chunk boundaries:
+        url = reverse("view_event_field", kwargs={"field": "copy"})
+        url += "/2013/01/01?daysahead=365&stream=1"
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        content = self._content(response)
+
+        self.assertEqual(content.count(u'<p class="pad">2013</p>'), 1)
+        self.assertEqual(content.count(u'<p class="pad">APRIL</p>'), 1)
+        self.assertIn(u'<p class="day">Tue 02 19:00 ......... Event two title</p>', content)
+        # Copy for each event only once:
+        self.assertEqual(content.count(u"<p>EVENT TWO TITLE</p>"), 1)
+        self.assertEqual(content.count(u"<p>EVENT FOUR TITL\u0112</p>"), 1)
+
+    def test_not_streamed(self):
+        url = reverse("view_event_field", kwargs={"field": "rota"})
+        url += "/2013/01/01?daysahead=365&stream=0"
+        response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertContains(response, u"Event four titl\u0113")
+
+    def test_rota_csv(self):
+        url = reverse("view_event_field", kwargs={"field": "rota"})
+        url += "/2013/04/01?daysahead=30&format=csv"
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], "text/csv; charset=utf-8")
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="rota-2013-04-01-to-2013-05-01.csv"')
+
+        lines = self._content(response).splitlines()
+        self.assertEqual(lines[0], u"Date,Time,Event,Role,Rank,Required")
+        self.assertIn(u"2013-04-13,18:00,Event three title,Role 1 (standard),6,yes", lines)
+
+    def test_iter_chunks(self):
+        showings = Showing.objects.order_by('start', 'pk')
+        # Two showings with the same start at a chunk boundary:
+        Showing(copy_from=showings[1], start_offset=timedelta(0)).save(force=True)
+        expected = list(showings.values_list('pk', flat=True))
+
+        chunks = reports.iter_chunks(showings, 2)
+        first_chunk = next(chunks)
+        # Removing a showing that's already been listed doesn't make the next
+        # chunk skip one (as it would if it used an offset):
+        Showing.objects.filter(pk=first_chunk[0].pk).delete()
+        chunks = [first_chunk] + list(chunks)
+
+        self.assertTrue(all(len(chunk) <= 2 for chunk in chunks))
+        self.assertEqual([showing.pk for chunk in chunks for showing in chunk], expected)
 
 
 class PreferencesTests(DiaryTestsMixin, TestCase):
@@ -1270,3 +1508,271 @@ class EditTagsViewTests(DiaryTestsMixin, TestCase):
         )
         final_tag_count = EventTag.objects.count()
         self.assertEqual(initial_tag_count, final_tag_count)
+
+    def test_post_duplicate_new_tags(self):
+        url = reverse("edit_event_tags")
+        response = self.client.post(url, data={
+            "deleted_tags[]": [],
+            "new_tags[]": [u"new tag", u"New Tag"],
+        })
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['failed'], True)
+        self.assertEqual(
+            response_data[u'errors'],
+            {u"New Tag": [u'Event tag with this Name already exists.']}
+        )
+        self.assertFalse(EventTag.objects.filter(name=u"new tag").exists())
+
+    def test_post_delete_read_only(self):
+        EventTag.objects.filter(id=1).update(read_only=True)
+
+        url = reverse("edit_event_tags")
+        response = self.client.post(url, data={
+            "deleted_tags[]": [1, 2],
+            "new_tags[]": [],
+        })
+        response_data = json.loads(response.content)
+        self.assertEqual(response_data['failed'], False)
+        self.assertEqual(EventTag.objects.filter(id=1).count(), 1)
+        self.assertEqual(EventTag.objects.filter(id=2).count(), 0)
+
+
+class EditRolesViewTests(DiaryTestsMixin, TestCase):
+    def setUp(self):
+        super(EditRolesViewTests, self).setUp()
+        self.client.login(username="admin", password="T3stPassword!")
+        self.url = reverse("edit_roles")
+
+    def tearDown(self):
+        self.client.logout()
+
+    def _formset_data(self, roles, new_name=u""):
+        data = {
+            u"form-TOTAL_FORMS": len(roles) + 1,
+            u"form-INITIAL_FORMS": len(roles),
+            u"form-MAX_NUM_FORMS": 1000,
+            u"form-{0}-name".format(len(roles)): new_name,
+        }
+        for index, role in enumerate(roles):
+            prefix = u"form-{0}-".format(index)
+            data[prefix + u"id"] = role.pk
+            data[prefix + u"name"] = role.name
+            if role.standard:
+                data[prefix + u"standard"] = u"on"
+        return data
+
+    def test_post(self):
+        roles = list(Role.objects.all())
+        data = self._formset_data(roles, new_name=u"New r\u00f4le")
+        data[u"form-0-name"] = u"Role 1 renamed"
+        data[u"form-1-standard"] = u"on"
+        data[u"form-2-DELETE"] = u"on"
+
+        response = self.client.post(self.url, data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assert_has_message(response, u"Roles updated", u"success")
+
+        self.assertEqual(
+            list(Role.objects.values_list('name', 'standard')),
+            [(u"New r\u00f4le", False), (u"Role 1 renamed", True),
+             (u"Role 2 (nonstandard)", True)])
+        # Rota entries for the deleted role went with it:
+        self.assertFalse(RotaEntry.objects.filter(role_id=roles[2].pk).exists())
+
+    def test_post_duplicate_name(self):
+        roles = list(Role.objects.all())
+        data = self._formset_data(roles, new_name=u"Role 3")
+
+        response = self.client.post(self.url, data=data)
+        self.assertEqual(response.context['formset'].non_form_errors(),
+                         [u"Please correct the duplicate data for name."])
+        self.assertEqual(Role.objects.count(), 3)
+
+    def test_read_only_role_protected(self):
+        Role.objects.filter(name=u"Role 3").update(read_only=True)
+        roles = list(Role.objects.all())
+        data = self._formset_data(roles)
+
+        # Can't be renamed:
+        data[u"form-2-name"] = u"Role 3 renamed"
+        data[u"form-2-standard"] = u"on"
+        self.client.post(self.url, data=data)
+        role = Role.objects.get(pk=roles[2].pk)
+        self.assertEqual((role.name, role.standard), (u"Role 3", False))
+
+        # Can't be deleted:
+        data[u"form-2-name"] = u"Role 3"
+        data[u"form-2-DELETE"] = u"on"
+        self.client.post(self.url, data=data)
+        self.assertTrue(Role.objects.filter(pk=roles[2].pk).exists())
+
+        # Other changes are allowed:
+        del data[u"form-2-DELETE"]
+        self.client.post(self.url, data=data)
+        self.assertTrue(Role.objects.get(pk=roles[2].pk).standard)
+
+    def test_post_query_count(self):
+        # The number of queries doesn't depend on the number of roles
+        # changed / deleted:
+        for count in (2, 40):
+            Role.objects.bulk_create(
+                Role(name=u"Extra role {0}".format(n)) for n in range(count))
+            roles = list(Role.objects.all())
+            data = self._formset_data(roles)
+            for index, role in enumerate(roles):
+                if role.name.startswith(u"Extra"):
+                    data[u"form-{0}-standard".format(index)] = u"on"
+                    if role.pk % 2:
+                        data[u"form-{0}-DELETE".format(index)] = u"on"
+
+            with self.assertNumQueries(12):
+                response = self.client.post(self.url, data=data)
+            self.assert_has_message(response, u"Roles updated", u"success")
+            Role.objects.filter(name__startswith=u"Extra").delete()
+
+
+class EditEventTemplatesViewTests(DiaryTestsMixin, TestCase):
+    def setUp(self):
+        super(EditEventTemplatesViewTests, self).setUp()
+        self.client.login(username="admin", password="T3stPassword!")
+        self.url = reverse("edit_event_templates")
+
+    def tearDown(self):
+        self.client.logout()
+
+    def test_post(self):
+        template = EventTemplate.objects.get(pk=1)
+        response = self.client.post(self.url, data={
+            u"form-TOTAL_FORMS": 2,
+            u"form-INITIAL_FORMS": 1,
+            u"form-MAX_NUM_FORMS": 1000,
+            u"form-0-id": template.pk,
+            u"form-0-name": u"Renamed template",
+            u"form-0-roles": [2, 3],
+            u"form-0-tags": [2],
+            u"form-1-name": u"New template",
+            u"form-1-roles": [1],
+        })
+        self.assert_has_message(response, u"Event templates updated", u"success")
+
+        template = EventTemplate.objects.get(pk=template.pk)
+        self.assertEqual(template.name, u"Renamed template")
+        self.assertEqual(sorted(template.roles.values_list('pk', flat=True)), [2, 3])
+        self.assertEqual(list(template.tags.values_list('pk', flat=True)), [2])
+
+        new_template = EventTemplate.objects.get(name=u"New template")
+        self.assertEqual(list(new_template.roles.values_list('pk', flat=True)), [1])
+        self.assertEqual(list(new_template.tags.all()), [])
+
+    def test_post_delete(self):
+        template = EventTemplate.objects.get(pk=1)
+        self.client.post(self.url, data={
+            u"form-TOTAL_FORMS": 1,
+            u"form-INITIAL_FORMS": 1,
+            u"form-MAX_NUM_FORMS": 1000,
+            u"form-0-id": template.pk,
+            u"form-0-name": template.name,
+            u"form-0-roles": [1],
+            u"form-0-DELETE": u"on",
+        })
+        self.assertFalse(EventTemplate.objects.filter(pk=template.pk).exists())
+        self.assertFalse(EventTemplate.roles.through.objects.filter(
+            eventtemplate_id=template.pk).exists())
+
+    def test_post_invalid_role(self):
+        template = EventTemplate.objects.get(pk=1)
+        roles = sorted(template.roles.values_list('pk', flat=True))
+        response = self.client.post(self.url, data={
+            u"form-TOTAL_FORMS": 1,
+            u"form-INITIAL_FORMS": 1,
+            u"form-MAX_NUM_FORMS": 1000,
+            u"form-0-id": template.pk,
+            u"form-0-name": template.name,
+            u"form-0-roles": [2, 1000],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['formset'].forms[0].errors['roles'],
+                         [u"Select a valid choice. 1000 is not one of the available choices."])
+        self.assertEqual(sorted(template.roles.values_list('pk', flat=True)), roles)
+
+    def _formset_data(self, templates):
+        data = {
+            u"form-TOTAL_FORMS": len(templates),
+            u"form-INITIAL_FORMS": len(templates),
+            u"form-MAX_NUM_FORMS": 1000,
+        }
+        for index, template in enumerate(templates):
+            data[u"form-{0}-id".format(index)] = template.pk
+            data[u"form-{0}-name".format(index)] = template.name
+            data[u"form-{0}-roles".format(index)] = list(template.roles.values_list('pk', flat=True))
+            data[u"form-{0}-tags".format(index)] = list(template.tags.values_list('pk', flat=True))
+        return data
+
+    def test_query_count(self):
+        # The number of queries doesn't depend on the number of templates
+        # (including loading their roles and tags):
+        for count in (2, 20):
+            for n in range(count):
+                template = EventTemplate(name=u"Extra template {0}".format(n))
+                template.save()
+                template.roles.add(1, 2)
+                template.tags.add(1)
+            templates = list(EventTemplate.objects.all())
+            data = self._formset_data(templates)
+            for index, template in enumerate(templates):
+                if template.name.startswith(u"Extra"):
+                    data[u"form-{0}-roles".format(index)] = [2, 3]
+
+            # (Whether the role and tag choices have to be loaded depends on
+            # previous tests, so load them first)
+            choice_cache.role_choices()
+            choice_cache.tag_choices()
+            with self.assertNumQueries(16):
+                response = self.client.post(self.url, data=data)
+            self.assert_has_message(response, u"Event templates updated", u"success")
+            self.assertEqual(
+                list(EventTemplate.objects.get(name=u"Extra template 1").roles.order_by('pk')
+                                                                         .values_list('pk', flat=True)),
+                [2, 3])
+            EventTemplate.objects.filter(name__startswith=u"Extra").delete()
+
+    def test_formset_fields(self):
+        formset_class = bulk_modelformset_factory(
+            EventTemplate, diary_forms.EventTemplateForm, can_delete=True)
+        formset = formset_class(queryset=EventTemplate.objects.filter(pk=1))
+        form = formset.forms[0]
+        # Same fields in the same order as the plain form:
+        self.assertEqual([name for name in form.fields if name not in (u"id", u"DELETE")],
+                         diary_forms.EventTemplateForm().fields.keys())
+        self.assertEqual(sorted(form.initial['roles']),
+                         sorted(EventTemplate.objects.get(pk=1).roles.values_list('pk', flat=True)))
+        # (The form class isn't modified)
+        self.assertFalse(hasattr(diary_forms.EventTemplateForm, 'bulk_m2m_fields'))
+
+    def test_formset_save_no_commit(self):
+        formset_class = bulk_modelformset_factory(
+            EventTemplate, diary_forms.EventTemplateForm)
+        template = EventTemplate.objects.get(pk=1)
+        data = {
+            u"form-TOTAL_FORMS": 2,
+            u"form-INITIAL_FORMS": 1,
+            u"form-MAX_NUM_FORMS": 1000,
+            u"form-0-id": template.pk,
+            u"form-0-name": u"Renamed template",
+            u"form-0-roles": [2, 3],
+            u"form-1-name": u"New template",
+            u"form-1-roles": [1],
+            u"form-1-tags": [1],
+        }
+        formset = formset_class(data, queryset=EventTemplate.objects.filter(pk=template.pk))
+        self.assertTrue(formset.is_valid())
+        for obj in formset.save(commit=False):
+            obj.save()
+        formset.save_m2m()
+
+        template = EventTemplate.objects.get(pk=template.pk)
+        self.assertEqual(template.name, u"Renamed template")
+        self.assertEqual(sorted(template.roles.values_list('pk', flat=True)), [2, 3])
+        new_template = EventTemplate.objects.get(name=u"New template")
+        self.assertEqual(list(new_template.roles.values_list('pk', flat=True)), [1])
+        self.assertEqual(list(new_template.tags.values_list('pk', flat=True)), [1])
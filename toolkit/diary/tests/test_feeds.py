@@ -76,3 +76,23 @@ class FeedTests(DiaryTestsMixin, TestCase):
         tree = self._get_etree()
         items = tree.find('channel').findall("item")
         self.assertEqual(len(items), 0)
+
+    def test_feed_not_modified(self):
+        url = reverse("view-diary-rss")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @patch('django.utils.timezone.now')
+    def test_feed_modified(self, now_patch):
+        now_patch.return_value = self._fake_now + datetime.timedelta(days=5)
+        url = reverse("view-diary-rss")
+        etag = self.client.get(url)['ETag']
+
+        # Once the showing has started it drops out of the feed:
+        now_patch.return_value = self._fake_now + datetime.timedelta(days=9)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
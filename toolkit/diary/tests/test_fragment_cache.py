@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.urlresolvers import reverse
+from django.core.management import call_command
+
+from toolkit.diary.models import Event, Showing, MediaItem
+import toolkit.diary.fragment_cache as fragment_cache
+
+from .common import DiaryTestsMixin
+
+
+class EventFragmentCacheTests(DiaryTestsMixin, TestCase):
+
+    def setUp(self):
+        super(EventFragmentCacheTests, self).setUp()
+        self.event = Event.objects.get(name="Event three title")
+        self.url = reverse("single-event-view", kwargs={"event_id": self.event.pk})
+
+    def _key(self):
+        event = Event.objects.with_main_mediaitem().get(pk=self.event.pk)
+        return fragment_cache.fragment_key(event, event.showings.public())
+
+    @override_settings(EVENT_FRAGMENT_CACHE_STATS=True)
+    def test_fragment_cached(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, u"Event three title")
+        self.assertEqual(fragment_cache.stats(), {'hits': 0, 'misses': 1})
+
+        self.assertIn(u"Event three title", fragment_cache.get_fragment(self._key()))
+
+        # Shared with the programme pages:
+        self.client.get(reverse("day-view", kwargs={"year": "2013", "month": "4", "day": "13"}))
+        self.assertEqual(fragment_cache.stats(), {'hits': 2, 'misses': 1})
+
+    def test_event_change_invalidates(self):
+        key = self._key()
+        Event.objects.get(pk=self.event.pk).save()
+        self.assertNotEqual(self._key(), key)
+
+    def test_showing_change_invalidates(self):
+        key = self._key()
+        showing = Showing.objects.public().get(event=self.event)
+        Showing.objects.filter(pk=showing.pk).update(cancelled=True)
+        self.assertNotEqual(self._key(), key)
+
+    def test_media_change_invalidates(self):
+        key = self._key()
+        media_item = MediaItem(media_file=u"diary/image.jpg", credit=u"Someone")
+        media_item.save()
+        self.event.media.add(media_item)
+        key_with_media = self._key()
+        self.assertNotEqual(key_with_media, key)
+
+        # Doesn't change the event:
+        media_item.credit = u"Someone else"
+        media_item.save()
+        self.assertNotEqual(self._key(), key_with_media)
+
+    def test_other_event_unaffected(self):
+        key = self._key()
+        Event.objects.exclude(pk=self.event.pk)[0].save()
+        self.assertEqual(self._key(), key)
+
+    def test_stats_off(self):
+        self.client.get(self.url)
+        self.assertEqual(fragment_cache.stats(), {'hits': 0, 'misses': 0})
+
+    @override_settings(EVENT_FRAGMENT_CACHE_STATS=True)
+    def test_stats_command(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        output = StringIO()
+        call_command('event_fragment_stats', reset=True, stdout=output)
+        self.assertIn("Hits: 1  Misses: 1  Hit rate: 50.0%", output.getvalue())
+        self.assertEqual(fragment_cache.stats(), {'hits': 0, 'misses': 0})
@@ -1,11 +1,15 @@
 from __future__ import absolute_import
 import json
 
-from mock import patch
+from mock import patch, Mock
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
 
+from toolkit.members.models import Mailout
+import toolkit.members.mailout_progress as mailout_progress
+
 from .common import DiaryTestsMixin
 
 
@@ -137,9 +141,10 @@ class MailoutTests(DiaryTestsMixin, TestCase):
             }
         })
 
+    @patch("toolkit.diary.mailout_views.uuid")
     @patch("toolkit.members.tasks.send_mailout")
-    def test_exec_view_good_content(self, send_mailout_patch):
-        send_mailout_patch.delay.return_value.task_id = u'dummy-task-id'
+    def test_exec_view_good_content(self, send_mailout_patch, uuid_patch):
+        uuid_patch.return_value = u'dummy-task-id'
 
         url = reverse("exec-mailout")
         response = self.client.post(url, data={
@@ -156,6 +161,15 @@ class MailoutTests(DiaryTestsMixin, TestCase):
             u"task_id": u"dummy-task-id"
         })
 
+        mailout = Mailout.objects.get()
+        self.assertEqual(mailout.subject, u"Mailout of the month")
+        self.assertEqual(mailout.body, u"Blah\nBlah\nBlah")
+        self.assertEqual(mailout.task_id, u"dummy-task-id")
+        send_mailout_patch.apply_async.assert_called_once_with((mailout.pk,), task_id=u"dummy-task-id")
+        # Progress store is ready for the progress view:
+        self.assertEqual(mailout_progress.get(u"dummy-task-id"), {
+            'total': None, 'sent': 0, 'error_count': 0, 'result': None})
+
     def test_exec_view_get_progress_invalid_method(self):
         url = reverse("mailout-progress")
         response = self.client.post(url, data={u"task_id": u"dummy-task-id"})
@@ -299,6 +313,159 @@ class MailoutTests(DiaryTestsMixin, TestCase):
             u'task_id': u'dummy-task-id'
         }, response_data)
 
+    def _batched_async_results(self, report_state, report_result):
+        # AsyncResult mocks for a mailout split into batches
+        results = {
+            u"dummy-task-id": Mock(state=u"SUCCESS", task_id=u"dummy-task-id", result={
+                'total': 1000,
+                'batches': [u"batch-1", u"batch-2", u"batch-3"],
+                'report': u"report"}),
+            u"batch-1": Mock(state=u"SUCCESS", result={'sent': 500, 'errors': [],
+                                                       'error_count': 0, 'failure': None}),
+            u"batch-2": Mock(state=u"STARTED", result=None),
+            u"batch-3": Mock(state=u"PENDING", result=None),
+            u"report": Mock(state=report_state, result=report_result),
+        }
+        return lambda id: results[id]
+
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_batches(self, async_result_patch):
+        async_result_patch.side_effect = self._batched_async_results(u"PENDING", None)
+
+        url = reverse("mailout-progress")
+        response = self.client.get(url, data={u"task_id": u"dummy-task-id"})
+
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        self.assertEqual({
+            u'complete': False,
+            u'error': None,
+            u'error_msg': None,
+            u'sent_count': None,
+            u'progress': 50,
+            u'task_id': u'dummy-task-id'
+        }, response_data)
+
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_batches_complete(self, async_result_patch):
+        async_result_patch.side_effect = self._batched_async_results(u"SUCCESS", (False, 1000, "Ok"))
+
+        url = reverse("mailout-progress")
+        response = self.client.get(url, data={u"task_id": u"dummy-task-id"})
+
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        self.assertEqual({
+            u'complete': True,
+            u'error': False,
+            u'error_msg': u'Ok',
+            u'sent_count': 1000,
+            u'progress': 100,
+            u'task_id': u'dummy-task-id'
+        }, response_data)
+
+    def _store_progress(self):
+        # Progress of a mailout to 1000 members, in 3 batches:
+        mailout_progress.start(u"dummy-task-id")
+        mailout_progress.set_batches(u"dummy-task-id", 1000, 3)
+        mailout_progress.update_batch(u"dummy-task-id", 0, 500, 2)
+        mailout_progress.update_batch(u"dummy-task-id", 1, 215, 0)
+
+    def _get_progress(self, **params):
+        params[u"task_id"] = u"dummy-task-id"
+        url = reverse("mailout-progress")
+        response = self.client.get(url, data=params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_stored(self, async_result_patch):
+        async_result_patch.return_value.state = u"SUCCESS"
+        self._store_progress()
+
+        self.assertEqual(self._get_progress(), {
+            u'complete': False,
+            u'error': None,
+            u'error_msg': None,
+            u'sent_count': None,
+            u'progress': 71,
+            u'task_id': u'dummy-task-id'
+        })
+        self.assertFalse(async_result_patch.called)
+
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_stored_pending(self, async_result_patch):
+        async_result_patch.return_value.state = u"PENDING"
+        mailout_progress.start(u"dummy-task-id")
+
+        response_data = self._get_progress()
+
+        self.assertEqual(response_data[u'complete'], False)
+        self.assertEqual(response_data[u'progress'], 0)
+
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_stored_complete(self, async_result_patch):
+        self._store_progress()
+        mailout_progress.set_result(u"dummy-task-id", (False, 1000, "Ok"))
+
+        self.assertEqual(self._get_progress(progress=71), {
+            u'complete': True,
+            u'error': False,
+            u'error_msg': u'Ok',
+            u'sent_count': 1000,
+            u'progress': 100,
+            u'task_id': u'dummy-task-id'
+        })
+        # Didn't need to ask celery:
+        self.assertFalse(async_result_patch.called)
+
+    @patch("celery.result.AsyncResult")
+    @override_settings(MAILOUT_PROGRESS_LONG_POLL_TIMEOUT=0)
+    def test_exec_view_get_progress_stored_failure(self, async_result_patch):
+        # send_mailout died before it could record anything:
+        async_result_patch.return_value.state = u"FAILURE"
+        async_result_patch.return_value.result = u"Something went wrong"
+        mailout_progress.start(u"dummy-task-id")
+
+        response_data = self._get_progress(progress=0)
+
+        self.assertEqual(response_data[u'complete'], True)
+        self.assertEqual(response_data[u'error'], True)
+        self.assertEqual(response_data[u'error_msg'], u"Something went wrong")
+
+    @patch("time.sleep")
+    @patch("celery.result.AsyncResult")
+    def test_exec_view_get_progress_long_poll(self, async_result_patch, sleep_patch):
+        async_result_patch.return_value.state = u"SUCCESS"
+        self._store_progress()
+        # Third batch starts while waiting:
+        def sleep(seconds):
+            if sleep_patch.call_count == 2:
+                mailout_progress.update_batch(u"dummy-task-id", 2, 100, 0)
+        sleep_patch.side_effect = sleep
+
+        response_data = self._get_progress(progress=71)
+
+        self.assertEqual(response_data[u'progress'], 81)
+        self.assertEqual(sleep_patch.call_count, 2)
+        # Progress changed, so no need to check on the task:
+        self.assertFalse(async_result_patch.called)
+
+    @patch("time.sleep")
+    @patch("celery.result.AsyncResult")
+    @override_settings(MAILOUT_PROGRESS_LONG_POLL_TIMEOUT=0)
+    def test_exec_view_get_progress_long_poll_timeout(self, async_result_patch, sleep_patch):
+        async_result_patch.return_value.state = u"SUCCESS"
+        self._store_progress()
+
+        response_data = self._get_progress(progress=71)
+
+        self.assertEqual(response_data[u'complete'], False)
+        self.assertEqual(response_data[u'progress'], 71)
+        self.assertFalse(sleep_patch.called)
+        # No progress, so checked the task was still alive:
+        async_result_patch.assert_called_once_with(id=u"dummy-task-id")
+
     @patch("celery.result.AsyncResult")
     def test_exec_view_get_bad_celery_progress_data(self, async_result_patch):
         async_result_patch.return_value.state = u"PROGRESS"
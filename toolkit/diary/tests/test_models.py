@@ -1,13 +1,25 @@
 from __future__ import absolute_import
 
+import os
+import hashlib
 import pytz
-from datetime import datetime, date
+from StringIO import StringIO
+from datetime import datetime, date, timedelta
 
 from django.test import TestCase
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 
+import html2text
 import django.db
 from django.core.exceptions import ValidationError
-from toolkit.diary.models import Showing, Event, PrintedProgramme, EventTag
+from mock import patch
+
+from toolkit.diary.models import (Showing, Event, PrintedProgramme, EventTag, MediaItem,
+                                  EventTemplate)
+import toolkit.diary.page_cache as page_cache
 
 from .common import DiaryTestsMixin
 
@@ -37,6 +49,56 @@ class ShowingModelCustomQueryset(DiaryTestsMixin, TestCase):
             self.assertFalse(showing.hide_in_programme)
             self.assertFalse(showing.event.private)
 
+    def test_public_no_join(self):
+        query = str(Showing.objects.public().start_in_range(
+            datetime(2013, 4, 1, tzinfo=pytz.utc), datetime(2013, 5, 1, tzinfo=pytz.utc)).query)
+        self.assertNotIn("Events", query)
+
+    def test_is_public_follows_showing(self):
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+        self.assertTrue(showing.is_public)
+
+        showing.hide_in_programme = True
+        showing.save(force=True)
+        self.assertFalse(Showing.objects.get(pk=self.e2s2.pk).is_public)
+
+        showing.hide_in_programme = False
+        showing.save(force=True)
+        self.assertTrue(Showing.objects.get(pk=self.e2s2.pk).is_public)
+
+    def test_is_public_private_event(self):
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+        Event.objects.filter(pk=showing.event_id).update(private=True)
+        showing.save(force=True)
+        self.assertFalse(Showing.objects.get(pk=self.e2s2.pk).is_public)
+
+    def test_is_public_uses_loaded_event(self):
+        showing = Showing.objects.select_related('event').get(pk=self.e2s2.pk)
+        with self.assertNumQueries(0):
+            showing.set_is_public()
+        self.assertTrue(showing.is_public)
+
+        # No need to look at the event at all:
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+        showing.hide_in_programme = True
+        with self.assertNumQueries(0):
+            showing.set_is_public()
+        self.assertFalse(showing.is_public)
+
+    def test_is_public_follows_event(self):
+        event = Event.objects.get(name="Event two title")
+        event.private = True
+        event.save()
+        self.assertEqual(list(event.showings.filter(is_public=True)), [])
+
+        event.private = False
+        event.save()
+        # Only the confirmed and not hidden showings:
+        self.assertEqual(sorted(event.showings.filter(is_public=True).values_list('pk', flat=True)),
+                         sorted(event.showings.filter(confirmed=True, hide_in_programme=False)
+                                              .values_list('pk', flat=True)))
+        self.assertIn(self.e2s2, Showing.objects.public())
+
     def test_manager_not_cancelled(self):
         records = list(Showing.objects.not_cancelled())
         # From the fixtures, there are 7 showings that aren't cancelled
@@ -149,6 +211,254 @@ class EventModelLegacyCopy(TestCase):
         self.assertEqual(self.event.copy_plaintext, expected)
 
 
+class EventModelRenderedCopy(TestCase):
+
+    def setUp(self):
+        self.event = Event(name="Test event", legacy_copy=False,
+                           copy=u"<p>Some <b>copy</b></p>")
+        self.event.save()
+
+    def test_rendered_on_save(self):
+        reloaded = Event.objects.get(id=self.event.pk)
+        self.assertEqual(reloaded.rendered_copy_html, u"<p>Some <b>copy</b></p>")
+        self.assertEqual(reloaded.rendered_copy_plaintext.strip(), u"Some copy")
+
+    def test_rerendered_when_copy_changes(self):
+        reloaded = Event.objects.get(id=self.event.pk)
+        reloaded.copy = u"<p>New copy</p>"
+        # Copy reflects unsaved changes:
+        self.assertEqual(reloaded.copy_plaintext.strip(), u"New copy")
+        reloaded.save()
+
+        reloaded = Event.objects.get(id=self.event.pk)
+        self.assertEqual(reloaded.rendered_copy_html, u"<p>New copy</p>")
+        self.assertEqual(reloaded.rendered_copy_plaintext.strip(), u"New copy")
+        self.assertEqual(reloaded.copy_html, u"<p>New copy</p>")
+
+    def test_no_copy(self):
+        event = Event(name="No copy")
+        event.save()
+        self.assertEqual(event.copy_html, u"")
+        self.assertEqual(event.copy_plaintext.strip(), u"")
+
+    def test_deferred_copy(self):
+        event = Event.objects.only('id', 'name').get(id=self.event.pk)
+        self.assertEqual(event.copy_html, u"<p>Some <b>copy</b></p>")
+
+    def test_html2text_globals_untouched(self):
+        original = (html2text.BODY_WIDTH, html2text.UNICODE_SNOB, html2text.IGNORE_EMPHASIS)
+        Event(name="Another", copy=u"<p>Copy</p>").save()
+        self.assertEqual(original, (html2text.BODY_WIDTH, html2text.UNICODE_SNOB,
+                                    html2text.IGNORE_EMPHASIS))
+
+    def test_render_command(self):
+        Event.objects.filter(pk=self.event.pk).update(rendered_copy_html=None,
+                                                      rendered_copy_plaintext=None)
+        updated_at = Event.objects.get(id=self.event.pk).updated_at
+
+        call_command('render_event_copy', stdout=StringIO())
+
+        reloaded = Event.objects.get(id=self.event.pk)
+        self.assertEqual(reloaded.rendered_copy_html, u"<p>Some <b>copy</b></p>")
+        self.assertEqual(reloaded.rendered_copy_plaintext.strip(), u"Some copy")
+        self.assertEqual(reloaded.updated_at, updated_at)
+
+
+class EventMainMediaItemTests(TestCase):
+
+    def setUp(self):
+        self.event = Event(name="Test event")
+        self.event.save()
+        self.media_item = MediaItem(credit=u"Credit")
+        self.media_item.save()
+
+    def test_no_media(self):
+        self.assertEqual(Event.objects.get(id=self.event.pk).get_main_mediaitem(), None)
+
+    def test_get(self):
+        self.event.media.add(self.media_item)
+        event = Event.objects.get(id=self.event.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(event.get_main_mediaitem(), self.media_item)
+            # Result is kept:
+            self.assertEqual(event.get_main_mediaitem(), self.media_item)
+
+    def test_get_prefetched(self):
+        self.event.media.add(self.media_item)
+        with self.assertNumQueries(2):
+            events = list(Event.objects.with_main_mediaitem())
+        with self.assertNumQueries(0):
+            media = [event.get_main_mediaitem() for event in events]
+        self.assertEqual(media, [self.media_item])
+
+    def test_set_and_clear_prefetched(self):
+        event = Event.objects.with_main_mediaitem().get(id=self.event.pk)
+        self.assertEqual(event.get_main_mediaitem(), None)
+
+        event.set_main_mediaitem(self.media_item)
+        self.assertEqual(event.get_main_mediaitem(), self.media_item)
+
+        event.clear_main_mediaitem()
+        self.assertEqual(event.get_main_mediaitem(), None)
+        self.assertEqual(list(Event.objects.get(id=self.event.pk).media.all()), [])
+
+
+@patch("toolkit.util.tasks.generate_thumbnails")
+class MediaItemContentStoreTests(TestCase):
+
+    def setUp(self):
+        # (Random content, so files left by other tests are never reused)
+        self.content = os.urandom(64)
+        self.digest = hashlib.sha1(self.content).hexdigest()
+        self.names = set()
+
+    def tearDown(self):
+        for name in self.names:
+            default_storage.delete(name)
+
+    def _new_item(self, name="upload.JPG"):
+        media_item = MediaItem(media_file=SimpleUploadedFile(name, self.content))
+        media_item.save()
+        self.names.add(media_item.media_file.name)
+        return media_item
+
+    def test_stored_by_content_hash(self, task_mock):
+        media_item = self._new_item()
+        self.assertEqual(media_item.content_hash, self.digest)
+        self.assertEqual(media_item.media_file.name, u"diary/{0}.jpg".format(self.digest))
+        self.assertTrue(default_storage.exists(media_item.media_file.name))
+
+    def test_same_content_reuses_file(self, task_mock):
+        first = self._new_item()
+        second = self._new_item("another_name.jpg")
+        self.assertEqual(second.media_file.name, first.media_file.name)
+        self.assertEqual(self.names, set([first.media_file.name]))
+        # Thumbnails were only queued for the first:
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+
+    @patch("toolkit.util.image.get_mimetype")
+    def test_mimetype_only_set_when_content_changes(self, get_mimetype_patch, task_mock):
+        get_mimetype_patch.return_value = "image/jpeg"
+        media_item = self._new_item()
+        self.assertEqual(get_mimetype_patch.call_count, 1)
+
+        media_item = MediaItem.objects.get(pk=media_item.pk)
+        media_item.credit = u"New credit"
+        media_item.save()
+        self.assertEqual(get_mimetype_patch.call_count, 1)
+
+    def test_dedupe_command(self, task_mock):
+        old_names = []
+        for name in ("dedupe_a.jpg", "dedupe_b.jpg"):
+            media_item = MediaItem()
+            media_item.media_file.save(name, ContentFile(self.content))
+            old_names.append(media_item.media_file.name)
+        self.names.update(old_names)
+        new_name = u"diary/{0}.jpg".format(self.digest)
+        self.names.add(new_name)
+
+        call_command('dedupe_media_files', stdout=StringIO())
+
+        items = MediaItem.objects.filter(media_file__in=old_names + [new_name])
+        self.assertEqual([item.media_file.name for item in items], [new_name, new_name])
+        self.assertEqual([item.content_hash for item in items], [self.digest, self.digest])
+        self.assertTrue(default_storage.exists(new_name))
+        for name in old_names:
+            self.assertFalse(default_storage.exists(name))
+
+
+class EventAddShowingsTests(DiaryTestsMixin, TestCase):
+
+    def setUp(self):
+        super(EventAddShowingsTests, self).setUp()
+        self.event = Event(name=u"New event", template=EventTemplate.objects.get(id=1))
+        self.event.save()
+        self.start = pytz.utc.localize(datetime(2013, 6, 2, 19, 0))
+
+    @patch('django.utils.timezone.now')
+    def test_add_showings(self, now_patch):
+        now_patch.return_value = self._fake_now
+        starts = [self.start + timedelta(days=n) for n in range(3)]
+
+        showings = self.event.add_showings(starts, booked_by=u"Someone", confirmed=True)
+
+        self.assertEqual([s.pk for s in showings],
+                         list(self.event.showings.values_list('id', flat=True)))
+        for showing in Showing.objects.filter(event=self.event):
+            self.assertTrue(showing.is_public)
+            self.assertEqual(showing.booked_by, u"Someone")
+            self.assertEqual([e.role_id for e in showing.rotaentry_set.all()], [1])
+
+    @patch('django.utils.timezone.now')
+    def test_add_showings_invalidates_cache(self, now_patch):
+        now_patch.return_value = self._fake_now
+        key = page_cache.page_key(date(2013, 6, 1), date(2013, 6, 1), 7, None)
+
+        self.event.add_showings([self.start], booked_by=u"Someone")
+
+        self.assertNotEqual(page_cache.page_key(date(2013, 6, 1), date(2013, 6, 1), 7, None), key)
+
+    @patch('django.utils.timezone.now')
+    def test_add_showings_in_past(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        with self.assertRaises(django.db.IntegrityError):
+            self.event.add_showings([self.start, self.start - timedelta(days=2)],
+                                    booked_by=u"Someone")
+        self.assertEqual(self.event.showings.count(), 0)
+
+    @patch('django.utils.timezone.now')
+    def test_add_showings_same_start(self, now_patch):
+        now_patch.return_value = self._fake_now
+
+        with self.assertRaises(django.db.IntegrityError):
+            self.event.add_showings([self.start, self.start + timedelta(days=1), self.start],
+                                    booked_by=u"Someone")
+        self.assertEqual(self.event.showings.count(), 0)
+
+
+class ShowingRotaTests(DiaryTestsMixin, TestCase):
+
+    def setUp(self):
+        super(ShowingRotaTests, self).setUp()
+        # Has 6 of role 1:
+        self.showing = Showing.objects.get(event__name=u"Event three title")
+
+    def _rota(self, showing):
+        return sorted(showing.rotaentry_set.values_list('role_id', 'rank'))
+
+    def test_update_rota(self):
+        with self.assertNumQueries(4):
+            self.showing.update_rota({1: 2, 2: 3, 3: 0})
+        self.assertEqual(self._rota(self.showing), [(1, 1), (1, 2), (2, 1), (2, 2), (2, 3)])
+
+    def test_update_rota_adds_after_highest_rank(self):
+        self.showing.rotaentry_set.filter(rank__in=(2, 3)).delete()
+        self.showing.update_rota({1: 6})
+        self.assertEqual(self._rota(self.showing),
+                         [(1, 1), (1, 4), (1, 5), (1, 6), (1, 7), (1, 8)])
+
+    def test_update_rota_unchanged(self):
+        with self.assertNumQueries(1):
+            self.showing.update_rota({1: 6, 2: 0})
+        self.assertEqual(len(self._rota(self.showing)), 6)
+
+    def test_clone_rota(self):
+        target = Showing.objects.get(pk=self.e2s1.pk)
+        with self.assertNumQueries(2):
+            target.clone_rota_from_showing(self.showing)
+        self.assertEqual(self._rota(target),
+                         [(1, 1), (1, 2), (1, 3), (1, 4), (1, 5), (1, 6),
+                          (2, 1), (3, 1)])
+
+    def test_reset_rota(self):
+        event = self.showing.event
+        event.template = EventTemplate.objects.get(id=1)
+        event.save()
+        self.showing.reset_rota_to_default()
+        self.assertEqual(self._rota(self.showing), [(1, 1)])
+
+
 class PrintedProgrammeModelTests(TestCase):
 
     def test_month_ok(self):
@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 import json
+from datetime import date, timedelta
 
 from django.test import TestCase
 from django.core.urlresolvers import reverse, resolve
 import django.http
 
+from toolkit.diary.models import Showing, Event, PrintedProgramme, MediaItem
+from toolkit.util.db import commit_on_success
+
 from .common import DiaryTestsMixin
 
 
@@ -84,6 +88,22 @@ class PublicDiaryViews(DiaryTestsMixin, TestCase):
                          u"copy": u"Event three Copy"
                          }])
 
+    def test_day_json_query_count(self):
+        # Number of queries shouldn't depend on the number of showings:
+        source = Showing.objects.get(start__month=4, start__day=13)
+        for hours in range(1, 5):
+            Showing(copy_from=source, start_offset=timedelta(hours=hours)).save(force=True)
+
+        url = reverse("day-view-json", kwargs={"year": "2013", "month": "4", "day": "13"})
+        # One for the showings, one each for media and tags:
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+
+        data = json.loads(response.content)
+        self.assertEqual(len(data), 5)
+        for item in data:
+            self.assertEqual(item['tags'], u"tag two")
+
     # View of individual showing:
     def test_view_showing(self):
         url = reverse("single-showing-view", kwargs={"showing_id": str(self.e2s2.pk)})
@@ -117,6 +137,17 @@ class PublicDiaryViews(DiaryTestsMixin, TestCase):
         self.assertNotContains(response, "4 Apr")
         self.assertNotContains(response, "5 Apr")
 
+    def test_view_event_query_count(self):
+        media_item = MediaItem(credit=u"Media credit")
+        media_item.save()
+        Event.objects.get(id=2).media.add(media_item)
+
+        url = reverse("single-event-view", kwargs={"event_id": "2"})
+        # Conditional GET fingerprint, event, media and showings:
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, u"Media credit")
+
     def test_view_event_legacy(self):
         url = reverse("single-event-view-legacyid", kwargs={"legacy_id": "100"})
         response = self.client.get(url)
@@ -132,6 +163,232 @@ class PublicDiaryViews(DiaryTestsMixin, TestCase):
     # TODO: Cancelled/confirmed/visible/TTT
 
 
+class ProgrammeCacheTests(DiaryTestsMixin, TestCase):
+
+    """Test caching of rendered programme pages"""
+
+    def setUp(self):
+        super(ProgrammeCacheTests, self).setUp()
+        self.url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+
+    def test_second_request_cached(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, u'Event three title')
+
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(self.url)
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+
+    def test_different_parameters_not_shared(self):
+        self.client.get(self.url)
+
+        response = self.client.get(self.url, data={'daysahead': 5})
+        self.assertContains(response, u'Event two title')
+        self.assertNotContains(response, u'Event three title')
+
+    def test_event_change_invalidates(self):
+        self.client.get(self.url)
+
+        event = Event.objects.get(name="Event three title")
+        event.name = u"Renamed event"
+        event.save()
+
+        response = self.client.get(self.url)
+        self.assertContains(response, u'Renamed event')
+        self.assertNotContains(response, u'Event three title')
+
+    def test_showing_change_invalidates(self):
+        self.client.get(self.url)
+
+        showing = Showing.objects.get(event__name=u"Event three title")
+        showing.hide_in_programme = True
+        showing.save(force=True)
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, u'Event three title')
+
+    def test_showing_moved_invalidates_old_month(self):
+        self.client.get(self.url)
+
+        showing = Showing.objects.get(event__name=u"Event three title")
+        showing.start = showing.start.replace(month=5)
+        showing.save(force=True)
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, u'Event three title')
+
+    def test_invalidated_after_commit(self):
+        self.client.get(self.url)
+
+        with commit_on_success():
+            showing = Showing.objects.get(event__name=u"Event three title")
+            showing.hide_in_programme = True
+            showing.save(force=True)
+            # Not committed yet (so another request could still read the old
+            # data, and mustn't cache it under a new version); still cached:
+            with self.assertNumQueries(0):
+                self.client.get(self.url)
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, u'Event three title')
+
+    def test_media_item_deleted_invalidates(self):
+        media_item = MediaItem(media_file=u"diary/image.jpg", credit=u"Some media credit")
+        media_item.save()
+        Event.objects.get(name=u"Event three title").media.add(media_item)
+        response = self.client.get(self.url)
+        self.assertContains(response, u'Some media credit')
+
+        media_item.delete()
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, u'Some media credit')
+
+    def test_change_in_other_month_doesnt_invalidate(self):
+        self.client.get(self.url)
+
+        # Showing in September:
+        showing = Showing.objects.get(start__month=9)
+        showing.confirmed = True
+        showing.save(force=True)
+
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+    def test_printed_programme_change_invalidates(self):
+        self.client.get(self.url)
+
+        PrintedProgramme(programme="/foo/bar.pdf", month=date(2013, 4, 1)).save()
+
+        response = self.client.get(self.url)
+        self.assertContains(response, u'Printed programme for Apr 2013')
+
+
+class ConditionalGetTests(DiaryTestsMixin, TestCase):
+
+    """Test ETag / Last-Modified handling for the public views"""
+
+    def _assert_not_modified(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, '')
+        return response
+
+    def test_programme_not_modified(self):
+        self._assert_not_modified(reverse("month-view", kwargs={"year": "2013", "month": "4"}))
+
+    def test_programme_not_modified_no_query(self):
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        etag = self.client.get(url)['ETag']
+        # (The fingerprint comes from the page cache)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_programme_no_last_modified(self):
+        # (Deleting a showing wouldn't change it)
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_programme_modified(self):
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        etag = self.client.get(url)['ETag']
+
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+        showing.hide_in_programme = True
+        showing.save(force=True)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_programme_showing_deleted(self):
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        etag = self.client.get(url)['ETag']
+
+        Showing.objects.filter(pk=self.e2s2.pk).delete()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_programme_media_modified(self):
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        media_item = MediaItem(media_file=u"diary/image.jpg", credit=u"Someone")
+        media_item.save()
+        Event.objects.get(pk=2).media.add(media_item)
+        etag = self.client.get(url)['ETag']
+
+        media_item.credit = u"Someone else"
+        media_item.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_programme_different_range(self):
+        url = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, data={'daysahead': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_event_not_modified(self):
+        self._assert_not_modified(reverse("single-event-view", kwargs={"event_id": "2"}))
+
+    def test_event_modified(self):
+        url = reverse("single-event-view", kwargs={"event_id": "2"})
+        etag = self.client.get(url)['ETag']
+
+        event = Event.objects.get(pk=2)
+        event.copy = u"New copy"
+        event.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, u"New copy")
+
+    def test_event_media_modified(self):
+        url = reverse("single-event-view", kwargs={"event_id": "2"})
+        media_item = MediaItem(media_file=u"diary/image.jpg", credit=u"Someone")
+        media_item.save()
+        Event.objects.get(pk=2).media.add(media_item)
+        etag = self.client.get(url)['ETag']
+
+        # Doesn't change the event:
+        media_item.credit = u"Someone else"
+        media_item.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_event(self):
+        url = reverse("single-event-view", kwargs={"event_id": "1000"})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_archive_not_modified(self):
+        self._assert_not_modified(reverse("archive-view-index"))
+        self._assert_not_modified(reverse("archive-view-year", kwargs={"year": "2013"}))
+        self._assert_not_modified(reverse("archive-view-month", kwargs={"year": "2013", "month": "4"}))
+
+    def test_archive_media_modified(self):
+        url = reverse("archive-view-month", kwargs={"year": "2013", "month": "4"})
+        media_item = MediaItem(media_file=u"diary/image.jpg", credit=u"Someone")
+        media_item.save()
+        Event.objects.get(pk=2).media.add(media_item)
+        etag = self.client.get(url)['ETag']
+
+        media_item.credit = u"Someone else"
+        media_item.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
 class UrlTests(DiaryTestsMixin, TestCase):
 
     """Test the regular expressions in urls.py"""
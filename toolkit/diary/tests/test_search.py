@@ -0,0 +1,122 @@
+from __future__ import absolute_import
+
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.core.management import call_command
+
+from toolkit.diary.models import Event, EventTag, EventSearchTerm
+import toolkit.diary.search as search
+
+from .common import DiaryTestsMixin
+
+
+class SearchIndexTests(DiaryTestsMixin, TestCase):
+
+    def _event_ids(self, text, include_copy=False):
+        return set(search.search_events(text, include_copy))
+
+    def test_tokenise(self):
+        self.assertEqual(search.tokenise(u"Some Words, a Thing & \u0175\u00ebird-ness!"),
+                         [u"some", u"words", u"thing", u"\u0175\u00ebird", u"ness"])
+
+    def test_index_updated_on_save(self):
+        event = Event.objects.get(name="Event three title")
+        self.assertIn(event.pk, self._event_ids(u"three"))
+
+        event.name = u"Renamed"
+        event.save()
+        self.assertNotIn(event.pk, self._event_ids(u"three"))
+        self.assertEqual(self._event_ids(u"renamed"), set([event.pk]))
+
+    def test_prefix_match(self):
+        event = Event.objects.get(name="Event three title")
+        self.assertEqual(self._event_ids(u"thr"), set([event.pk]))
+        self.assertEqual(self._event_ids(u"hree"), set())
+
+    def test_copy_only_if_requested(self):
+        event = Event(name=u"Something", copy=u"<p>A <b>marvellous</b> film</p>")
+        event.save()
+        self.assertEqual(self._event_ids(u"marvellous"), set())
+        self.assertEqual(self._event_ids(u"marvellous", include_copy=True), set([event.pk]))
+
+    def test_all_words_must_match(self):
+        e3 = Event.objects.get(name="Event three title")
+        self.assertEqual(self._event_ids(u"three title"), set([e3.pk]))
+        self.assertEqual(self._event_ids(u"three four"), set())
+
+    def test_tags(self):
+        tagged = set(Event.objects.filter(tags__name=u"tag two").values_list('pk', flat=True))
+        self.assertEqual(self._event_ids(u"tag two"), tagged)
+
+    def test_tag_renamed(self):
+        tag = EventTag.objects.get(name=u"tag two")
+        tag.name = u"rhubarb"
+        tag.save()
+        tagged = set(Event.objects.filter(tags=tag).values_list('pk', flat=True))
+        self.assertEqual(self._event_ids(u"rhubarb"), tagged)
+
+    def test_tag_removed(self):
+        event = Event.objects.get(name="Event three title")
+        event.tags.clear()
+        self.assertNotIn(event.pk, self._event_ids(u"tag two"))
+
+    def test_ranking(self):
+        in_copy = Event(name=u"Something", copy=u"About an aardvark")
+        in_copy.save()
+        in_name = Event(name=u"Aardvark", copy=u"Something else")
+        in_name.save()
+        scores = search.search_events(u"aardvark", True)
+        self.assertTrue(scores[in_name.pk] > scores[in_copy.pk])
+
+    def test_unsearchable(self):
+        self.assertEqual(search.search_events(u"a ?", False), None)
+
+    def test_rebuild(self):
+        before = set(EventSearchTerm.objects.values_list('event_id', 'term', 'field', 'weight'))
+        EventSearchTerm.objects.all().delete()
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        after = set(EventSearchTerm.objects.values_list('event_id', 'term', 'field', 'weight'))
+        self.assertEqual(before, after)
+
+
+class ArchiveSearchViewTests(DiaryTestsMixin, TestCase):
+
+    url = reverse("archive-search")
+
+    def test_search(self):
+        response = self.client.get(self.url, {'search_term': u'three'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s.event.name for s in response.context['showing_list']],
+                         [u"Event three title"])
+        self.assertContains(response, u"1 Result")
+
+    def test_search_ranked(self):
+        Event.objects.filter(name=u"Event three title").update(name=u"Event three event")
+        search.rebuild_index()
+
+        response = self.client.get(self.url, {'search_term': u'event'})
+        self.assertEqual(response.status_code, 200)
+        names = [s.event.name for s in response.context['showing_list']]
+        self.assertEqual(names[0], u"Event three event")
+        # Only public showings:
+        self.assertEqual(sorted(names), [u"Event four titl\u0113", u"Event three event",
+                                         u"Event two title", u"Event two title"])
+
+    def test_search_fallback(self):
+        # Single characters aren't indexed:
+        response = self.client.get(self.url, {'search_term': u'e'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['showing_list']), 4)
+
+    def test_pagination(self):
+        response = self.client.get(self.url, {'search_term': u'event', 'page': 2})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(self.url, {'search_term': u'event', 'page': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['is_paginated'])
+        self.assertEqual(response.context['query_params'], u"search_term=event")
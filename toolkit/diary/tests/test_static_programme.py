@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from mock import patch
+
+from django.test import TestCase
+from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.conf import settings
+
+from toolkit.diary.models import Event, Showing, MediaItem
+import toolkit.diary.static_programme as static_programme
+import toolkit.diary.tasks
+from toolkit.util.db import commit_on_success
+
+from .common import DiaryTestsMixin
+
+
+class StaticProgrammeTests(DiaryTestsMixin, TestCase):
+
+    def setUp(self):
+        super(StaticProgrammeTests, self).setUp()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _file(self, path, index='index.html'):
+        return os.path.join(self.root, path.strip('/'), index)
+
+    def test_paths_for_showing(self):
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+        paths = static_programme.paths_for_showing(showing)
+
+        for path in ('/programme/', '/programme/view/2013', '/programme/view/2013/4',
+                     '/programme/view/2013/4/2', '/programme/archive/2013/4/',
+                     '/programme/event/id/{0}/'.format(showing.event_id),
+                     '/programme/event/oldid/100/', '/programme/rss/',
+                     '/programme/view/tag-two/'):
+            self.assertIn(path, paths)
+
+    def test_render_pages(self):
+        month_path = reverse("month-view", kwargs={"year": "2013", "month": "4"})
+        rss_path = reverse("view-diary-rss")
+
+        written = static_programme.render_pages([month_path, rss_path], root=self.root)
+
+        self.assertEqual(written, 2)
+        with open(self._file(month_path)) as static_file:
+            self.assertEqual(static_file.read(), self.client.get(month_path).content)
+        self.assertTrue(os.path.isfile(self._file(rss_path, 'index.rss')))
+
+    def test_missing_page_removed(self):
+        private_event = Event.objects.get(name=u"PRIVATE Event FIVE titl\u0113!")
+        path = reverse("single-event-view", kwargs={"event_id": private_event.pk})
+        os.makedirs(os.path.dirname(self._file(path)))
+        open(self._file(path), 'w').close()
+
+        written = static_programme.render_pages([path], root=self.root)
+
+        self.assertEqual(written, 0)
+        self.assertFalse(os.path.exists(self._file(path)))
+
+    def test_render_command(self):
+        with self.settings(STATIC_PROGRAMME_ROOT=self.root):
+            call_command('render_static_programme', stdout=StringIO())
+
+        event = Event.objects.get(name="Event three title")
+        for path in (reverse("default-view"),
+                     reverse("day-view", kwargs={"year": "2013", "month": "4", "day": "13"}),
+                     reverse("single-event-view", kwargs={"event_id": event.pk}),
+                     reverse("archive-view-index")):
+            self.assertTrue(os.path.isfile(self._file(path)), path)
+
+    def test_render_current_task(self):
+        with self.settings(STATIC_PROGRAMME_ROOT=self.root):
+            written = toolkit.diary.tasks.render_current_static_programme()
+
+        self.assertGreater(written, 0)
+        self.assertTrue(os.path.isfile(self._file(reverse("default-view"))))
+
+    def test_render_current_scheduled(self):
+        tasks = [entry['task'] for entry in settings.CELERYBEAT_SCHEDULE.values()]
+        self.assertIn('toolkit.diary.tasks.render_current_static_programme', tasks)
+
+    @patch("toolkit.diary.tasks.render_static_programme_pages")
+    def test_change_schedules_render(self, task_mock):
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+
+        with self.settings(STATIC_PROGRAMME_ROOT=self.root):
+            showing.save(force=True)
+
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+        paths = task_mock.apply_async.call_args[1]['args'][0]
+        self.assertIn('/programme/view/2013/4/2', paths)
+
+    @patch("toolkit.diary.tasks.render_static_programme_pages")
+    def test_render_scheduled_after_commit(self, task_mock):
+        showing = Showing.objects.get(pk=self.e2s2.pk)
+
+        with self.settings(STATIC_PROGRAMME_ROOT=self.root):
+            with commit_on_success():
+                showing.save(force=True)
+                self.assertFalse(task_mock.apply_async.called)
+
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+
+    @patch("toolkit.diary.tasks.render_static_programme_pages")
+    def test_media_item_deleted_schedules_render(self, task_mock):
+        event = Event.objects.get(name="Event three title")
+        media_item = MediaItem(media_file=u"diary/image.jpg")
+        media_item.save()
+        event.media.add(media_item)
+
+        with self.settings(STATIC_PROGRAMME_ROOT=self.root):
+            task_mock.reset_mock()
+            media_item.delete()
+
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+        paths = task_mock.apply_async.call_args[1]['args'][0]
+        self.assertIn(reverse("single-event-view", kwargs={"event_id": event.pk}), paths)
+
+    @patch("toolkit.diary.tasks.render_static_programme_pages")
+    def test_disabled(self, task_mock):
+        Showing.objects.get(pk=self.e2s2.pk).save(force=True)
+        self.assertFalse(task_mock.apply_async.called)
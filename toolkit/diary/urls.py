@@ -4,6 +4,7 @@ from toolkit.diary.models import Event
 from django.contrib.auth.decorators import login_required
 
 import toolkit.diary.feeds
+from toolkit.diary.conditional_get import conditional, feed_fingerprint
 from toolkit.diary.edit_views import EditEventView
 from toolkit.diary.public_views import (ArchiveIndex, ArchiveYear,
                                         ArchiveMonth, ArchiveSearch)
@@ -39,7 +40,8 @@ programme_urls = patterns(
     url(r'^view/(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/json$', 'view_diary_json', name="day-view-json"),
 
     # RSS feed
-    url(r'^rss/$', toolkit.diary.feeds.BasicWhatsOnFeed(), name="view-diary-rss", ),
+    url(r'^rss/$', conditional(feed_fingerprint)(toolkit.diary.feeds.BasicWhatsOnFeed()),
+        name="view-diary-rss", ),
 )
 
 diary_urls = patterns(
@@ -53,11 +55,14 @@ diary_urls = patterns(
     url(r'^edit/(?P<year>\d{4})/?$', 'edit_diary_list', name="year-edit", ),
     url(r'^edit/(?P<year>\d{4})/(?P<month>\d{1,2})/?$', 'edit_diary_list', name="month-edit", ),
     url(r'^edit/(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})', 'edit_diary_list', name="day-edit", ),
+    # Later parts of the edit list, fetched as the list is scrolled:
+    url(r'^edit/chunk/(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})/$',
+        'edit_diary_list_chunk', name="edit-list-chunk", ),
 
     # Edit an event: view event before editing
     url(r'^edit/event/id/(?P<pk>\d+)/view/$',
         login_required(DetailView.as_view(
-            model=Event,
+            queryset=Event.objects.with_main_mediaitem(),
             template_name='view_event_privatedetails.html')), name="edit-event-details-view"
         ),
     # Edit an event
@@ -68,6 +73,8 @@ diary_urls = patterns(
     url(r'^edit/ideas/(?P<year>\d{4})/(?P<month>\d{1,2})/$', 'edit_ideas', name="edit-ideas"),
     # Add a new showing (to an existing event) - submission URL for edit-showing
     url(r'^edit/event/id/(?P<event_id>\d+)/addshowing$', 'add_showing', name="add-showing"),
+    # Add a series of showings (to an existing event) - also from edit-showing
+    url(r'^edit/event/id/(?P<event_id>\d+)/addshowings$', 'add_showing_series', name="add-showing-series"),
     # Delete a showing
     url(r'^edit/showing/id/(?P<showing_id>\d+)/delete$', 'delete_showing', name="delete-showing"),
     # Add a new event + showing
@@ -0,0 +1,179 @@
+"""Delivery of mailout messages over several SMTP connections at once (used by
+tasks.send_mailout_batch)
+
+Almost all the time taken to send a mailout is spent waiting for the SMTP
+server to respond to each message. Rather than sending the messages one after
+another over a single connection, SMTPPool opens several connections
+(settings.MAILOUT_SMTP_CONNECTIONS), each with its own thread taking messages
+from a shared queue, so that several messages are in flight at once.
+
+If the server drops a connection (SMTPServerDisconnected) the connection is
+reopened and the message retried, up to
+settings.MAILOUT_SMTP_RECONNECT_ATTEMPTS times.
+
+Results are passed back to the thread that called SMTPPool.deliver, so that
+everything else (counting progress, updating the celery task state, collecting
+errors) happens in that thread, as before.
+
+To measure throughput against a local SMTP server run
+"manage.py benchmark_mailout_delivery".
+"""
+import Queue
+import socket
+import smtplib
+import logging
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Put on the job queue to tell a worker thread to stop:
+_STOP = object()
+
+
+class _Failed(object):
+    # Result for a message that failed with an exception, which is raised in
+    # the thread that called deliver()
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class SMTPPool(object):
+    """Pool of SMTP connections, used to send messages using the given send
+    function.
+
+    send is called as send(smtp_conn, *args), and should return None or an
+    error message (for errors that only affect that message). If it raises
+    SMTPServerDisconnected the connection is reopened and send called again.
+    Any other exception stops the delivery.
+
+    Use as a context manager (or call open() and close()) to connect and
+    disconnect.
+    """
+    def __init__(self, send, size=None, host=None, port=None, reconnect_attempts=None):
+        self._send = send
+        self.size = size or settings.MAILOUT_SMTP_CONNECTIONS
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        if reconnect_attempts is None:
+            reconnect_attempts = settings.MAILOUT_SMTP_RECONNECT_ATTEMPTS
+        self.reconnect_attempts = reconnect_attempts
+        self._connections = []
+
+    def _connect(self):
+        return smtplib.SMTP(self.host, self.port)
+
+    def open(self):
+        """Open all the connections. Raises whatever smtplib raised if any of
+        them fail (having closed any that were opened)"""
+        try:
+            for _ in range(self.size):
+                self._connections.append(self._connect())
+        except Exception:
+            self.close()
+            raise
+        logger.debug("Opened {0} connections to {1}:{2}".format(
+            self.size, self.host, self.port))
+
+    def close(self):
+        for smtp_conn in self._connections:
+            try:
+                smtp_conn.quit()
+            except (smtplib.SMTPException, socket.error) as exc:
+                logger.error("SMTP Quit failed: {0}".format(exc))
+        self._connections = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _send_on(self, index, args):
+        # Send using connection number index, reconnecting if necessary
+        attempts = 0
+        while True:
+            try:
+                return self._send(self._connections[index], *args)
+            except smtplib.SMTPServerDisconnected as ssd:
+                if attempts >= self.reconnect_attempts:
+                    raise
+                attempts += 1
+                logger.warning("SMTP connection lost ({0}), reconnecting (attempt {1} of {2})"
+                               .format(ssd, attempts, self.reconnect_attempts))
+                self._connections[index].close()
+                self._connections[index] = self._connect()
+
+    def send(self, *args):
+        """Send a single message, using the first connection, in the calling
+        thread (e.g. a report, once deliver() has finished). Returns what the
+        send function returned."""
+        return self._send_on(0, args)
+
+    def _worker(self, index, jobs, results, abort):
+        while True:
+            job = jobs.get()
+            if job is _STOP:
+                return
+            if abort.is_set():
+                # (Drain the queue without sending anything)
+                continue
+            key, args = job
+            try:
+                result = self._send_on(index, args)
+            except Exception as exc:
+                logger.exception("Delivery failed: {0}".format(exc))
+                abort.set()
+                results.put((key, _Failed(exc)))
+                return
+            results.put((key, result))
+
+    def deliver(self, messages):
+        """Send messages over all the connections at once.
+
+        messages is an iterable of (key, args) pairs, where args is a tuple of
+        the arguments (after the connection) to pass to the send function.
+
+        Yields (key, result) pairs, where result is what the send function
+        returned, in the calling thread, as each message is sent (so not
+        necessarily in the order they were given).
+
+        If sending a message fails with an exception then nothing more is
+        sent, and the exception is raised once the messages that were already
+        being sent have finished.
+        """
+        if not self._connections:
+            raise ValueError("SMTPPool isn't open")
+        jobs = Queue.Queue()
+        results = Queue.Queue()
+        abort = threading.Event()
+
+        # (Everything is queued before starting, so that messages are built,
+        # and any database queries made, in this thread)
+        count = 0
+        for key, args in messages:
+            jobs.put((key, args))
+            count += 1
+
+        threads = []
+        for index in range(len(self._connections)):
+            jobs.put(_STOP)
+            thread = threading.Thread(target=self._worker,
+                                      args=(index, jobs, results, abort),
+                                      name="SMTPPool-{0}".format(index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            for _ in xrange(count):
+                key, result = results.get()
+                if isinstance(result, _Failed):
+                    raise result.exc
+                yield key, result
+        finally:
+            abort.set()
+            for thread in threads:
+                thread.join()
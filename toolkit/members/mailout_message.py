@@ -0,0 +1,153 @@
+"""Building the copy of a mailout sent to each member (see
+tasks.send_mailout_batch)
+
+Every copy of a mailout is the same apart from the member's name, email
+address, pk (in the unsubscribe and edit links) and mailout key. So rather
+than formatting the text, reversing the URLs and building and encoding a new
+MIMEText for every recipient, MailoutMessage builds the message once with
+placeholders where those go, and then only has to fill the placeholders in
+for each recipient.
+
+Members whose details can't simply be filled in (e.g. a name with a line
+break in it, or an email address that would be wrapped or encoded) get their
+message built in full, by build_email, which gives exactly the same bytes.
+
+To compare the cost of the two, run "manage.py benchmark_mailout_messages".
+"""
+import uuid
+from email.mime.text import MIMEText
+from email.Header import Header
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+
+# Nb; this is not the email header, it's just the "Dear XYZ" bit at the top
+# of the mail:
+HEADER_TEMPLATE = u"Dear {0},\n\n"
+
+# Longest email address that can go in the "To" header without being wrapped:
+_MAX_FAST_ADDRESS_LENGTH = 64
+
+# Fields that are filled in for each recipient, and how many times each
+# appears in the message:
+_FIELD_COUNTS = {
+    'destination': 1,
+    'name': 1,
+    'pk': 2,
+    'key': 2,
+}
+
+
+def string_is_ascii(string):
+    return all(ord(char) < 0x7F for char in string)
+
+
+def signature_template():
+    return (
+        u"\n" +
+        u"\n" +
+        u"If you wish to be removed from our mailing list please use this link:\n" +
+        u"http://{0}{{0}}?k={{2}}\n" +
+        u"To edit details of your membership, please use this link:\n" +
+        u"http://{0}{{1}}?k={{2}}\n"
+    ).format(settings.EMAIL_UNSUBSCRIBE_HOST)
+
+
+def build_email(destination, subject, body, mail_is_ascii):
+    """Return the complete email (as a byte string) with the given
+    destination address, subject and body (all unicode)"""
+    # Body, encoded in either ASCII or UTF-8:
+    body_charset = "ascii" if mail_is_ascii else "utf-8"
+    msg = MIMEText(body.encode(body_charset, "replace"), "plain", body_charset)
+
+    # Assume 'From' is always ASCII(!)
+    msg['From'] = settings.MAILOUT_FROM_ADDRESS
+    # This will try encoding in ascii, then iso-8859-1 then fallback to UTF-8
+    # if that fails. (This is desirable as iso-8859-1 is more readable without
+    # decoding, plus more compact)
+    # ('To' can contain non-ascii in name part, i.e. "name <address>")
+    msg['To'] = Header(destination, "iso-8859-1")
+    msg['Subject'] = Header(subject, "iso-8859-1")
+
+    return msg.as_string()
+
+
+def _url_template(url_name):
+    # Reverse the URL once with a dummy pk, and turn it into a template with
+    # {0} where the pk goes
+    dummy_pk = 9876543210123
+    url = reverse(url_name, args=(dummy_pk,))
+    assert url.count(str(dummy_pk)) == 1
+    return url.replace(str(dummy_pk), u"{0}")
+
+
+class MailoutMessage(object):
+    """The copies of a mailout with the given subject and body (unicode) to
+    send to each member"""
+
+    def __init__(self, subject, body):
+        self.subject = subject
+        self.body = body
+        self._signature_template = signature_template()
+        self._unsubscribe_url_template = _url_template("unsubscribe-member")
+        self._edit_url_template = _url_template("edit-member")
+        # Cache if body is 7 bit clean (will need to check each member's
+        # name, but save a bit of time by not scanning everything)
+        self.body_is_ascii = string_is_ascii(body) and string_is_ascii(self._signature_template)
+        # Message with placeholders, as a %-format string, for ascii and
+        # non-ascii messages (None if it couldn't be made):
+        self._skeletons = {
+            True: self._compile(True) if self.body_is_ascii else None,
+            False: self._compile(False),
+        }
+
+    def recipient_body(self, name, pk, key):
+        """Return the body (unicode) of the copy for the member with the given
+        name, pk and mailout key"""
+        return (HEADER_TEMPLATE.format(name) +
+                self.body +
+                self._signature_template.format(
+                    self._unsubscribe_url_template.format(pk),
+                    self._edit_url_template.format(pk),
+                    key))
+
+    def _compile(self, mail_is_ascii):
+        tokens = dict((field, u"mailout{0}{1}".format(field, uuid.uuid4().hex))
+                      for field in _FIELD_COUNTS)
+        if not mail_is_ascii:
+            # The non-ascii message is only used when there's something
+            # non-ascii in it, which changes the Content-Transfer-Encoding, so
+            # make sure there is:
+            tokens['name'] += u"\u00e9"
+        body = self.recipient_body(tokens['name'], tokens['pk'], tokens['key'])
+        message = build_email(tokens['destination'], self.subject, body, mail_is_ascii)
+        skeleton = message.replace("%", "%%")
+        for field, token in tokens.iteritems():
+            token = token.encode("ascii" if mail_is_ascii else "utf-8")
+            if skeleton.count(token) != _FIELD_COUNTS[field]:
+                # (e.g. encoded or wrapped by the email package)
+                return None
+            skeleton = skeleton.replace(token, "%({0})s".format(field))
+        return skeleton
+
+    def _can_fill_in(self, name, destination, key):
+        return ("\n" not in name and "\r" not in name and
+                string_is_ascii(destination) and
+                len(destination) <= _MAX_FAST_ADDRESS_LENGTH and
+                not any(char.isspace() or char in ",;\"" for char in destination) and
+                string_is_ascii(key))
+
+    def build(self, destination, name, pk, key):
+        """Return the copy of the mailout (as a byte string) for the member
+        with the given email address, name, pk and mailout key"""
+        mail_is_ascii = self.body_is_ascii and string_is_ascii(name)
+        skeleton = self._skeletons[mail_is_ascii]
+        if skeleton is not None and self._can_fill_in(name, destination, key):
+            return skeleton % {
+                'destination': destination.encode("ascii"),
+                'name': name.encode("ascii" if mail_is_ascii else "utf-8"),
+                'pk': str(pk),
+                'key': key.encode("ascii"),
+            }
+        return build_email(destination, self.subject,
+                           self.recipient_body(name, pk, key), mail_is_ascii)
@@ -0,0 +1,79 @@
+"""Progress of mailouts that are being sent, kept in the cache
+
+Rather than each batch of a mailout (see tasks.send_mailout_batch) reporting
+progress through celery's update_state, which writes to the result backend
+(i.e. the database), each batch writes its sent and error counts to its own
+cache key. Nothing is ever read and then written back, so batches running on
+different workers at once don't need any locking, whatever the cache backend.
+
+Everything is keyed by the id of the send_mailout task, which is what the
+mailout page polls (see diary.mailout_views.mailout_progress).
+"""
+from django.core.cache import cache
+
+KEY_PREFIX = 'mailout_progress'
+
+# Seconds to keep progress for (long enough to cover the longest mailout):
+TIMEOUT = 24 * 60 * 60
+
+
+def _key(task_id, part):
+    return u"{0}:{1}:{2}".format(KEY_PREFIX, task_id, part)
+
+
+def start(task_id):
+    """Record that the send_mailout task with the given id has been queued"""
+    if task_id:
+        cache.set(_key(task_id, 'info'), {'total': None, 'batches': 0}, TIMEOUT)
+
+
+def set_batches(task_id, total, batches):
+    """Record that the mailout is being sent to total members, in the given
+    number of batches"""
+    if task_id:
+        cache.set(_key(task_id, 'info'), {'total': total, 'batches': batches}, TIMEOUT)
+
+
+def update_batch(task_id, batch_number, sent, error_count):
+    """Record the number of members batch number batch_number (counting from
+    0) has sent to so far, and how many of those failed"""
+    if task_id:
+        cache.set(_key(task_id, batch_number), (sent, error_count), TIMEOUT)
+
+
+def set_result(task_id, result):
+    """Record the result of the mailout (as returned by send_mailout_report)"""
+    if task_id:
+        cache.set(_key(task_id, 'result'), result, TIMEOUT)
+
+
+def get(task_id):
+    """Return dict of the progress of the mailout:
+    {'total': <members, or None if not started yet>,
+     'sent': <count>, 'error_count': <count>,
+     'result': <result, or None if not finished>}
+    or None if there's no progress recorded for the task"""
+    info = cache.get(_key(task_id, 'info'))
+    if info is None:
+        return None
+    keys = [_key(task_id, batch_number) for batch_number in range(info['batches'])]
+    keys.append(_key(task_id, 'result'))
+    values = cache.get_many(keys)
+    sent = error_count = 0
+    for key in keys[:-1]:
+        batch_sent, batch_error_count = values.get(key, (0, 0))
+        sent += batch_sent
+        error_count += batch_error_count
+    return {
+        'total': info['total'],
+        'sent': sent,
+        'error_count': error_count,
+        'result': values.get(keys[-1]),
+    }
+
+
+def percent(progress):
+    """Return percentage complete of mailout, given progress from get()"""
+    if not progress['total']:
+        return 0
+    return min(int((100.0 * progress['sent']) / progress['total']), 100)
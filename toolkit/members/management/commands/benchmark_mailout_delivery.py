@@ -0,0 +1,71 @@
+import timeit
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from toolkit.members.delivery import SMTPPool
+from toolkit.members.smtp_sink import SMTPSink
+from toolkit.members.tasks import _send_email
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Measure the rate at which mailout messages can be sent to a '
+            'local SMTP server over different numbers of connections')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--messages',
+                    type='int',
+                    dest='messages',
+                    default=500,
+                    help='Number of messages to send each time (default 500)'),
+        make_option('--connections',
+                    dest='connections',
+                    default='1,2,4,8',
+                    help='Comma separated numbers of connections to try (default 1,2,4,8)'),
+        make_option('--delay',
+                    type='float',
+                    dest='delay',
+                    default=10,
+                    help=('Milliseconds the local server takes to accept each '
+                          'message (default 10)')),
+        make_option('--port',
+                    type='int',
+                    dest='port',
+                    default=None,
+                    help=('Send to an existing SMTP server on this port on '
+                          'localhost, rather than starting one')),
+    )
+
+    requires_model_validation = True
+
+    def _deliver(self, connections, port, messages):
+        with SMTPPool(_send_email, size=connections, host="127.0.0.1", port=port) as pool:
+            return sum(1 for _ in pool.deliver(messages))
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+        try:
+            connection_counts = [int(count) for count in options['connections'].split(',')]
+        except ValueError:
+            raise CommandError("Invalid --connections")
+
+        body = u"Dear Member,\n\n" + u"Some news about films.\n" * 50
+        messages = [(n, (u"member{0}@example.com".format(n), u"Benchmark", body, True))
+                    for n in range(options['messages'])]
+
+        sink = None
+        port = options['port']
+        if port is None:
+            sink = SMTPSink(delay=options['delay'] / 1000.0)
+            sink.start()
+            port = sink.port
+        try:
+            for connections in connection_counts:
+                seconds = timeit.timeit(lambda: self._deliver(connections, port, messages), number=1)
+                self.stdout.write(u"{0:>3} connections: {1} messages in {2:.2f}s, {3:.0f} messages/s".format(
+                    connections, len(messages), seconds, len(messages) / seconds))
+        finally:
+            if sink:
+                sink.stop()
@@ -0,0 +1,87 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+
+from toolkit.members.mailout_message import (MailoutMessage, HEADER_TEMPLATE, build_email,
+                                             signature_template, string_is_ascii)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Compare the CPU time taken to build each copy of a mailout for a '
+            'list of made up recipients the old way (building and encoding '
+            'a MIMEText for each) with filling in a precompiled message')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--recipients',
+                    type='int',
+                    dest='recipients',
+                    default=10000,
+                    help='Number of recipients (default 10000)'),
+        make_option('--unicode',
+                    action='store_true',
+                    dest='unicode',
+                    default=False,
+                    help='Use a mailout body with non-ascii characters in it'),
+        make_option('--repeat',
+                    type='int',
+                    dest='repeat',
+                    default=3,
+                    help='Number of times to build the whole list (default 3)'),
+    )
+
+    requires_model_validation = True
+
+    def _build_per_recipient(self, subject, body, recipients):
+        # As send_mailout did before the message was precompiled:
+        signature = signature_template()
+        body_is_ascii = string_is_ascii(body) and string_is_ascii(signature)
+        for email, name, pk, key in recipients:
+            header = HEADER_TEMPLATE.format(name)
+            mail_body = header + body + signature.format(
+                reverse("unsubscribe-member", args=(pk,)),
+                reverse("edit-member", args=(pk,)),
+                key,
+            )
+            mail_is_ascii = body_is_ascii and string_is_ascii(header)
+            build_email(email, subject, mail_body, mail_is_ascii)
+
+    def _build_precompiled(self, subject, body, recipients):
+        message = MailoutMessage(subject, body)
+        for email, name, pk, key in recipients:
+            message.build(email, name, pk, key)
+
+    def _time(self, func, subject, body, recipients, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.clock()
+            func(subject, body, recipients)
+            seconds = time.clock() - start
+            best = seconds if best is None else min(best, seconds)
+        return best
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+
+        subject = u"Cube Microplex forthcoming events"
+        body = u"".join(
+            u"{0} Event number {0}\n\n".format(n) + u"Some words about a film. " * 30 + u"\n\n"
+            for n in range(20))
+        if options['unicode']:
+            body += u"Tickets \u00a35 / \u20ac6\n"
+        # (One in ten names isn't ascii):
+        recipients = [(u"member{0}@example.com".format(n),
+                       u"Member Zo\u00eb {0}".format(n) if n % 10 == 0 else u"Member {0}".format(n),
+                       n + 1,
+                       u"k3yk3yk3yk3yk3yk3yk3yk3yk3y{0:05}".format(n))
+                      for n in range(options['recipients'])]
+
+        for label, func in (("per recipient", self._build_per_recipient),
+                            ("precompiled", self._build_precompiled)):
+            seconds = self._time(func, subject, body, recipients, options['repeat'])
+            self.stdout.write(u"{0:>14}: {1} messages, best of {2}: {3:.2f}s CPU, {4:.1f}us per message".format(
+                label, len(recipients), options['repeat'], seconds,
+                seconds * 1e6 / len(recipients)))
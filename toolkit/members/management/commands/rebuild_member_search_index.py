@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+import toolkit.members.search as search
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Regenerate the member search index for all members'
+
+    requires_model_validation = True
+
+    def handle(self, *args, **options):
+        if args:
+            raise CommandError("Not expecting any arguments")
+
+        self.stdout.write("Rebuilding member search index")
+        count = search.rebuild_index()
+        self.stdout.write("Done ({0} members)".format(count))
@@ -0,0 +1,45 @@
+from celery.utils import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from toolkit.members.models import Mailout, MailoutDelivery
+import toolkit.members.tasks
+import toolkit.members.mailout_progress as mailout_progress
+
+
+class Command(BaseCommand):
+    args = '<mailout id>'
+    help = ('Carry on sending a mailout that was interrupted, to the members '
+            'who it hasn\'t been sent to yet. With no mailout id, list recent '
+            'mailouts.')
+
+    requires_model_validation = True
+
+    def _list_mailouts(self):
+        for mailout in Mailout.objects.order_by('-pk')[:10]:
+            counts = mailout.delivery_counts()
+            self.stdout.write(u"{0}: {1} ({2}) sent {3}, failed {4}, unknown {5}, {6}".format(
+                mailout.pk, mailout.subject, mailout.created_at,
+                counts[MailoutDelivery.SENT], counts[MailoutDelivery.FAILED],
+                counts[MailoutDelivery.SENDING],
+                u"finished" if mailout.finished_at else u"not finished"))
+
+    def handle(self, *args, **options):
+        if not args:
+            self._list_mailouts()
+            return
+        if len(args) > 1:
+            raise CommandError("Expecting one mailout id")
+        try:
+            mailout = Mailout.objects.get(pk=int(args[0]))
+        except (ValueError, Mailout.DoesNotExist):
+            raise CommandError("No such mailout: {0}".format(args[0]))
+
+        pending = mailout.pending_recipients().count()
+        self.stdout.write(u"Resuming mailout {0} ({1}) to {2} members".format(
+            mailout.pk, mailout.subject, pending))
+        task_id = uuid()
+        mailout_progress.start(task_id)
+        Mailout.objects.filter(pk=mailout.pk).update(task_id=task_id, finished_at=None)
+        toolkit.members.tasks.send_mailout.apply_async((mailout.pk,), task_id=task_id)
+        self.stdout.write(u"Started task {0}".format(task_id))
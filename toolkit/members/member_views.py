@@ -1,9 +1,10 @@
+import json
 import logging
 
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
-from django.db.models import Q
 from django.core.urlresolvers import reverse
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib import messages
 from django.core.exceptions import ObjectDoesNotExist
@@ -12,11 +13,17 @@ from django.views.decorators.http import require_POST, require_safe, require_htt
 
 from toolkit.members.forms import NewMemberForm, MemberForm
 from toolkit.members.models import Member
+import toolkit.members.search as member_search
 from toolkit.util import compare_constant_time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Number of members on each page of search results:
+SEARCH_RESULTS_PER_PAGE = 50
+# Maximum number of members returned by search_json:
+TYPEAHEAD_MAX_RESULTS = 10
+
 
 @permission_required('toolkit.write')
 @require_http_methods(["GET", "POST"])
@@ -58,13 +65,28 @@ def search(request):
     results = None
 
     if search_terms:
-        results = Member.objects.filter(  Q(name__icontains=search_terms)
-                                        | Q(email__icontains=search_terms)
-                                        | Q(number=search_terms)
-                                       ).order_by('name')
+        # (See search.py)
+        results = member_search.search_members(search_terms)
+        if results is None:
+            results = Member.objects.none()
+        paginator = Paginator(results, SEARCH_RESULTS_PER_PAGE)
+        try:
+            page = paginator.page(request.GET.get('page', 1))
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+
+        # Search parameters, for the links to other pages of results:
+        query_params = request.GET.copy()
+        query_params.pop('page', None)
         context = {
             'search_terms': search_terms,
-            'members': results,
+            'members': page.object_list,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'query_params': query_params.urlencode(),
             'show_edit_link': show_edit_link,
             'show_delete_link': show_delete_link,
         }
@@ -77,6 +99,27 @@ def search(request):
     return render(request, 'search_members.html', context)
 
 
+@login_required
+@require_safe
+def search_json(request):
+    # Used for the "type ahead" suggestions on the member search page and the
+    # volunteer form. Returns a list of (up to TYPEAHEAD_MAX_RESULTS) members
+    # matching the "q" parameter.
+    results = member_search.search_members(request.GET.get('q', u""))
+    members = []
+    if results is not None:
+        results = results.only('id', 'number', 'name', 'email')[:TYPEAHEAD_MAX_RESULTS]
+        members = [{
+            'id': member.pk,
+            'number': member.number,
+            'name': member.name,
+            'email': member.email,
+            'edit_url': reverse("edit-member", kwargs={'member_id': member.pk}),
+        } for member in results]
+
+    return HttpResponse(json.dumps(members), mimetype="application/json")
+
+
 @login_required
 @require_safe
 def view(request, member_id):
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+from toolkit.members import search
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        # Index the existing members (see toolkit.members.search); members
+        # saved from now on are indexed as they're saved
+        orm.MemberSearchTerm.objects.all().delete()
+        search.build_index(orm.Member.objects.all(), orm.MemberSearchTerm)
+
+    def backwards(self, orm):
+        orm.MemberSearchTerm.objects.all().delete()
+
+    models = {
+        u'diary.role': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Role', 'db_table': "'Roles'"},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'}),
+            'read_only': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'standard': ('django.db.models.fields.BooleanField', [], {'default': 'False'})
+        },
+        u'members.mailout': {
+            'Meta': {'object_name': 'Mailout', 'db_table': "'Mailouts'"},
+            'body': ('django.db.models.fields.TextField', [], {}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '128'}),
+            'task_id': ('django.db.models.fields.CharField', [], {'max_length': '36', 'blank': 'True'})
+        },
+        u'members.mailoutdelivery': {
+            'Meta': {'unique_together': "(('mailout', 'member'),)", 'object_name': 'MailoutDelivery', 'db_table': "'MailoutDeliveries'"},
+            'error': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'mailout': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'deliveries'", 'to': u"orm['members.Mailout']"}),
+            'member': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'mailout_deliveries'", 'to': u"orm['members.Member']"}),
+            'status': ('django.db.models.fields.PositiveSmallIntegerField', [], {'db_index': 'True'})
+        },
+        u'members.member': {
+            'Meta': {'object_name': 'Member', 'db_table': "'Members'"},
+            'address': ('django.db.models.fields.CharField', [], {'max_length': '128', 'null': 'True', 'blank': 'True'}),
+            'altphone': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True', 'blank': 'True'}),
+            'country': ('django.db.models.fields.CharField', [], {'max_length': '32', 'null': 'True', 'blank': 'True'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '64', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_member': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'mailout': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'mailout_failed': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'mailout_key': ('django.db.models.fields.CharField', [], {'default': "'3co0zvi258jaIbuuQ69nNXAsiyZdXBIT'", 'max_length': '32'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'notes': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'number': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'phone': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True', 'blank': 'True'}),
+            'postcode': ('django.db.models.fields.CharField', [], {'max_length': '16', 'null': 'True', 'blank': 'True'}),
+            'posttown': ('django.db.models.fields.CharField', [], {'max_length': '64', 'null': 'True', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'website': ('django.db.models.fields.CharField', [], {'max_length': '128', 'null': 'True', 'blank': 'True'})
+        },
+        u'members.membersearchterm': {
+            'Meta': {'object_name': 'MemberSearchTerm', 'db_table': "'MemberSearchTerms'"},
+            'field': ('django.db.models.fields.CharField', [], {'max_length': '4'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'member': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'search_terms'", 'to': u"orm['members.Member']"}),
+            'term': ('django.db.models.fields.CharField', [], {'max_length': '32', 'db_index': 'True'})
+        },
+        u'members.volunteer': {
+            'Meta': {'object_name': 'Volunteer', 'db_table': "'Volunteers'"},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'member': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "'volunteer'", 'unique': 'True', 'to': u"orm['members.Member']"}),
+            'notes': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'portrait': ('django.db.models.fields.files.ImageField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'roles': ('django.db.models.fields.related.ManyToManyField', [], {'to': u"orm['diary.Role']", 'symmetrical': 'False', 'db_table': "'Volunteer_Roles'", 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['members']
\ No newline at end of file
@@ -8,6 +8,7 @@ from django.db import models
 
 from toolkit.diary.models import Role
 from toolkit.util import generate_random_string
+from toolkit.util.db import commit_on_success_unless_managed
 
 logger = logging.getLogger(__name__)
 
@@ -134,6 +135,29 @@ class Member(models.Model):
 #        pass
 
 
+class MemberSearchTerm(models.Model):
+    """An entry in the index used by the member search; see
+    toolkit.members.search"""
+
+    NAME = 'name'
+    EMAIL = 'mail'
+    DOMAIN = 'dom'
+    NUMBER = 'num'
+
+    member = models.ForeignKey(Member, related_name='search_terms')
+    term = models.CharField(max_length=32, db_index=True)
+    # Which part of the member's details the term came from (the local part
+    # of the email address, the domain, etc.):
+    field = models.CharField(max_length=4, choices=((NAME, 'Name'), (EMAIL, 'Email'),
+                                                    (DOMAIN, 'Email domain'), (NUMBER, 'Number')))
+
+    class Meta:
+        db_table = 'MemberSearchTerms'
+
+    def __unicode__(self):
+        return u"{0} ({1}, member {2})".format(self.term, self.field, self.member_id)
+
+
 class Volunteer(models.Model):
 
     member = models.OneToOneField('Member', related_name='volunteer')
@@ -180,3 +204,100 @@ class Volunteer(models.Model):
             self.__original_portrait = self.portrait.file.name if self.portrait else None
         except (IOError, OSError, ValueError):
             self.__original_portrait = None
+
+
+class Mailout(models.Model):
+    """An email sent to all the members on the mailing list (see
+    toolkit.members.tasks.send_mailout). Which members it has been sent to is
+    recorded in MailoutDelivery, so that a mailout that was interrupted can
+    be resumed without sending anything to anyone twice."""
+
+    subject = models.CharField(max_length=128)
+    body = models.TextField()
+
+    # Id of the most recent send_mailout task (the one to poll for progress):
+    task_id = models.CharField(max_length=36, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the delivery report has been sent (i.e. all the batches
+    # finished, though not necessarily successfully):
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'Mailouts'
+
+    def __unicode__(self):
+        return u"{0} ({1})".format(self.subject, self.created_at)
+
+    def pending_recipients(self):
+        """Members who should get the mailout, who it hasn't been sent (or
+        started being sent) to yet"""
+        return (Member.objects.mailout_recipients()
+                              .exclude(pk__in=self.deliveries.values('member_id')))
+
+    def claim(self, member_ids):
+        """Record that the mailout is about to be sent to the given members
+        (so it won't be sent to them again, even if the sending dies before
+        finding out whether it worked)"""
+        MailoutDelivery.objects.bulk_create([
+            MailoutDelivery(mailout=self, member_id=member_id, status=MailoutDelivery.SENDING)
+            for member_id in member_ids])
+
+    def record(self, sent_ids, errors):
+        """Record the result of sending to members that were claimed: sent_ids
+        is a list of ids of members it was sent to, errors is a dict mapping
+        member id to error message for members it couldn't be sent to"""
+        with commit_on_success_unless_managed():
+            if sent_ids:
+                (self.deliveries.filter(member_id__in=sent_ids)
+                                .update(status=MailoutDelivery.SENT))
+            # (Assume errors are rare enough not to be worth bulk updating)
+            for member_id, error in errors.iteritems():
+                (self.deliveries.filter(member_id=member_id)
+                                .update(status=MailoutDelivery.FAILED,
+                                        error=error[:MailoutDelivery.MAX_ERROR_LENGTH]))
+
+    def delivery_counts(self):
+        """Return dict mapping MailoutDelivery status to the number of members
+        with that status"""
+        counts = dict.fromkeys((MailoutDelivery.SENDING, MailoutDelivery.SENT, MailoutDelivery.FAILED), 0)
+        counts.update(self.deliveries.order_by()
+                                     .values_list('status')
+                                     .annotate(models.Count('pk')))
+        return counts
+
+
+class MailoutDelivery(models.Model):
+    """Ledger of the members a Mailout has been sent to"""
+
+    MAX_ERROR_LENGTH = 255
+
+    # Claimed, but not (yet) known whether it was sent:
+    SENDING = 0
+    SENT = 1
+    # SMTP server refused it, bad address, etc.:
+    FAILED = 2
+    STATUS_CHOICES = (
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    mailout = models.ForeignKey(Mailout, related_name='deliveries')
+    member = models.ForeignKey(Member, related_name='mailout_deliveries')
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, db_index=True)
+    error = models.CharField(max_length=MAX_ERROR_LENGTH, blank=True)
+
+    class Meta:
+        db_table = 'MailoutDeliveries'
+        # (The unique index also makes it cheap to find what a mailout has
+        # been sent to)
+        unique_together = (('mailout', 'member'),)
+
+    def __unicode__(self):
+        return u"Mailout {0} to member {1}: {2}".format(
+            self.mailout_id, self.member_id, self.get_status_display())
+
+# Connect signal handlers that keep the search index up to date (at the end of
+# the file, as the handlers need the models defined above):
+import toolkit.members.search
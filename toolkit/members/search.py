@@ -0,0 +1,161 @@
+"""Search index for the member search (see member_views.search and
+member_views.search_json)
+
+Rather than doing a "LIKE '%term%'" scan over every member's name and email
+address, the words in each member's name, the local part and domain of their
+email address, and their membership number are stored in the
+MemberSearchTerm table, one row per (member, term, field). Searching then only
+needs indexed "LIKE 'term%'" lookups on that table (as for the archive
+search, see toolkit.diary.search) so takes about the same time however many
+members there are.
+
+Terms are normalised to lower case without accents (so "zoe" matches
+u"Zo\u00eb"). Search terms match the start of indexed terms (so "smi" matches "Smith" and
+"smith@example.com", and "exam" matches "someone@example.com"). A search
+containing "@" matches the local part and domain of email addresses
+separately. If there's more than one word in the search then members must
+match all of them.
+
+The index is updated whenever a member is saved. It's built for existing
+members by migration 0006; to rebuild the entire index, run
+"manage.py rebuild_member_search_index".
+"""
+import re
+import logging
+import unicodedata
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from toolkit.members.models import Member, MemberSearchTerm
+from toolkit.util.db import commit_on_success_unless_managed
+
+logger = logging.getLogger(__name__)
+
+# Terms longer than this are truncated:
+MAX_TERM_LENGTH = MemberSearchTerm._meta.get_field('term').max_length
+
+# Number of rows to insert at once when rebuilding the index:
+REBUILD_BATCH_SIZE = 500
+
+_word_re = re.compile(r'\w+', flags=re.UNICODE)
+
+
+def normalise(text):
+    """Return text in lower case, with accents removed"""
+    decomposed = unicodedata.normalize('NFKD', unicode(text).lower())
+    return u"".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenise(text):
+    """Return list of (normalised) index terms in the given text"""
+    return [word[:MAX_TERM_LENGTH] for word in _word_re.findall(normalise(text))]
+
+
+def _split_email(email):
+    local, _, domain = normalise(email).rpartition(u'@')
+    return local, domain
+
+
+def _member_terms(member, term_model=MemberSearchTerm):
+    """Return list of term_model (MemberSearchTerm) objects (unsaved) for the
+    given member"""
+    terms = set((MemberSearchTerm.NAME, term) for term in tokenise(member.name or u""))
+    if member.email:
+        local, domain = _split_email(member.email)
+        terms.update((MemberSearchTerm.EMAIL, term) for term in tokenise(local))
+        if domain:
+            terms.add((MemberSearchTerm.DOMAIN, domain[:MAX_TERM_LENGTH]))
+    number = normalise(member.number or u"").strip()
+    if number:
+        terms.add((MemberSearchTerm.NUMBER, number[:MAX_TERM_LENGTH]))
+
+    return [term_model(member_id=member.pk, field=field, term=term)
+            for field, term in terms]
+
+
+def index_member(member):
+    """Replace the index entries for the given (saved) member"""
+    with commit_on_success_unless_managed():
+        MemberSearchTerm.objects.filter(member_id=member.pk).delete()
+        MemberSearchTerm.objects.bulk_create(_member_terms(member))
+
+
+def build_index(members, term_model=MemberSearchTerm):
+    """Add index entries for the members in the given queryset (which
+    mustn't have any yet). term_model is there for the South migration
+    that builds the index, which passes its frozen model. Returns the number
+    of members indexed"""
+    count = 0
+    batch = []
+    for member in members.only('id', 'name', 'email', 'number').iterator():
+        batch.extend(_member_terms(member, term_model))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            term_model.objects.bulk_create(batch)
+            batch = []
+        count += 1
+    term_model.objects.bulk_create(batch)
+    return count
+
+
+def rebuild_index():
+    """Throw away and regenerate the entire index. Returns the number of
+    members indexed"""
+    with transaction.commit_on_success():
+        MemberSearchTerm.objects.all().delete()
+        count = build_index(Member.objects.all())
+    logger.info(u"Rebuilt member search index for {0} members".format(count))
+    return count
+
+
+def _query_terms(text):
+    """Return list of (fields, term) pairs that a member must match to match
+    the search text, where fields is a list of the fields the term can be
+    found in, or None for any field"""
+    query = []
+    for word in text.split():
+        if u'@' in word:
+            local, domain = _split_email(word)
+            query.extend(([MemberSearchTerm.EMAIL], term) for term in tokenise(local))
+            if domain:
+                query.append(([MemberSearchTerm.DOMAIN], domain[:MAX_TERM_LENGTH]))
+        else:
+            query.extend((None, term) for term in tokenise(word))
+    # (Preserve order while removing duplicates)
+    unique = []
+    for item in query:
+        if item not in unique:
+            unique.append(item)
+    return unique
+
+
+def search_members(text, members=None):
+    """Return queryset of members (from the members queryset, default all
+    members) matching all the words in text, ordered by name, or None if text
+    doesn't contain anything that could be searched for in the index (e.g.
+    it's only punctuation)"""
+    query = _query_terms(text)
+    if not query:
+        return None
+    if members is None:
+        members = Member.objects.all()
+    # (Each filter() call on search_terms gets its own join, so a member has
+    # to match every term)
+    for fields, term in query:
+        if fields is None:
+            members = members.filter(search_terms__term__startswith=term)
+        else:
+            members = members.filter(search_terms__term__startswith=term,
+                                     search_terms__field__in=fields)
+    return members.distinct().order_by('name', 'pk')
+
+
+# Keep the index up to date:
+
+@receiver(post_save, sender=Member)
+def _member_saved(sender, instance, raw, **kwargs):
+    # Don't try to index while loading fixtures - rebuild the index afterwards
+    # instead
+    if not raw:
+        index_member(instance)
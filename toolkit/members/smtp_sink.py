@@ -0,0 +1,103 @@
+"""A minimal local SMTP server that accepts and keeps every message sent to
+it, for testing and benchmarking mailout delivery (see delivery.py)
+
+Unlike smtpd.DebuggingServer it handles each connection in its own thread, and
+can be told to take a while to accept each message (as a real server would),
+so that sending over several connections at once can be measured.
+"""
+import time
+import threading
+import SocketServer
+
+
+class _SinkHandler(SocketServer.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(line + "\r\n")
+
+    def _read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line.rstrip("\r\n") == ".":
+                return "".join(lines)
+            if line.startswith(".."):
+                line = line[1:]
+            lines.append(line)
+
+    def handle(self):
+        server = self.server
+        self._reply("220 localhost SMTP sink")
+        mailfrom, rcpttos = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            argument = line[4:].strip()
+            if command in ("HELO", "EHLO"):
+                self._reply("250 localhost")
+            elif command == "MAIL":
+                mailfrom = argument.partition(":")[2].strip().strip("<>")
+                rcpttos = []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                rcpttos.append(argument.partition(":")[2].strip().strip("<>"))
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                if server.delay:
+                    time.sleep(server.delay)
+                server.received(mailfrom, rcpttos, data)
+                self._reply("250 OK")
+            elif command == "RSET":
+                mailfrom, rcpttos = None, []
+                self._reply("250 OK")
+            elif command == "NOOP":
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class SMTPSink(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """SMTP server listening on localhost (on a free port, unless one is
+    given), taking delay seconds to accept each message.
+
+    Use as a context manager to start and stop it in a background thread.
+    Messages received are in the messages attribute, as a list of
+    (mailfrom, rcpttos, data) tuples.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, delay=0):
+        SocketServer.TCPServer.__init__(self, ("127.0.0.1", port), _SinkHandler)
+        self.host, self.port = self.server_address
+        self.delay = delay
+        self.messages = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def received(self, mailfrom, rcpttos, data):
+        with self._lock:
+            self.messages.append((mailfrom, rcpttos, data))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="SMTPSink")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -1,43 +1,31 @@
 import smtplib
-from email.mime.text import MIMEText
-from email.Header import Header
 
 from django.conf import settings
-from django.core.urlresolvers import reverse
+import django.utils.timezone as timezone
 
-from celery import task, current_task
+from celery import task, chord
+from celery.utils import uuid
 from celery.utils.log import get_task_logger
 
-from toolkit.members.models import Member
+from toolkit.members.models import Mailout, MailoutDelivery
+from toolkit.members.delivery import SMTPPool
+import toolkit.members.mailout_progress as mailout_progress
+from toolkit.members.mailout_message import (MailoutMessage, build_email,
+                                             string_is_ascii, signature_template)
 
 logger = get_task_logger(__name__)
 
 
-def string_is_ascii(string):
-    return all(ord(char) < 0x7F for char in string)
-
-
-def _send_email(smtp_conn, destination, subject, body, mail_is_ascii):
+def _send_message(smtp_conn, destination, message):
+    # Send message (a complete email, as a byte string) to destination.
+    # Returns an error message if it couldn't be sent.
     error = None
 
-    # Body, encoded in either ASCII or UTF-8:
-    body_charset = "ascii" if mail_is_ascii else "utf-8"
-    msg = MIMEText(body.encode(body_charset, "replace"), "plain", body_charset)
-
-    # Assume 'From' is always ASCII(!)
-    msg['From'] = settings.MAILOUT_FROM_ADDRESS
-    # This will try encoding in ascii, then iso-8859-1 then fallback to UTF-8
-    # if that fails. (This is desirable as iso-8859-1 is more readable without
-    # decoding, plus more compact)
-    # ('To' can contain non-ascii in name part, i.e. "name <address>")
-    msg['To'] = Header(destination, "iso-8859-1")
-    msg['Subject'] = Header(subject, "iso-8859-1")
-
     try:
         # Enforce ascii destination email address:
         smtp_conn.sendmail(settings.MAILOUT_FROM_ADDRESS,
                            [destination.encode("ascii")],
-                           msg.as_string())
+                           message)
     except UnicodeError:
         msg = "Non-ascii email address {0}".format(destination.encode("ascii", "replace"))
         logger.error(msg)
@@ -53,108 +41,227 @@ def _send_email(smtp_conn, destination, subject, body, mail_is_ascii):
     return error
 
 
+def _send_email(smtp_conn, destination, subject, body, mail_is_ascii):
+    message = build_email(destination, subject, body, mail_is_ascii)
+    return _send_message(smtp_conn, destination, message)
+
+
 @task()
-def send_mailout(subject, body):
+def send_mailout(mailout_id):
+    """
+    Sends the Mailout with the given id to all members who have an email
+    address, and who have mailout==True and mailout_failed=False, that it
+    hasn't already been sent to (so if a mailout was interrupted, running
+    this again resumes it).
+
+    The recipients (in order of pk) are split into batches of
+    settings.MAILOUT_BATCH_SIZE, each sent by a separate send_mailout_batch
+    task (so they can be sent by several workers at once, and a worker dying
+    only loses one batch). Once they've all finished send_mailout_report
+    sends an email to settings.MAILOUT_DELIVERY_REPORT_TO.
+
+    If there are no recipients returns a tuple:
+    (True, 0, error_message)
+
+    Otherwise returns a dict of the ids of the tasks that were started:
+    {'total': <number of recipients>, 'batches': [<task id>, ...],
+     'report': <task id>}
+    (see diary.mailout_views.mailout_progress). The send_mailout_report task
+    returns the result of the whole mailout.
+
+    Progress is recorded in the mailout_progress store, under the id of this
+    task (as is the failure, if this dies).
     """
-    Sends email with supplied subject/body to all members who have an email
-    address, and who have mailout==True and mailout_failed=False.
+    progress_id = send_mailout.request.id
+    try:
+        return _start_mailout(mailout_id, progress_id)
+    except Exception as exc:
+        logger.exception("Mailout job failed, {0}".format(exc))
+        mailout_progress.set_result(progress_id, (True, 0, "Mailout job died: {0}".format(exc)))
+        raise
 
-    Requires subject and body to be unicode.
 
-    Also sends an email to settings.MAILOUT_DELIVERY_REPORT_TO when done.
+def _start_mailout(mailout_id, progress_id):
+    mailout = Mailout.objects.get(pk=mailout_id)
+    member_ids = list(mailout.pending_recipients()
+                             .order_by('pk')
+                             .values_list('pk', flat=True))
+    count = len(member_ids)
 
-    returns a tuple:
-    (error, sent_count, error_message)
-    where error is True if an error occurred.
+    if count == 0:
+        logger.error("No recipients found")
+        result = (True, 0, 'No recipients found')
+        mailout_progress.set_result(progress_id, result)
+        return result
+
+    batch_size = settings.MAILOUT_BATCH_SIZE
+    batches = []
+    for start in xrange(0, count, batch_size):
+        batch_ids = member_ids[start:start + batch_size]
+        batches.append(send_mailout_batch.subtask(
+            (mailout.pk, batch_ids[0], batch_ids[-1], progress_id, len(batches)),
+            task_id=uuid()))
+    report = send_mailout_report.subtask((mailout.pk, progress_id), task_id=uuid())
+
+    logger.info("Sending mailout {0} to {1} recipients in {2} batches".format(
+        mailout.pk, count, len(batches)))
+    mailout_progress.set_batches(progress_id, count, len(batches))
+    chord(batches)(report)
+
+    return {
+        'total': count,
+        'batches': [batch.options['task_id'] for batch in batches],
+        'report': report.options['task_id'],
+    }
+
+
+@task()
+def send_mailout_batch(mailout_id, first_member_id, last_member_id,
+                       progress_id=None, batch_number=0):
     """
+    Sends the Mailout with the given id to members who should get it, and
+    haven't already, with pks between first_member_id and last_member_id
+    (inclusive). Part of send_mailout.
 
-    header_template = u"Dear {0},\n\n"
-    signature_template = (
-        u"\n" +
-        u"\n" +
-        u"If you wish to be removed from our mailing list please use this link:\n" +
-        u"http://{0}{{0}}?k={{2}}\n" +
-        u"To edit details of your membership, please use this link:\n" +
-        u"http://{0}{{1}}?k={{2}}\n"
-    ).format(settings.EMAIL_UNSUBSCRIBE_HOST)
-
-    recipients = Member.objects.mailout_recipients()
-    count = recipients.count()
+    Progress is recorded in the mailout_progress store, under progress_id, as
+    batch number batch_number.
+
+    Each recipient is recorded in the mailout's delivery ledger (see
+    MailoutDelivery) as it's sent, claiming recipients in chunks of
+    settings.MAILOUT_LEDGER_BATCH_SIZE before sending to them, so that if this
+    dies nobody gets sent the mailout twice.
+
+    Returns a dict:
+    {'sent': <count>, 'error_count': <count>,
+     'failure': <message if the batch died, or None>}
+    """
+
+    mailout = Mailout.objects.get(pk=mailout_id)
+
+    recipients = list(mailout.pending_recipients()
+                             .filter(pk__range=(first_member_id, last_member_id))
+                             .order_by('pk'))
+    count = len(recipients)
     sent = 0
     one_percent = count // 100 or 1
 
+    error_count = 0
+    result = {'sent': 0, 'error_count': 0, 'failure': None}
+
     if count == 0:
-        logger.error("No recipients found")
-        return (True, 0, 'No recipients found')
+        return result
 
-    logger.info("Sending mailout to {0} recipients".format(count))
+    logger.info("Sending mailout {0} to {1} recipients (members {2} to {3})".format(
+        mailout.pk, count, first_member_id, last_member_id))
 
-    # Open connection to SMTP server:
+    # Open connections to SMTP server:
+    pool = SMTPPool(_send_message, size=min(settings.MAILOUT_SMTP_CONNECTIONS, count))
     try:
-        smtp_conn = smtplib.SMTP(settings.EMAIL_HOST, settings.EMAIL_PORT)
+        pool.open()
     except Exception as exc:
         msg = "Failed to connect to SMTP server: {0}".format(exc)
         logger.error(msg)
-        return (True, 0, msg)
+        result['failure'] = msg
+        return result
 
-    # Cache if body is 7 bit clean (will need to check each sender name, but
-    # save a bit of time by not scanning everything)
-    body_is_ascii = string_is_ascii(body) and string_is_ascii(signature_template)
+    def messages(chunk):
+        for recipient in chunk:
+            yield recipient.pk, (recipient.email,
+                                 message.build(recipient.email, recipient.name,
+                                               recipient.pk, recipient.mailout_key))
 
-    err_list = []
+    chunk_size = settings.MAILOUT_LEDGER_BATCH_SIZE
+    try:
+        # (Builds the message once, with placeholders for the per-recipient
+        # parts)
+        message = MailoutMessage(mailout.subject, mailout.body)
+
+        for start in xrange(0, count, chunk_size):
+            chunk = recipients[start:start + chunk_size]
+            mailout.claim([recipient.pk for recipient in chunk])
+            sent_ids = []
+            errors = {}
+            try:
+                # Sent over all the connections at once; results come back
+                # here as each message is sent:
+                for member_id, error in pool.deliver(messages(chunk)):
+                    if error:
+                        errors[member_id] = error
+                        error_count += 1
+                    else:
+                        sent_ids.append(member_id)
+
+                    sent += 1
+                    if sent % one_percent == 0:
+                        mailout_progress.update_batch(progress_id, batch_number, sent, error_count)
+            finally:
+                # (Including what was sent before anything went wrong)
+                mailout.record(sent_ids, errors)
+    except Exception as exc:
+        logger.exception("Mailout batch failed, {0}".format(exc))
+        result['failure'] = "Mailout job died: {0}".format(exc)
+    finally:
+        pool.close()
 
-    # XXX XXX XXX
-    # Uncomment the following line if you want to disable mailout for testing
-    # return (True, 0, 'DISABLED UNTIL READY')
+    mailout_progress.update_batch(progress_id, batch_number, sent, error_count)
+    result['sent'] = sent
+    result['error_count'] = error_count
+    return result
 
-    try:
-        for recipient in recipients:
-            # Nb; this is not the email header, it's just the "Dear XYZ"
-            # bit at the top of the mail:
-            header = header_template.format(
-                recipient.name
-            )
-
-            # Build per-recipient signature, with customised unsubscribe links:
-            signature = signature_template.format(
-                reverse("unsubscribe-member", args=(recipient.pk,)),
-                reverse("edit-member", args=(recipient.pk,)),
-                recipient.mailout_key,
-            )
-            # Build final email, still in unicode:
-            mail_body = header + body + signature
-            mail_is_ascii = body_is_ascii and string_is_ascii(header)
-
-            error = _send_email(smtp_conn, recipient.email, subject, mail_body, mail_is_ascii)
-
-            if error:
-                err_list.append(error)
-
-            sent += 1
-            if sent % one_percent == 0:
-                progress = int((100.0 * sent) / count) + 1
-                current_task.update_state(state='PROGRESS{0:03}'.format(progress),
-                                          meta={'sent': sent, 'total': count})
-        # All done? Send report:
-        report = "{0} copies of the following were sent out on cube members list\n".format(sent)
-        if len(err_list) > 0:
-            # Only send a max of 100 error messages!
-            report += "{0} errors:\n{1}".format(len(err_list), "\n".join(err_list[:100]))
-            if len(err_list) > 100:
-                report += "(Error list truncated at 100 entries)\n"
-
-        report += "\n"
-        report += body
-
-        _send_email(smtp_conn, unicode(settings.MAILOUT_DELIVERY_REPORT_TO), subject, report, body_is_ascii)
 
+@task()
+def send_mailout_report(batch_results, mailout_id, progress_id=None):
+    """
+    Sends a report of the Mailout with the given id to
+    settings.MAILOUT_DELIVERY_REPORT_TO, given the results of all the
+    send_mailout_batch tasks. Part of send_mailout.
+
+    The counts and errors in the report are from the mailout's delivery
+    ledger, so cover every time it's been (re)started. The result is also
+    recorded in the mailout_progress store, under progress_id.
+
+    returns a tuple:
+    (error, sent_count, error_message)
+    where error is True if an error occurred.
+    """
+    mailout = Mailout.objects.get(pk=mailout_id)
+    counts = mailout.delivery_counts()
+    sent = counts[MailoutDelivery.SENT] + counts[MailoutDelivery.FAILED]
+    error_count = counts[MailoutDelivery.FAILED]
+    failures = [result['failure'] for result in batch_results if result['failure']]
+
+    report = "{0} copies of the following were sent out on cube members list\n".format(sent)
+    if failures:
+        report += "{0} of {1} batches failed:\n{2}\n".format(
+            len(failures), len(batch_results), "\n".join(failures))
+    if counts[MailoutDelivery.SENDING]:
+        report += ("{0} copies may or may not have been sent (sending was "
+                   "interrupted), and won't be resent\n").format(counts[MailoutDelivery.SENDING])
+    if error_count > 0:
+        # Only send a max of 100 error messages!
+        err_list = (mailout.deliveries.filter(status=MailoutDelivery.FAILED)
+                                      .order_by('member')
+                                      .values_list('error', flat=True)[:100])
+        report += "{0} errors:\n{1}".format(error_count, "\n".join(err_list))
+        if error_count > 100:
+            report += "(Error list truncated at 100 entries)\n"
+
+    report += "\n"
+    report += mailout.body
+
+    body_is_ascii = string_is_ascii(mailout.body) and string_is_ascii(signature_template())
+    result = (False, sent, 'Ok')
+    if failures:
+        result = (True, sent, "\n".join(failures))
+    try:
+        with SMTPPool(_send_email, size=1) as pool:
+            pool.send(unicode(settings.MAILOUT_DELIVERY_REPORT_TO), mailout.subject, report, body_is_ascii)
     except Exception as exc:
-        logger.exception("Mailout job failed, {0}".format(exc))
-        return (True, sent, "Mailout job died: {0}".format(exc))
+        logger.exception("Failed sending mailout report, {0}".format(exc))
+        if not failures:
+            result = (True, sent, "Failed sending report: {0}".format(exc))
     finally:
-        try:
-            smtp_conn.quit()
-        except smtplib.SMTPException as smtpe:
-            logger.error("SMTP Quit failed: {0}".format(smtpe))
+        Mailout.objects.filter(pk=mailout.pk).update(finished_at=timezone.now())
 
-    return (False, sent, 'Ok')
+    mailout_progress.set_result(progress_id, result)
+    return result
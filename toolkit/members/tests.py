@@ -1,3 +1,4 @@
+import json
 import shutil
 import urllib
 import os.path
@@ -5,20 +6,26 @@ import tempfile
 import smtplib
 import email.parser
 import email.header
+from StringIO import StringIO
 
 from mock import patch, call
 
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.core.cache import cache
 from django.conf import settings
 
 import django.contrib.auth.models as auth_models
 import django.contrib.contenttypes as contenttypes
 
-from toolkit.members.models import Member, Volunteer
+from toolkit.members.models import Member, Volunteer, MemberSearchTerm, Mailout, MailoutDelivery
 from toolkit.diary.models import Role
 import toolkit.members.tasks
+import toolkit.members.mailout_message as mailout_message
+import toolkit.members.mailout_progress as mailout_progress
+from toolkit.members.smtp_sink import SMTPSink
 
 
 class MembersTestsMixin(object):
@@ -122,6 +129,7 @@ class SecurityTests(MembersTestsMixin, TestCase):
             # Member urls:
             'add-member': {},
             'search-members': {},
+            'search-members-json': {},
             'view-member': {'member_id': 1},
             'edit-member': {'member_id': 1},
             'delete-member': {'member_id': 1},
@@ -441,6 +449,86 @@ class TestSearchMemberView(MembersTestsMixin, TestCase):
                             )
         self.assertNotContains(response, u'<input type="submit" value="Edit">', html=True)
 
+    def _search(self, query):
+        response = self.client.get(reverse("search-members"), data={'q': query})
+        self.assertEqual(response.status_code, 200)
+        return list(response.context['members'])
+
+    def test_query_prefix_and_accents(self):
+        # "tw" matches the start of "Tw\u020d", as does "two" (without the
+        # accent):
+        self.assertIn(self.mem_2, self._search(u"tw"))
+        self.assertIn(self.mem_2, self._search(u"TWO mem"))
+        self.assertEqual(self._search(u"wo"), [])
+
+    def test_query_email(self):
+        self.assertEqual(self._search(u"@example"), [self.mem_1, self.mem_2])
+        self.assertEqual(self._search(u"two@"), [self.mem_3, self.mem_2])
+        self.assertEqual(self._search(u"two@member.test"), [self.mem_3])
+        # Domain on its own:
+        self.assertEqual(self._search(u"squoo"), [self.mem_8])
+
+    def test_query_number(self):
+        self.assertEqual(self._search(u"000"), [self.mem_3])
+        self.assertEqual([member.name for member in self._search(u"01")],
+                         [u"Number Eight, No mailout please", u"Number Nine, mailout failed"])
+
+    def test_query_not_searchable(self):
+        self.assertEqual(self._search(u"!!"), [])
+
+    @patch('toolkit.members.member_views.SEARCH_RESULTS_PER_PAGE', 3)
+    def test_query_paginated(self):
+        response = self.client.get(reverse("search-members"), data={'q': u'volunteer'})
+        self.assertEqual([member.name for member in response.context['members']],
+                         [u"Volunteer Four", u"Volunteer One", u"Volunteer Three"])
+        self.assertContains(response, u"4 results")
+        self.assertContains(response, u"Page 1 of 2")
+        self.assertContains(response, u"q=volunteer&amp;page=2")
+
+        response = self.client.get(reverse("search-members"), data={'q': u'volunteer', 'page': u'2'})
+        self.assertEqual([member.name for member in response.context['members']],
+                         [u"Volunteer Two"])
+
+        # Out of range:
+        response = self.client.get(reverse("search-members"), data={'q': u'volunteer', 'page': u'9'})
+        self.assertEqual([member.name for member in response.context['members']],
+                         [u"Volunteer Two"])
+
+    def test_search_json(self):
+        response = self.client.get(reverse("search-members-json"), data={'q': u'volunteer t'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "application/json")
+        self.assertEqual(json.loads(response.content), [{
+            u'id': self.mem_6.pk,
+            u'number': u'4',
+            u'name': u'Volunteer Three',
+            u'email': u'volthree@foo.test',
+            u'edit_url': reverse("edit-member", kwargs={'member_id': self.mem_6.pk}),
+        }, {
+            u'id': self.mem_5.pk,
+            u'number': u'4',
+            u'name': u'Volunteer Two',
+            u'email': u'',
+            u'edit_url': reverse("edit-member", kwargs={'member_id': self.mem_5.pk}),
+        }])
+
+    def test_search_json_no_query(self):
+        response = self.client.get(reverse("search-members-json"))
+        self.assertEqual(json.loads(response.content), [])
+
+    def test_index_updated_on_save(self):
+        self.mem_3.name = u"Another Name"
+        self.mem_3.save()
+        self.assertEqual(self._search(u"third"), [])
+        self.assertEqual(self._search(u"another"), [self.mem_3])
+
+    def test_rebuild_index(self):
+        MemberSearchTerm.objects.all().delete()
+        self.assertEqual(self._search(u"third"), [])
+
+        call_command('rebuild_member_search_index', stdout=StringIO())
+        self.assertEqual(self._search(u"third"), [self.mem_3])
+
 
 class TestDeleteMemberView(MembersTestsMixin, TestCase):
 
@@ -1361,10 +1449,82 @@ class TestVolunteerEdit(MembersTestsMixin, TestCase):
         shutil.rmtree(os.path.join('/tmp', settings.VOLUNTEER_PORTRAIT_DIR))
 
 
+class TestMailoutMessage(MembersTestsMixin, TestCase):
+    def _old_build(self, subject, body, email, name, pk, key):
+        # How each copy was built before the message was precompiled:
+        signature = mailout_message.signature_template()
+        header = mailout_message.HEADER_TEMPLATE.format(name)
+        mail_body = header + body + signature.format(
+            reverse("unsubscribe-member", args=(pk,)),
+            reverse("edit-member", args=(pk,)),
+            key,
+        )
+        mail_is_ascii = (mailout_message.string_is_ascii(body) and
+                         mailout_message.string_is_ascii(signature) and
+                         mailout_message.string_is_ascii(header))
+        return mailout_message.build_email(email, subject, mail_body, mail_is_ascii)
+
+    def _assert_same_as_old(self, subject, body, recipients):
+        message = mailout_message.MailoutMessage(subject, body)
+        for email, name, pk, key in recipients:
+            self.assertEqual(message.build(email, name, pk, key),
+                             self._old_build(subject, body, email, name, pk, key))
+
+    def _members(self):
+        return [(member.email, member.name, member.pk, member.mailout_key)
+                for member in Member.objects.exclude(email=None).exclude(email='')]
+
+    def test_ascii_body(self):
+        self._assert_same_as_old(u"The Subject!", u"The Body!\nFrom here, 100% of it\n", self._members())
+
+    def test_unicode_body(self):
+        self._assert_same_as_old(u"The \xa31 Subject \u2603!",
+                                 u"The Body!\nThat will be \u20ac1, please\nTa \u2603!",
+                                 self._members())
+
+    def test_awkward_recipients(self):
+        recipients = [
+            (u"someone@example.com", u"Name with\nFrom a newline", 123, u"key"),
+            (u"someone@example.com", u"100% Zo\u00eb", 124, u"key"),
+            (u"Zo\u00eb <zoe@example.com>", u"Zo\u00eb", 125, u"key"),
+            (u"{0}@example.com".format(u"x" * 80), u"Long", 126, u"key"),
+        ]
+        self._assert_same_as_old(u"The Subject!", u"The Body!", recipients)
+        self._assert_same_as_old(u"The Subject!", u"The \u20ac Body!", recipients)
+
+
+# (Only one connection at a time, as the mock SMTP connections aren't thread
+# safe)
+@override_settings(MAILOUT_SMTP_CONNECTIONS=1)
 class TestMemberMailoutTask(MembersTestsMixin, TestCase):
     def setUp(self):
         super(TestMemberMailoutTask, self).setUp()
         self.assertTrue(self.client.login(username="admin", password="T3stPassword!"))
+        cache.clear()
+
+    def _send_mailout(self, subject, body):
+        self.mailout = Mailout.objects.create(subject=subject, body=body)
+        return self._run_mailout(self.mailout)
+
+    def _run_mailout(self, mailout):
+        # Run send_mailout, then the batch tasks and the report task it would
+        # have started, in this thread. Returns the result of the report task
+        # (or of send_mailout, if it didn't start anything).
+        # (With a task id, so that progress is recorded)
+        self.progress_id = "mailout-task-{0}".format(mailout.pk)
+        mailout_progress.start(self.progress_id)
+        with patch("toolkit.members.tasks.chord") as chord_mock:
+            result = toolkit.members.tasks.send_mailout.apply(
+                args=(mailout.pk,), task_id=self.progress_id).get()
+        if not chord_mock.called:
+            return result
+        batches = chord_mock.call_args[0][0]
+        report = chord_mock.return_value.call_args[0][0]
+        self.assertEqual(result['batches'], [batch.options['task_id'] for batch in batches])
+        self.assertEqual(result['report'], report.options['task_id'])
+        self.batch_args = [batch.args for batch in batches]
+        batch_results = [batch.apply().get() for batch in batches]
+        return report.apply(args=(batch_results,)).get()
 
     def _assert_mail_as_expected(self, msgstr, is_utf8, from_addr, dest_addr, body_contains, expected_subject):
         message = email.parser.Parser().parsestr(msgstr)
@@ -1387,19 +1547,17 @@ class TestMemberMailoutTask(MembersTestsMixin, TestCase):
         subject = subject[0][0].decode(subject[0][1]) if subject[0][1] else subject[0][0]
         self.assertEqual(subject, expected_subject)
 
-    def _assert_mail_sent(self, result, current_task_mock, smtplib_mock, subject, body, is_utf8):
-        current_task_mock.update_state.assert_has_calls([
-            call(state='PROGRESS017', meta={'total': 6, 'sent': 1}),
-            call(state='PROGRESS034', meta={'total': 6, 'sent': 2}),
-            call(state='PROGRESS051', meta={'total': 6, 'sent': 3}),
-            call(state='PROGRESS067', meta={'total': 6, 'sent': 4}),
-            call(state='PROGRESS084', meta={'total': 6, 'sent': 5}),
-            # 101% complete! (ahem)
-            call(state='PROGRESS101', meta={'total': 6, 'sent': 6})
-        ])
+    def _assert_mail_sent(self, result, smtplib_mock, subject, body, is_utf8):
+        self.assertEqual(mailout_progress.get(self.progress_id), {
+            'total': 6,
+            'sent': 6,
+            'error_count': 0,
+            'result': (False, 6, 'Ok'),
+        })
 
-        # Expect to have connected:
-        smtplib_mock.assert_called_once_with('smtp.test', 8281)
+        # Expect to have connected (once for the batch, once for the
+        # report):
+        self.assertEqual(smtplib_mock.call_args_list, [call('smtp.test', 8281)] * 2)
 
         # Sent 6 mails, plus one summary:
         conn = smtplib_mock.return_value
@@ -1426,51 +1584,46 @@ class TestMemberMailoutTask(MembersTestsMixin, TestCase):
         conn.quite.assert_called_once()
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_send_unicode(self, current_task_mock, smtplib_mock):
+    def test_send_unicode(self, smtplib_mock):
         subject = u"The Subject \u2603!"
         body = u"The Body!\nThat will be \u20ac1, please\nTa \u2603!"
-        result = toolkit.members.tasks.send_mailout(subject, body)
-        self._assert_mail_sent(result, current_task_mock, smtplib_mock, subject, body, True)
+        result = self._send_mailout(subject, body)
+        self._assert_mail_sent(result, smtplib_mock, subject, body, True)
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_send_ascii(self, current_task_mock, smtplib_mock):
+    def test_send_ascii(self, smtplib_mock):
         subject = u"The Subject!"
         body = u"The Body!\nThat will be $1, please\nTa!"
-        result = toolkit.members.tasks.send_mailout(subject, body)
-        self._assert_mail_sent(result, current_task_mock, smtplib_mock, subject, body, False)
+        result = self._send_mailout(subject, body)
+        self._assert_mail_sent(result, smtplib_mock, subject, body, False)
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_send_iso88591_subj(self, current_task_mock, smtplib_mock):
+    def test_send_iso88591_subj(self, smtplib_mock):
         subject = u"The \xa31 Subject!"
         body = u"The Body!\nThat will be $1, please\nTa!"
-        result = toolkit.members.tasks.send_mailout(subject, body)
-        self._assert_mail_sent(result, current_task_mock, smtplib_mock, subject, body, False)
+        result = self._send_mailout(subject, body)
+        self._assert_mail_sent(result, smtplib_mock, subject, body, False)
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_connect_fail(self, current_task_mock, smtplib_mock):
+    def test_connect_fail(self, smtplib_mock):
         smtplib_mock.side_effect = smtplib.SMTPConnectError("Blah", 101)
 
-        result = toolkit.members.tasks.send_mailout(
+        result = self._send_mailout(
             u"The \xa31 Subject!", u"The Body!\nThat will be $1, please\nTa!"
         )
 
         self.assertEqual(result, (True, 0, "Failed to connect to SMTP server: ('Blah', 101)"))
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_send_fail(self, current_task_mock, smtplib_mock):
+    def test_send_fail(self, smtplib_mock):
         smtplib_mock.return_value.sendmail.side_effect = smtplib.SMTPException("Something failed", 101)
 
-        result = toolkit.members.tasks.send_mailout(
+        result = self._send_mailout(
             u"The \xa31 Subject!", u"The Body!\nThat will be $1, please\nTa!"
         )
 
@@ -1478,25 +1631,127 @@ class TestMemberMailoutTask(MembersTestsMixin, TestCase):
         self.assertEqual(result, (False, 6, "Ok"))
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_send_fail_disconnected(self, current_task_mock, smtplib_mock):
+    def test_send_fail_disconnected(self, smtplib_mock):
         smtplib_mock.return_value.sendmail.side_effect = smtplib.SMTPServerDisconnected("Something failed", 101)
 
-        result = toolkit.members.tasks.send_mailout(
+        result = self._send_mailout(
             u"The \xa31 Subject!", u"The Body!\nThat will be $1, please\nTa!"
         )
 
         self.assertEqual(result, (True, 0, "Mailout job died: ('Something failed', 101)"))
+        # Connected, then tried reconnecting twice (for the batch, then
+        # again for the report):
+        self.assertEqual(smtplib_mock.call_count, 6)
+
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281, MAILOUT_SMTP_RECONNECT_ATTEMPTS=2)
+    def test_send_reconnect(self, smtplib_mock):
+        # Connection dropped sending the second message:
+        sendmail = smtplib_mock.return_value.sendmail
+        sendmail.side_effect = [{}, smtplib.SMTPServerDisconnected("Gone away"),
+                                {}, {}, {}, {}, {}, {}]
+
+        result = self._send_mailout(
+            u"The Subject!", u"The Body!\nThat will be $1, please\nTa!"
+        )
+
+        self.assertEqual(result, (False, 6, "Ok"))
+        self.assertEqual(smtplib_mock.call_count, 3)
+        # Second message was retried:
+        self.assertEqual(sendmail.call_count, 8)
+        self.assertEqual(sendmail.call_args_list[1], sendmail.call_args_list[2])
+
+    @override_settings(MAILOUT_SMTP_CONNECTIONS=3, MAILOUT_BATCH_SIZE=4)
+    def test_send_to_smtp_sink(self):
+        with SMTPSink() as sink:
+            with self.settings(EMAIL_HOST=sink.host, EMAIL_PORT=sink.port):
+                result = self._send_mailout(
+                    u"The Subject \u2603!", u"The Body!\nThat will be \u20ac1, please\nTa \u2603!"
+                )
+
+        self.assertEqual(result, (False, 6, "Ok"))
+        # Two batches, split by pk:
+        member_ids = [member.pk for member in Member.objects.mailout_recipients().order_by('pk')]
+        self.assertEqual([args[1:] for args in self.batch_args],
+                         [(member_ids[0], member_ids[3], self.progress_id, 0),
+                          (member_ids[4], member_ids[5], self.progress_id, 1)])
+        self.assertEqual(mailout_progress.get(self.progress_id), {
+            'total': 6,
+            'sent': 6,
+            'error_count': 0,
+            'result': (False, 6, "Ok"),
+        })
+
+        recipients = [rcpttos for _, rcpttos, _ in sink.messages]
+        expected = [[member.email] for member in Member.objects.mailout_recipients()]
+        self.assertEqual(sorted(recipients[:6]), sorted(expected))
+        # Report sent last:
+        self.assertEqual(recipients[6], [settings.MAILOUT_DELIVERY_REPORT_TO])
+        self.assertEqual(len(sink.messages), 7)
+        for mailfrom, _, data in sink.messages:
+            self.assertEqual(mailfrom, settings.MAILOUT_FROM_ADDRESS)
+        self._assert_mail_as_expected(
+            sink.messages[6][2], True, settings.MAILOUT_FROM_ADDRESS,
+            settings.MAILOUT_DELIVERY_REPORT_TO,
+            u"6 copies of the following were sent out on cube members list",
+            u"The Subject \u2603!")
+
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
+    def test_send_progress(self, smtplib_mock):
+        smtplib_mock.return_value.sendmail.side_effect = [
+            {}, smtplib.SMTPException("Refused"), {}, {}, {}, {}, {}]
+
+        with patch("toolkit.members.tasks.mailout_progress.update_batch") as update_batch_mock:
+            result = self._send_mailout(u"The Subject!", u"The Body!")
+
+        self.assertEqual(result, (False, 6, "Ok"))
+        # After each message (i.e. each 1%), and once at the end:
+        self.assertEqual(update_batch_mock.call_args_list, [
+            call(self.progress_id, 0, 1, 0),
+            call(self.progress_id, 0, 2, 1),
+            call(self.progress_id, 0, 3, 1),
+            call(self.progress_id, 0, 4, 1),
+            call(self.progress_id, 0, 5, 1),
+            call(self.progress_id, 0, 6, 1),
+            call(self.progress_id, 0, 6, 1),
+        ])
+
+    @patch("toolkit.members.tasks.chord")
+    def test_start_fail(self, chord_mock):
+        chord_mock.side_effect = IOError("No broker")
+        mailout = Mailout.objects.create(subject=u"The Subject!", body=u"The Body!")
+        mailout_progress.start(u"task-id")
+
+        result = toolkit.members.tasks.send_mailout.apply(args=(mailout.pk,), task_id=u"task-id")
+
+        self.assertEqual(result.state, "FAILURE")
+        # Recorded the failure for the progress view:
+        self.assertEqual(mailout_progress.get(u"task-id")['result'],
+                         (True, 0, "Mailout job died: No broker"))
+
+    @patch("toolkit.members.tasks.MailoutMessage")
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
+    def test_message_error(self, smtplib_mock, message_mock):
+        message_mock.side_effect = ValueError("Bad URL")
+
+        result = self._send_mailout(u"The Subject!", u"The Body!")
+
+        # Batch failed, but the connection was closed and the report still sent:
+        self.assertEqual(result, (True, 0, "Mailout job died: Bad URL"))
+        self.assertEqual(smtplib_mock.return_value.quit.call_count, 2)
+        self.assertEqual(smtplib_mock.return_value.sendmail.call_args[0][1],
+                         [settings.MAILOUT_DELIVERY_REPORT_TO])
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_random_error(self, current_task_mock, smtplib_mock):
+    def test_random_error(self, smtplib_mock):
         # Test a non SMTP error
         smtplib_mock.return_value.sendmail.side_effect = IOError("something")
 
-        result = toolkit.members.tasks.send_mailout(
+        result = self._send_mailout(
             u"The \xa31 Subject!", u"The Body!\nThat will be $1, please\nTa!"
         )
 
@@ -1504,13 +1759,94 @@ class TestMemberMailoutTask(MembersTestsMixin, TestCase):
         self.assertEqual(result, (True, 0, "Mailout job died: something"))
 
     @patch("smtplib.SMTP")
-    @patch("toolkit.members.tasks.current_task")
     @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
-    def test_no_recipients(self, current_task_mock, smtplib_mock):
+    def test_report_batches(self, smtplib_mock):
+        mailout = Mailout.objects.create(subject=u"The Subject!", body=u"The Body!")
+        members = list(Member.objects.mailout_recipients().order_by('pk'))
+        statuses = [MailoutDelivery.SENT] * 3 + [MailoutDelivery.FAILED] * 2 + [MailoutDelivery.SENDING]
+        errors = [u""] * 3 + [u"Non-ascii email address ?@example.com", u"Failed", u""]
+        for member, status, error in zip(members, statuses, errors):
+            MailoutDelivery.objects.create(mailout=mailout, member=member, status=status, error=error)
+        batch_results = [
+            {'sent': 2, 'failure': None},
+            {'sent': 1, 'failure': u"Mailout job died: Something"},
+            {'sent': 2, 'failure': None},
+        ]
+
+        result = toolkit.members.tasks.send_mailout_report(batch_results, mailout.pk)
+
+        self.assertEqual(result, (True, 5, u"Mailout job died: Something"))
+        sendmail = smtplib_mock.return_value.sendmail
+        self.assertEqual(sendmail.call_count, 1)
+        self.assertEqual(sendmail.call_args[0][1], [settings.MAILOUT_DELIVERY_REPORT_TO])
+        report = email.parser.Parser().parsestr(sendmail.call_args[0][2]).get_payload()
+        self.assertIn(u"5 copies of the following were sent out", report)
+        self.assertIn(u"1 of 3 batches failed:\nMailout job died: Something\n", report)
+        self.assertIn(u"1 copies may or may not have been sent", report)
+        self.assertIn(u"2 errors:\nNon-ascii email address ?@example.com\nFailed", report)
+        self.assertNotEqual(Mailout.objects.get(pk=mailout.pk).finished_at, None)
+
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281, MAILOUT_LEDGER_BATCH_SIZE=2)
+    def test_send_ledger(self, smtplib_mock):
+        sendmail = smtplib_mock.return_value.sendmail
+        sendmail.side_effect = [{}, smtplib.SMTPException("Refused"), {}, {}, {}, {}, {}]
+
+        result = self._send_mailout(u"The Subject!", u"The Body!")
+
+        self.assertEqual(result, (False, 6, "Ok"))
+        members = list(Member.objects.mailout_recipients().order_by('pk'))
+        self.assertEqual(
+            list(self.mailout.deliveries.order_by('member').values_list('member', 'status', 'error')),
+            [(members[0].pk, MailoutDelivery.SENT, u""),
+             (members[1].pk, MailoutDelivery.FAILED, u"Refused")] +
+            [(member.pk, MailoutDelivery.SENT, u"") for member in members[2:]])
+        self.assertEqual(self.mailout.pending_recipients().count(), 0)
+
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281, MAILOUT_LEDGER_BATCH_SIZE=2)
+    def test_resume(self, smtplib_mock):
+        sendmail = smtplib_mock.return_value.sendmail
+        # Dies sending the fourth message (and the report):
+        sendmail.side_effect = [{}, {}, {}, IOError("something"), IOError("something")]
+
+        result = self._send_mailout(u"The Subject!", u"The Body!")
+
+        self.assertEqual(result, (True, 3, "Mailout job died: something"))
+        members = list(Member.objects.mailout_recipients().order_by('pk'))
+        self.assertEqual(self.mailout.delivery_counts(), {
+            MailoutDelivery.SENT: 3,
+            MailoutDelivery.FAILED: 0,
+            # Fourth message (claimed, but don't know if it was sent):
+            MailoutDelivery.SENDING: 1,
+        })
+        self.assertEqual(list(self.mailout.pending_recipients().order_by('pk')), members[4:])
+
+        sendmail.reset_mock()
+        sendmail.side_effect = None
+        result = self._run_mailout(self.mailout)
+
+        self.assertEqual(result, (False, 5, "Ok"))
+        # Only sent to the last two members, then the report:
+        self.assertEqual([sendmail_call[0][1] for sendmail_call in sendmail.call_args_list],
+                         [[members[4].email], [members[5].email], [settings.MAILOUT_DELIVERY_REPORT_TO]])
+        report = email.parser.Parser().parsestr(sendmail.call_args[0][2]).get_payload()
+        self.assertIn(u"5 copies of the following were sent out", report)
+        self.assertIn(u"1 copies may or may not have been sent", report)
+
+        # Nothing left to send:
+        result = self._run_mailout(self.mailout)
+        self.assertEqual(result, (True, 0, "No recipients found"))
+
+    @patch("smtplib.SMTP")
+    @override_settings(EMAIL_HOST="smtp.test", EMAIL_PORT=8281)
+    def test_no_recipients(self, smtplib_mock):
         Member.objects.all().delete()
         # Test a non SMTP error
-        result = toolkit.members.tasks.send_mailout(
+        result = self._send_mailout(
             u"The \xa31 Subject!", u"The Body!\nThat will be $1, please\nTa!"
         )
 
         self.assertEqual(result, (True, 0, "No recipients found"))
+        self.assertEqual(mailout_progress.get(self.progress_id)['result'],
+                         (True, 0, "No recipients found"))
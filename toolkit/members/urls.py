@@ -21,6 +21,7 @@ member_urls = patterns(
     # Internal:
     url(r'^add/$', 'add_member', name='add-member'),
     url(r'^search/$', 'search', name='search-members'),
+    url(r'^search/json/$', 'search_json', name='search-members-json'),
     url(r'^(?P<member_id>\d+)$', 'view', name='view-member'),
     url(r'^(?P<member_id>\d+)/edit/$', 'edit_member', name='edit-member'),
     url(r'^(?P<member_id>\d+)/delete$', 'delete_member', name='delete-member'),
@@ -1,4 +1,5 @@
 import os.path
+from celery.schedules import crontab
 import django.core.urlresolvers
 import sys
 
@@ -18,6 +19,22 @@ Additonal Info -"""
 
 DEFAULT_MUGSHOT = "/static/members/default_mugshot.gif"
 
+# Images shown in place of thumbnails (by thumbnail alias) that haven't been
+# generated yet (see toolkit/util/thumbnail_queue.py):
+THUMBNAIL_PLACEHOLDERS = {
+    'portrait': DEFAULT_MUGSHOT,
+    'std': "/static/diary/default_programme_image.gif",
+}
+# Seconds to wait after a file is uploaded before generating its thumbnails:
+THUMBNAIL_GENERATE_DELAY = 5
+
+# As Django's default upload handlers, but also hashing uploads as they're
+# received (see toolkit/util/media_store.py):
+FILE_UPLOAD_HANDLERS = (
+    "toolkit.util.media_store.HashingMemoryFileUploadHandler",
+    "toolkit.util.media_store.HashingTemporaryFileUploadHandler",
+)
+
 # This is used as the hostname for unsubscribe links in emails (i.e. emails
 # will have links added to http://[this]/members/100/unsubscribe)
 EMAIL_UNSUBSCRIBE_HOST = "cubecinema.com"
@@ -31,6 +48,22 @@ EMAIL_PORT = 25
 MAILOUT_DELIVERY_REPORT_TO = u"cubeadmin@cubecinema.com"
 # "From" address for mailout
 MAILOUT_FROM_ADDRESS = u"mailout@cubecinema.com"
+# Number of recipients in each of the batches (celery tasks) that a mailout is
+# split into (see send_mailout in toolkit/members/tasks.py):
+MAILOUT_BATCH_SIZE = 500
+# Number of recipients in a batch to record as being sent to in the delivery
+# ledger at once. If sending dies, up to this many members won't know whether
+# they were sent the mailout (and won't be sent it again when it's resumed):
+MAILOUT_LEDGER_BATCH_SIZE = 50
+# Longest time (in seconds) the mailout progress view waits for progress to
+# change before responding anyway:
+MAILOUT_PROGRESS_LONG_POLL_TIMEOUT = 20
+# Number of connections to the SMTP server to send a mailout over at once (see
+# toolkit/members/delivery.py):
+MAILOUT_SMTP_CONNECTIONS = 4
+# Number of times to reconnect and try again if the SMTP server drops the
+# connection while sending a message:
+MAILOUT_SMTP_RECONNECT_ATTEMPTS = 2
 
 # The maximum number of each type of role that can be assigned to a showing
 # (so, for example, can't have more than this number of bar staff)
@@ -44,6 +77,25 @@ VOLUNTEER_PORTRAIT_DIR = 'volunteers'
 # programmes can be uploaded
 DAWN_OF_TIME = 1998
 
+# Number of seconds for which rendered public programme pages are cached
+# (the cache is also invalidated whenever the data on a page changes, so this
+# can be fairly long)
+PROGRAMME_CACHE_TIMEOUT = 60 * 60
+
+# Number of seconds for which the rendered details of each event on the
+# programme pages (event_fragment.html) are cached (see fragment_cache.py)
+EVENT_FRAGMENT_CACHE_TIMEOUT = 24 * 60 * 60
+# Count hits / misses in the event fragment cache (see the event_fragment_stats
+# management command). Costs a cache write for every fragment, so only turn
+# on while investigating:
+EVENT_FRAGMENT_CACHE_STATS = False
+
+# Copy / terms / rota reports covering more than this number of days are sent
+# as they're rendered rather than built up in memory first, with the showings
+# loaded STREAMED_REPORT_CHUNK_SIZE at a time (see diary/reports.py)
+STREAMED_REPORT_MIN_DAYS = 62
+STREAMED_REPORT_CHUNK_SIZE = 100
+
 ###############################################################################
 #
 # Below here are Django settings
@@ -78,11 +130,36 @@ APP_ROOT_DETECTED = os.path.abspath(os.path.join(os.path.dirname(
 
 APPEND_SLASH = True
 
+# Cache. This needs to be shared between all server processes (so not the
+# local memory cache) otherwise changes made in one process won't invalidate
+# pages cached by the others:
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(APP_ROOT_DETECTED, 'cache'),
+    }
+}
+
+# Directory that pages from the public programme are pre-rendered to, for
+# Apache to serve directly (see toolkit/diary/static_programme.py). Set to None
+# to disable:
+STATIC_PROGRAMME_ROOT = os.path.join(APP_ROOT_DETECTED, 'programme_static')
+
 # Celery
 BROKER_URL = 'django://'
 CELERY_RESULT_BACKEND = 'database'
 CELERY_RESULT_DBURI = "django://"
 
+# Periodic tasks, run by celerybeat (see serverconfig/supervisor-conf.d):
+CELERYBEAT_SCHEDULE = {
+    # Pages of the static programme that change with the date have to be
+    # re-rendered once the date has changed (times are in TIME_ZONE):
+    'render-current-static-programme': {
+        'task': 'toolkit.diary.tasks.render_current_static_programme',
+        'schedule': crontab(hour=0, minute=1),
+    },
+}
+
 
 # Django settings for cube project.
 ALLOWED_HOSTS = ['.cubecinema.com', ]
@@ -0,0 +1,414 @@
+"""Model formsets that validate and save all their forms with a handful of
+queries, rather than several per form (used for the role, event template and
+tag editors; see diary.edit_views)
+
+Django's BaseModelFormSet looks up the object for each form with its own
+query when validating, checks unique fields with a query per form, and saves
+each changed object (and each of its many-to-many relations), and deletes
+each deleted object, one at a time. BulkModelFormSet instead:
+
+- finds the objects for the forms in the formset's queryset, which is loaded
+  once anyway
+- loads the many-to-many relations of all those objects, and checks the
+  chosen related objects, with one query per field, rather than one per field
+  per form
+- checks unique fields for all the changed forms with one query per field
+- deletes all the deleted objects with one query
+- updates the changed objects with one UPDATE for each distinct set of
+  changes
+- applies the many-to-many changes with one insert and one delete per field
+
+New objects are still saved one at a time, as they need primary keys.
+
+Model.save() and Model.delete() aren't called for changed / deleted objects
+so any protection those methods implement needs to be made available to the
+formset: if the model has save_allowed() / delete_allowed() methods then
+objects for which they return False are left alone, as save() / delete()
+would.
+
+Signals: post_save isn't sent for changed objects, and m2m_changed isn't sent
+for the many-to-many changes; the bulk_updated signal is sent (once, with all
+the changed objects) instead. (post_save is sent for new objects, and
+pre_delete / post_delete for deleted ones, as usual.) So anything that
+listens to post_save for a model that's edited with a BulkModelFormSet must
+also listen to bulk_updated. Currently that's:
+
+- diary.choice_cache._choices_changed, for Role and EventTemplate (the
+  role and event template editors)
+- util.thumbnail_cache._file_owner_changed, but only for models with file
+  fields, which none of them have
+
+(EventTag is only ever created with a BulkModelFormSet, so its receivers in
+diary.page_cache, diary.search and diary.static_programme don't need to.)
+Nothing listens to m2m_changed for EventTemplate.roles / tags.
+"""
+import logging
+import operator
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.validators import EMPTY_VALUES
+from django.db.models import Q
+from django.dispatch import Signal
+from django.forms.models import BaseModelFormSet, modelformset_factory
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_text
+import django.utils.timezone as timezone
+
+from toolkit.util.ordereddict import OrderedDict
+from toolkit.util.db import commit_on_success_unless_managed
+
+logger = logging.getLogger(__name__)
+
+# Sent by BulkModelFormSet.save after updating existing objects, with the
+# model as the sender, in place of post_save and m2m_changed (see the module
+# docstring for which receivers need to listen to it):
+bulk_updated = Signal(providing_args=['objects'])
+
+
+def _allowed(obj, check_name):
+    check = getattr(obj, check_name, None)
+    return check is None or check()
+
+
+def validate_unique_in_db(model, forms, exclude_pks=()):
+    """Check the unique fields of the (valid, ModelForm) forms against the
+    database and each other, with one query per field, adding an error to
+    any form with a clash. Rows with a primary key in exclude_pks are
+    ignored."""
+    manager = model._default_manager
+    for field in model._meta.local_fields:
+        if not field.unique or field.primary_key:
+            continue
+        forms_by_value = OrderedDict()
+        for form in forms:
+            if field.name not in form.cleaned_data:
+                continue
+            if form.instance.pk is not None and field.name not in form.changed_data:
+                continue
+            # (Use the value from the instance, which has been through the
+            # model's clean() method)
+            value = getattr(form.instance, field.attname)
+            if value not in EMPTY_VALUES:
+                forms_by_value.setdefault(value, []).append(form)
+        if not forms_by_value:
+            continue
+
+        existing = manager.filter(**{field.name + '__in': forms_by_value.keys()})
+        if exclude_pks:
+            existing = existing.exclude(pk__in=list(exclude_pks))
+        existing = set(existing.values_list(field.attname, flat=True))
+
+        for value, value_forms in forms_by_value.iteritems():
+            clashes = value_forms if value in existing else value_forms[1:]
+            for form in clashes:
+                message = form.instance.unique_error_message(model, (field.name,))
+                form._errors[field.name] = form.error_class([message])
+                del form.cleaned_data[field.name]
+
+
+class BulkModelFormMixin(object):
+    """Mixin for the forms in a BulkModelFormSet (bulk_modelformset_factory
+    adds it, see _bulk_form). Note that only single field unique constraints
+    are checked.
+
+    The many-to-many fields are excluded from the form's Meta (and added
+    back as declared fields) so that ModelForm doesn't look up their initial
+    values with a query per field; they're set from m2m_initial instead."""
+    # Names of the many-to-many fields:
+    bulk_m2m_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        # Function that returns the initial values of the many-to-many fields
+        # for the instance, given its pk (see BulkModelFormSet._m2m_initial):
+        m2m_initial = kwargs.pop('m2m_initial', None)
+        super(BulkModelFormMixin, self).__init__(*args, **kwargs)
+        if self.instance.pk is None or not self.bulk_m2m_fields:
+            return
+        if m2m_initial is not None:
+            values = m2m_initial(self.instance.pk)
+        else:
+            # (Not in a BulkModelFormSet)
+            values = dict((name, list(getattr(self.instance, name).values_list('pk', flat=True)))
+                          for name in self.bulk_m2m_fields)
+        for name, value in values.iteritems():
+            # (Anything given in the initial argument takes priority, as it
+            # would for ModelForm)
+            self.initial.setdefault(name, value)
+
+    def validate_unique(self):
+        # Done for all the forms at once by BulkModelFormSet.validate_unique
+        pass
+
+
+class _PreloadedObjectField(forms.ModelChoiceField):
+    """Field for the primary key of each form in a BulkModelFormSet, which
+    finds the object in the formset's queryset rather than querying for it"""
+    def __init__(self, formset, *args, **kwargs):
+        super(_PreloadedObjectField, self).__init__(*args, **kwargs)
+        self.formset = formset
+
+    def to_python(self, value):
+        if value in EMPTY_VALUES:
+            return None
+        try:
+            obj = self.formset._existing_object(self.formset.model._meta.pk.to_python(value))
+        except ValidationError:
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'])
+        return obj
+
+
+class _PreloadedMultipleObjectField(forms.ModelMultipleChoiceField):
+    """Many-to-many field of the forms in a BulkModelFormSet, which finds the
+    chosen objects in the field's queryset, loaded once for the whole formset,
+    rather than querying for them for each form. Returns a list of objects
+    rather than a queryset."""
+    # Set for each form by BulkModelFormSet.add_fields:
+    formset = None
+    formset_field_name = None
+
+    @classmethod
+    def from_field(cls, field):
+        """Return a new field with the same settings as the given
+        ModelMultipleChoiceField"""
+        return cls(field.queryset, required=field.required, widget=field.widget,
+                   label=field.label, initial=field.initial, help_text=field.help_text,
+                   error_messages=field.error_messages, show_hidden_initial=field.show_hidden_initial,
+                   validators=field.validators, localize=field.localize)
+
+    def clean(self, value):
+        if self.formset is None:
+            return super(_PreloadedMultipleObjectField, self).clean(value)
+        if not value:
+            if self.required:
+                raise ValidationError(self.error_messages['required'])
+            return []
+        if not isinstance(value, (list, tuple)):
+            raise ValidationError(self.error_messages['list'])
+        objects = self.formset._related_objects(self.formset_field_name, self.queryset)
+        result = []
+        for item in value:
+            obj = objects.get(force_text(item))
+            if obj is None:
+                raise ValidationError(self.error_messages['invalid_choice'] % item)
+            result.append(obj)
+        self.run_validators(value)
+        return result
+
+
+class BulkModelFormSet(BaseModelFormSet):
+
+    def add_fields(self, form, index):
+        super(BulkModelFormSet, self).add_fields(form, index)
+        pk_name = self._pk_field.name
+        pk_field = form.fields[pk_name]
+        form.fields[pk_name] = _PreloadedObjectField(
+            self, pk_field.queryset, initial=pk_field.initial,
+            required=False, widget=pk_field.widget)
+        for name in self._m2m_field_names():
+            field = form.fields.get(name)
+            if isinstance(field, _PreloadedMultipleObjectField):
+                field.formset = self
+                field.formset_field_name = name
+
+    def _related_objects(self, name, queryset):
+        """Return dict mapping (text) pk -> object for the queryset of the
+        many-to-many field with the given name, loaded once per formset"""
+        if not hasattr(self, '_related_object_cache'):
+            self._related_object_cache = {}
+        if name not in self._related_object_cache:
+            self._related_object_cache[name] = dict(
+                (force_text(obj.pk), obj) for obj in queryset)
+        return self._related_object_cache[name]
+
+    def _construct_form(self, i, **kwargs):
+        kwargs['m2m_initial'] = self._m2m_initial
+        return super(BulkModelFormSet, self)._construct_form(i, **kwargs)
+
+    def _m2m_field_names(self):
+        return [field.name for field in self.model._meta.many_to_many
+                if field.name in self.form.base_fields]
+
+    def _m2m_initial(self, pk):
+        """Return dict mapping the name of each many-to-many field in the form
+        to the list of pks of the related objects for the object with the
+        given pk. The relations for every object in the queryset are loaded
+        the first time this is called, with one query per field."""
+        if not hasattr(self, '_m2m_values'):
+            self._m2m_values = {}
+            for name in self._m2m_field_names():
+                field = self.model._meta.get_field(name)
+                through = field.rel.through
+                source_attname = through._meta.get_field(field.m2m_field_name()).attname
+                target_attname = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                related = {}
+                rows = (through._default_manager
+                               .filter(**{source_attname + '__in': self.get_queryset().values('pk')})
+                               .order_by('pk')
+                               .values_list(source_attname, target_attname))
+                for source_pk, target_pk in rows:
+                    related.setdefault(source_pk, []).append(target_pk)
+                self._m2m_values[name] = related
+        return dict((name, list(related.get(pk, ())))
+                    for name, related in self._m2m_values.iteritems())
+
+    def _is_changed(self, form):
+        return form.has_changed() and not (self.can_delete and self._should_delete_form(form))
+
+    def validate_unique(self):
+        # Check the forms against each other:
+        super(BulkModelFormSet, self).validate_unique()
+        # ...and against everything not in the formset:
+        validate_unique_in_db(
+            self.model,
+            [form for form in self.forms if form.is_valid() and self._is_changed(form)],
+            exclude_pks=[form.instance.pk for form in self.forms
+                         if form.instance.pk is not None])
+
+    def save(self, commit=True):
+        """Save the changes from all the forms (see module docstring) and
+        return the list of changed and new objects, as for
+        BaseModelFormSet"""
+        if not commit:
+            # Leave it to the caller. The forms' save_m2m() doesn't save the
+            # many-to-many fields, as they're excluded from the forms' Meta
+            # (see _bulk_form), so the formset's does that itself:
+            result = super(BulkModelFormSet, self).save(commit)
+            saved = set(id(obj) for obj in result)
+            saved_forms = [form for form in self.forms
+                           if id(form.instance) in saved]
+            self.save_m2m = lambda: self._save_m2m(saved_forms)
+            return result
+
+        existing_forms = [form for form in self.initial_forms
+                          if form.instance.pk is not None]
+        with commit_on_success_unless_managed():
+            self._delete_objects(existing_forms)
+            changed_forms = self._update_objects(existing_forms)
+            new_forms = self._create_objects()
+            self._save_m2m(changed_forms + new_forms)
+        return [obj for obj, _ in self.changed_objects] + self.new_objects
+
+    def _delete_objects(self, existing_forms):
+        self.deleted_objects = []
+        if not self.can_delete:
+            return
+        for form in existing_forms:
+            if not self._should_delete_form(form):
+                continue
+            if _allowed(form.instance, 'delete_allowed'):
+                self.deleted_objects.append(form.instance)
+            else:
+                logger.error(u"Not deleting {0}: not allowed".format(form.instance))
+        if self.deleted_objects:
+            self.model._default_manager.filter(
+                pk__in=[obj.pk for obj in self.deleted_objects]).delete()
+
+    def _update_objects(self, existing_forms):
+        self.changed_objects = []
+        changed_forms = []
+        # Map changes (tuple of (attname, value) pairs) -> list of pks:
+        updates = OrderedDict()
+        # (All the objects get the same updated time, so they can share an
+        # UPDATE)
+        now = timezone.now()
+        fields = self.model._meta.local_fields
+        for form in existing_forms:
+            obj = form.instance
+            if not self._is_changed(form):
+                continue
+            if not _allowed(obj, 'save_allowed'):
+                logger.error(u"Not saving {0}: not allowed".format(obj))
+                continue
+            self.changed_objects.append((obj, form.changed_data))
+            changed_forms.append(form)
+
+            changes = []
+            for field in fields:
+                if getattr(field, 'auto_now', False):
+                    setattr(obj, field.attname, now)
+                    changes.append((field.attname, now))
+                elif field.name in form.changed_data:
+                    # (pre_save commits uploaded files)
+                    changes.append((field.attname, field.pre_save(obj, False)))
+            if changes:
+                updates.setdefault(tuple(changes), []).append(obj.pk)
+
+        manager = self.model._default_manager
+        for changes, pks in updates.iteritems():
+            manager.filter(pk__in=pks).update(**dict(changes))
+        if updates:
+            bulk_updated.send(sender=self.model,
+                              objects=[obj for obj, _ in self.changed_objects])
+        return changed_forms
+
+    def _create_objects(self):
+        self.new_objects = []
+        new_forms = []
+        for form in self.extra_forms:
+            if self._is_changed(form):
+                # (commit=False, as the relations are saved with everything
+                # else's)
+                self.new_objects.append(form.save(commit=False))
+                form.instance.save()
+                new_forms.append(form)
+        return new_forms
+
+    def _save_m2m(self, saved_forms):
+        for name in self._m2m_field_names():
+            field = self.model._meta.get_field(name)
+            through = field.rel.through
+            source_attname = through._meta.get_field(field.m2m_field_name()).attname
+            target_name = field.m2m_reverse_field_name()
+            target_attname = through._meta.get_field(target_name).attname
+
+            removed = []
+            added = []
+            for form in saved_forms:
+                if name not in form.cleaned_data or form.instance.pk is None:
+                    continue
+                current = set(form.initial.get(name) or ())
+                wanted = set(obj.pk for obj in form.cleaned_data[name])
+                if current - wanted:
+                    removed.append(Q(**{
+                        source_attname: form.instance.pk,
+                        target_attname + '__in': list(current - wanted),
+                    }))
+                added.extend(through(**{source_attname: form.instance.pk,
+                                        target_attname: pk})
+                             for pk in wanted - current)
+
+            if removed:
+                through._default_manager.filter(reduce(operator.or_, removed)).delete()
+            if added:
+                through._default_manager.bulk_create(added)
+
+
+def _bulk_form(form):
+    """Return a subclass of the given ModelForm class (as generated by
+    modelformset_factory) for a BulkModelFormSet"""
+    m2m_names = [field.name for field in form._meta.model._meta.many_to_many
+                 if field.name in form.base_fields]
+    attrs = {'bulk_m2m_fields': tuple(m2m_names)}
+    if m2m_names:
+        attrs['Meta'] = type('Meta', (form.Meta,), {
+            'exclude': tuple(form._meta.exclude or ()) + tuple(m2m_names)})
+        for name in m2m_names:
+            field = form.base_fields[name]
+            if type(field) is forms.ModelMultipleChoiceField and not field.to_field_name:
+                field = _PreloadedMultipleObjectField.from_field(field)
+            attrs[name] = field
+    bulk_form = type(form.__name__, (BulkModelFormMixin, form), attrs)
+    # (Declared fields go after the others, so put them back in order)
+    bulk_form.base_fields = SortedDict((name, bulk_form.base_fields[name])
+                                       for name in form.base_fields)
+    return bulk_form
+
+
+def bulk_modelformset_factory(model, form=forms.ModelForm, formset=BulkModelFormSet, **kwargs):
+    """As modelformset_factory, returning a BulkModelFormSet"""
+    formset = modelformset_factory(model, form=form, formset=formset, **kwargs)
+    formset.form = _bulk_form(formset.form)
+    return formset
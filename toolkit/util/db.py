@@ -0,0 +1,57 @@
+import threading
+import contextlib
+
+from django.db import transaction
+
+# Functions waiting for the transaction(s) started by commit_on_success in
+# this thread to commit (None when not inside one):
+_pending = threading.local()
+
+
+@contextlib.contextmanager
+def commit_on_success():
+    """As transaction.commit_on_success, but when the outermost such block
+    commits it then calls any functions passed to after_commit() inside it.
+    If the block raises they're thrown away, as whatever they were going to
+    act on has been rolled back."""
+    outermost = getattr(_pending, 'callbacks', None) is None
+    if outermost:
+        _pending.callbacks = []
+    try:
+        with transaction.commit_on_success():
+            yield
+    except:
+        if outermost:
+            _pending.callbacks = None
+        raise
+    if outermost:
+        callbacks, _pending.callbacks = _pending.callbacks, None
+        for callback in callbacks:
+            callback()
+
+
+def after_commit(callback):
+    """Call callback (with no arguments) once the changes made so far are
+    committed: when the enclosing commit_on_success block exits, or straight
+    away if there isn't one. Used for anything that must only happen once
+    other processes can see the changes, e.g. invalidating caches - if it's
+    done before, another request can re-cache the old data in between."""
+    callbacks = getattr(_pending, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+@contextlib.contextmanager
+def commit_on_success_unless_managed():
+    """As commit_on_success, unless a transaction is already in progress, in
+    which case the block becomes part of that transaction.
+
+    (commit_on_success commits when it exits even if it's nested inside
+    another transaction, e.g. the one in diary.edit_views.add_event)"""
+    if transaction.is_managed():
+        yield
+    else:
+        with commit_on_success():
+            yield
@@ -2,6 +2,13 @@ import logging
 
 import magic
 
+from easy_thumbnails.files import get_thumbnailer
+from easy_thumbnails.models import Thumbnail
+from easy_thumbnails.utils import get_storage_hash
+
+import toolkit.util.thumbnail_cache as thumbnail_cache
+import toolkit.util.thumbnail_queue as thumbnail_queue
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,3 +38,79 @@ def get_mimetype(source_file):
     logger.debug(u"Mime type for {0} detected as {1}".format(source_file.name, mimetype))
 
     return mimetype
+
+
+def get_thumbnail_urls(field_files, thumbnail_options, generate=True):
+    """
+    field_files must be an iterable of FieldFile objects, all from the same
+    model field.
+
+    returns dict mapping the name of each file to the URL of its thumbnail
+    (generated with the given easy_thumbnails options) or None if the
+    thumbnail couldn't be generated. If generate is False then missing
+    thumbnails are queued to be generated in the background (see
+    thumbnail_queue) and None is returned for them.
+
+    This is for use when a lot of thumbnails are needed at once; rather than
+    checking the modification time of every source and thumbnail file (as
+    easy_thumbnails does for each call to get_thumbnail) the thumbnails
+    recorded in the easy_thumbnails cache tables are looked up in a single
+    query. Any that aren't found are generated as normal. URLs are also
+    cached, see thumbnail_cache.
+    """
+    field_files = dict((field_file.name, field_file)
+                       for field_file in field_files if field_file)
+    urls = thumbnail_cache.get_cached_urls(field_files.keys(), thumbnail_options)
+
+    thumbnailers = {}
+    for name, field_file in field_files.iteritems():
+        if name not in urls:
+            thumbnailers[name] = get_thumbnailer(field_file)
+
+    if not thumbnailers:
+        return urls
+
+    # (Don't bother trying to be clever if @2x thumbnails are in use)
+    sample = next(thumbnailers.itervalues())
+    if not sample.thumbnail_high_resolution:
+        # Map possible thumbnail names to the source file name. (Thumbnails
+        # get a different extension depending on whether they're transparent,
+        # so there are two candidates for each source)
+        candidates = {}
+        for name, thumbnailer in thumbnailers.iteritems():
+            for transparent in (False, True):
+                thumbnail_name = thumbnailer.get_thumbnail_name(
+                    thumbnail_options, transparent=transparent)
+                candidates[thumbnail_name] = name
+
+        cached = (Thumbnail.objects.filter(
+            storage_hash=get_storage_hash(sample.thumbnail_storage),
+            name__in=candidates.keys(),
+            source__storage_hash=get_storage_hash(sample.source_storage),
+            source__name__in=thumbnailers.keys(),
+        ).values_list('name', 'modified', 'source__name', 'source__modified'))
+
+        for thumbnail_name, modified, source_name, source_modified in cached:
+            # Ignore thumbnails that are older than the source image:
+            if candidates.get(thumbnail_name) == source_name and source_modified <= modified:
+                thumbnailer = thumbnailers[source_name]
+                urls[source_name] = thumbnailer.thumbnail_storage.url(thumbnail_name)
+                thumbnail_cache.set_cached_url(source_name, thumbnail_options, urls[source_name])
+
+    for name, thumbnailer in thumbnailers.iteritems():
+        if name in urls:
+            continue
+        try:
+            thumbnail = thumbnailer.get_thumbnail(thumbnail_options, generate=generate)
+        except Exception:
+            logger.exception(u"Failed getting thumbnail for {0}".format(name))
+            urls[name] = None
+            continue
+        if thumbnail is None:
+            thumbnail_queue.queue(name, [thumbnail_options])
+            urls[name] = None
+        else:
+            urls[name] = thumbnail.url
+            thumbnail_cache.set_cached_url(name, thumbnail_options, urls[name])
+
+    return urls
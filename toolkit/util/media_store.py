@@ -0,0 +1,97 @@
+"""Content-addressed storage of uploaded files (used for MediaItem images, see
+diary.models.MediaItem.save)
+
+Uploads are hashed (SHA-1) as they're received, by the upload handlers below
+(see settings.FILE_UPLOAD_HANDLERS), and stored under a name made from the
+hash rather than the name they were uploaded with. If a file with the same
+content has been uploaded before then the existing file is used rather than
+storing another copy, so anything already generated from it (e.g.
+thumbnails) is reused as well.
+
+As files stored this way may be shared, they must never be deleted or
+changed in place (except by the dedupe_media_files management command, which
+moves existing files over to this scheme).
+"""
+import os.path
+import re
+import hashlib
+import logging
+
+from django.core.files.uploadhandler import (MemoryFileUploadHandler,
+                                             TemporaryFileUploadHandler)
+
+logger = logging.getLogger(__name__)
+
+# Base name (without the extension) of a content-addressed file:
+_CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{40}$')
+
+
+class _HashingUploadHandlerMixin(object):
+    # Keeps a hash of the data the handler stores, and sets it as the
+    # content_hash attribute of the uploaded file
+    def new_file(self, *args, **kwargs):
+        self.content_sha1 = hashlib.sha1()
+        return super(_HashingUploadHandlerMixin, self).new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining = super(_HashingUploadHandlerMixin, self).receive_data_chunk(raw_data, start)
+        if remaining is None:
+            # (This handler stored the data, rather than passing it on)
+            self.content_sha1.update(raw_data)
+        return remaining
+
+    def file_complete(self, file_size):
+        uploaded_file = super(_HashingUploadHandlerMixin, self).file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.content_hash = self.content_sha1.hexdigest()
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(_HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(_HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def content_hash(content):
+    """Return the (hex) SHA-1 hash of the content of a File, using the hash
+    worked out as it was uploaded if there is one"""
+    digest = getattr(content, 'content_hash', None)
+    if digest is None:
+        sha1 = hashlib.sha1()
+        for chunk in content.chunks():
+            sha1.update(chunk)
+        content.seek(0)
+        digest = sha1.hexdigest()
+    return digest
+
+
+def content_name(digest, original_name):
+    """Return the file name (without a directory) to store a file with the
+    given content hash under. The extension of the original name is kept, so
+    that the web server can still work out the type of the file."""
+    return digest + os.path.splitext(original_name)[1].lower()
+
+
+def hash_from_name(name):
+    """Return the content hash from the name of a content-addressed file, or
+    None if the name isn't one"""
+    base = os.path.splitext(os.path.basename(name or u""))[0]
+    return base if _CONTENT_NAME_RE.match(base) else None
+
+
+def use_content_name(field_file, digest):
+    """Rename the uncommitted file (i.e. upload) in field_file (a FieldFile)
+    to the content-addressed name for digest. If a file with that name has
+    already been stored, field_file is pointed at it and the upload won't be
+    stored again."""
+    name = content_name(digest, field_file.name)
+    stored_name = field_file.field.generate_filename(field_file.instance, name)
+    if field_file.storage.exists(stored_name):
+        logger.info(u"Using existing file {0} for upload {1}".format(stored_name, field_file.name))
+        field_file.name = stored_name
+        field_file._committed = True
+    else:
+        field_file.name = name
@@ -0,0 +1,4 @@
+# Connect the signal handlers that keep the thumbnail URL cache up to date,
+# and that queue generation of thumbnails for new files:
+import toolkit.util.thumbnail_cache
+import toolkit.util.thumbnail_queue
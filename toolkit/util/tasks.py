@@ -0,0 +1,17 @@
+from celery import task
+from celery.utils.log import get_task_logger
+
+import toolkit.util.thumbnail_queue as thumbnail_queue
+
+logger = get_task_logger(__name__)
+
+
+@task()
+def generate_thumbnails(source_name, options_list):
+    """Generate thumbnails of the given file with each of the given sets of
+    options (see thumbnail_queue.py). Returns the number of thumbnails
+    generated."""
+    generated = thumbnail_queue.generate(source_name, options_list)
+    logger.info(u"Generated {0} of {1} thumbnails for {2}".format(
+        generated, len(options_list), source_name))
+    return generated
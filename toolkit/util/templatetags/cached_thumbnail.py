@@ -0,0 +1,34 @@
+"""Replacement for the easy_thumbnails thumbnail_url filter that caches the
+thumbnail URLs (see toolkit.util.thumbnail_cache) and doesn't generate
+thumbnails in the request (see toolkit.util.thumbnail_queue)
+
+Usage is the same, i.e. {% load cached_thumbnail %} then
+{{ person.photo|thumbnail_url:'small' }}"""
+import logging
+
+from django import template
+
+import toolkit.util.thumbnail_cache as thumbnail_cache
+import toolkit.util.thumbnail_queue as thumbnail_queue
+
+logger = logging.getLogger(__name__)
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail_url(source, alias):
+    """Return the thumbnail url for a source file using an aliased set of
+    thumbnail options, the placeholder image url if the thumbnail hasn't been
+    generated yet, or an empty string if that fails"""
+    if not source:
+        return ''
+    try:
+        url = thumbnail_cache.get_thumbnail_url(source, alias, generate=False)
+        if url is None:
+            thumbnail_queue.queue_aliases(source)
+            return thumbnail_queue.placeholder_url(alias)
+        return url
+    except Exception:
+        logger.exception(u"Failed generating thumbnail for {0}, {1}".format(source, alias))
+        return ''
@@ -4,5 +4,232 @@ import tempfile
 from mock import patch
 
 from django.test import TestCase
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.template import Template, Context
+
+from easy_thumbnails.files import get_thumbnailer
+
+from toolkit.diary.models import MediaItem
 
 import toolkit.util.image as image
+import toolkit.util.db as db
+import toolkit.util.thumbnail_cache as thumbnail_cache
+import toolkit.util.thumbnail_queue as thumbnail_queue
+
+
+def _clear_thumbnail_cache():
+    cache.clear()
+    thumbnail_cache.clear_local()
+
+
+class ThumbnailUrlTests(TestCase):
+
+    def setUp(self):
+        _clear_thumbnail_cache()
+        test_image = os.path.join(settings.APP_ROOT_DETECTED, "toolkit",
+                                  "members", "test_data", "image_bluesq.jpg")
+        self.media_item = MediaItem()
+        with open(test_image, "rb") as image_file:
+            self.media_item.media_file.save("thumbnail_test.jpg", File(image_file))
+        self.options = {'size': (10, 10)}
+
+    def tearDown(self):
+        get_thumbnailer(self.media_item.media_file).delete_thumbnails()
+        self.media_item.media_file.delete(save=False)
+
+    def test_no_files(self):
+        self.assertEqual(image.get_thumbnail_urls([], self.options), {})
+
+    def test_generates_missing_thumbnail(self):
+        name = self.media_item.media_file.name
+        urls = image.get_thumbnail_urls([self.media_item.media_file], self.options)
+
+        self.assertEqual(urls.keys(), [name])
+        self.assertTrue(urls[name].startswith(settings.MEDIA_URL))
+        self.assertTrue(os.path.exists(os.path.join(
+            settings.MEDIA_ROOT, urls[name][len(settings.MEDIA_URL):])))
+
+    def test_existing_thumbnail_not_statted(self):
+        name = self.media_item.media_file.name
+        expected = image.get_thumbnail_urls([self.media_item.media_file], self.options)
+        # (Check the lookup in the easy_thumbnails tables, not the URL cache)
+        _clear_thumbnail_cache()
+
+        with patch("os.path.getmtime") as getmtime_patch:
+            with self.assertNumQueries(1):
+                urls = image.get_thumbnail_urls([self.media_item.media_file], self.options)
+            self.assertFalse(getmtime_patch.called)
+
+        self.assertEqual(urls, expected)
+        self.assertEqual(urls[name], get_thumbnailer(self.media_item.media_file).get_thumbnail(self.options).url)
+
+    def test_cached_url_not_statted(self):
+        expected = image.get_thumbnail_urls([self.media_item.media_file], self.options)
+
+        with patch("os.stat") as stat_patch:
+            with patch("os.path.getmtime") as getmtime_patch:
+                with self.assertNumQueries(0):
+                    urls = image.get_thumbnail_urls([self.media_item.media_file], self.options)
+                self.assertFalse(stat_patch.called)
+                self.assertFalse(getmtime_patch.called)
+
+        self.assertEqual(urls, expected)
+
+
+class CachedThumbnailFilterTests(TestCase):
+
+    def setUp(self):
+        _clear_thumbnail_cache()
+        test_image = os.path.join(settings.APP_ROOT_DETECTED, "toolkit",
+                                  "members", "test_data", "image_bluesq.jpg")
+        self.media_item = MediaItem()
+        with open(test_image, "rb") as image_file:
+            self.media_item.media_file.save("thumbnail_test.jpg", File(image_file))
+        self.media_item.save()
+        self.template = Template("{% load cached_thumbnail %}{{ file|thumbnail_url:'std' }}")
+
+    def tearDown(self):
+        get_thumbnailer(self.media_item.media_file).delete_thumbnails()
+        self.media_item.media_file.delete(save=False)
+
+    def _render(self):
+        return self.template.render(Context({'file': self.media_item.media_file}))
+
+    def test_filter(self):
+        expected = get_thumbnailer(self.media_item.media_file)['std'].url
+        self.assertEqual(self._render(), expected)
+
+        with patch("os.stat") as stat_patch:
+            with patch("os.path.getmtime") as getmtime_patch:
+                with self.assertNumQueries(0):
+                    self.assertEqual(self._render(), expected)
+                self.assertFalse(stat_patch.called)
+                self.assertFalse(getmtime_patch.called)
+
+    def test_no_file(self):
+        self.assertEqual(Template("{% load cached_thumbnail %}{{ file|thumbnail_url:'std' }}")
+                         .render(Context({'file': MediaItem().media_file})), u"")
+
+    def test_bad_alias(self):
+        self.assertEqual(Template("{% load cached_thumbnail %}{{ file|thumbnail_url:'nope' }}")
+                         .render(Context({'file': self.media_item.media_file})), u"")
+
+    def test_invalidated_on_save(self):
+        get_thumbnailer(self.media_item.media_file)['std']
+        self._render()
+        with patch("toolkit.util.thumbnail_cache.get_thumbnailer") as get_thumbnailer_patch:
+            get_thumbnailer_patch.return_value.get_thumbnail.return_value.url = u"/new/url.jpg"
+            self.assertNotEqual(self._render(), u"/new/url.jpg")
+
+            self.media_item.credit = u"Someone"
+            self.media_item.save()
+            self.assertEqual(self._render(), u"/new/url.jpg")
+
+
+@patch("toolkit.util.tasks.generate_thumbnails")
+class ThumbnailQueueTests(TestCase):
+
+    def setUp(self):
+        _clear_thumbnail_cache()
+        test_image = os.path.join(settings.APP_ROOT_DETECTED, "toolkit",
+                                  "members", "test_data", "image_bluesq.jpg")
+        with open(test_image, "rb") as image_file:
+            self.image_data = image_file.read()
+        self.media_item = None
+        self.template = Template("{% load cached_thumbnail %}{{ file|thumbnail_url:'std' }}")
+        self.std_options = settings.THUMBNAIL_ALIASES['diary.MediaItem']['std']
+
+    def tearDown(self):
+        if self.media_item:
+            get_thumbnailer(self.media_item.media_file).delete_thumbnails()
+            self.media_item.media_file.delete(save=False)
+
+    def _upload(self):
+        self.media_item = MediaItem(
+            media_file=SimpleUploadedFile("queue_test.jpg", self.image_data))
+        self.media_item.save()
+        return self.media_item.media_file
+
+    def _render(self):
+        return self.template.render(Context({'file': self.media_item.media_file}))
+
+    def test_upload_queues_thumbnails(self, task_mock):
+        field_file = self._upload()
+
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+        self.assertEqual(task_mock.apply_async.call_args[1]['args'],
+                         [field_file.name, [self.std_options]])
+        # Not generated in the request:
+        self.assertIsNone(get_thumbnailer(field_file).get_thumbnail(self.std_options, generate=False))
+
+    def test_placeholder(self, task_mock):
+        self._upload()
+
+        self.assertEqual(self._render(), settings.THUMBNAIL_PLACEHOLDERS['std'])
+        self.assertEqual(self._render(), settings.THUMBNAIL_PLACEHOLDERS['std'])
+        # Only queued once:
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+
+    def test_generate(self, task_mock):
+        field_file = self._upload()
+        self.assertEqual(self._render(), settings.THUMBNAIL_PLACEHOLDERS['std'])
+
+        received = []
+
+        def receiver(sender, source_name, **kwargs):
+            received.append(source_name)
+        thumbnail_queue.thumbnails_generated.connect(receiver)
+        try:
+            self.assertEqual(thumbnail_queue.generate(field_file.name, [self.std_options]), 1)
+        finally:
+            thumbnail_queue.thumbnails_generated.disconnect(receiver)
+
+        self.assertEqual(received, [field_file.name])
+        expected = get_thumbnailer(field_file)['std'].url
+        with self.assertNumQueries(0):
+            self.assertEqual(self._render(), expected)
+
+    def test_json_thumbnails_not_generated(self, task_mock):
+        field_file = self._upload()
+        options = {'size': (10, 10)}
+
+        urls = image.get_thumbnail_urls([field_file], options, generate=False)
+
+        self.assertEqual(urls, {field_file.name: None})
+        self.assertEqual(task_mock.apply_async.call_args[1]['args'],
+                         [field_file.name, [options]])
+
+
+class AfterCommitTests(TestCase):
+
+    def test_no_transaction(self):
+        called = []
+        db.after_commit(lambda: called.append(1))
+        self.assertEqual(called, [1])
+
+    def test_called_after_commit(self):
+        called = []
+        with db.commit_on_success():
+            with db.commit_on_success():
+                db.after_commit(lambda: called.append(1))
+            # (Only the outermost block commits)
+            self.assertEqual(called, [])
+            db.after_commit(lambda: called.append(2))
+            self.assertEqual(called, [])
+        self.assertEqual(called, [1, 2])
+
+    def test_not_called_after_rollback(self):
+        called = []
+        with self.assertRaises(ValueError):
+            with db.commit_on_success():
+                db.after_commit(lambda: called.append(1))
+                raise ValueError()
+        self.assertEqual(called, [])
+
+        # (And isn't left pending for the next transaction)
+        with db.commit_on_success():
+            pass
+        self.assertEqual(called, [])
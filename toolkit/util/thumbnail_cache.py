@@ -0,0 +1,161 @@
+"""Cache of thumbnail URLs, for the thumbnail_url template filter (see
+templatetags/cached_thumbnail.py) and image.get_thumbnail_urls
+
+Getting a thumbnail from easy_thumbnails works out the thumbnail name (twice,
+for the opaque and transparent variants), checks the modification time of the
+source image and of the thumbnail file(s), and creates new storage objects,
+every time. As the thumbnail for a given source file and set of options
+always has the same URL, this caches the URL instead, so that rendering a
+page with lots of images doesn't need to touch the filesystem at all.
+
+There are two levels of cache:
+- a small LRU cache in each process, entries in which are trusted for
+  LOCAL_TIMEOUT seconds
+- the Django cache, shared between processes, which stores a dict of
+  options -> URL for each source file
+
+When a model with a file field is saved or deleted, the entries for its
+files are thrown away (immediately in the shared cache and the local cache of
+the process that did the save, within LOCAL_TIMEOUT elsewhere). The next
+lookup then goes through easy_thumbnails as normal, which regenerates the
+thumbnail if the source file is newer.
+"""
+import time
+import hashlib
+import logging
+import threading
+
+from django.core.cache import cache
+from django.db.models import FileField
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+
+from toolkit.util.ordereddict import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'thumbnail_url'
+
+# Maximum number of URLs kept in each process:
+LOCAL_SIZE = 1000
+# Number of seconds for which a URL in the local cache is used before
+# checking the shared cache again (so changes made by other processes are
+# seen):
+LOCAL_TIMEOUT = 60
+# Number of seconds for which URLs are kept in the shared cache:
+SHARED_TIMEOUT = 24 * 60 * 60
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _options_key(options):
+    return repr(sorted(options.items()))
+
+
+def _shared_key(source_name):
+    return u"{0}:{1}".format(
+        KEY_PREFIX, hashlib.md5(source_name.encode("utf-8")).hexdigest())
+
+
+def _local_get(source_name, options_key):
+    key = (source_name, options_key)
+    with _local_lock:
+        entry = _local.pop(key, None)
+        if entry is None or entry[1] < time.time() - LOCAL_TIMEOUT:
+            return None
+        # (Move to the most recently used end)
+        _local[key] = entry
+        return entry[0]
+
+
+def _local_set(source_name, options_key, url):
+    with _local_lock:
+        _local.pop((source_name, options_key), None)
+        _local[(source_name, options_key)] = (url, time.time())
+        while len(_local) > LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def get_cached_urls(source_names, options):
+    """Return dict mapping each of source_names (for which a thumbnail URL
+    with the given options is cached) to its thumbnail URL"""
+    options_key = _options_key(options)
+    urls = {}
+    missing = []
+    for name in source_names:
+        url = _local_get(name, options_key)
+        if url is None:
+            missing.append(name)
+        else:
+            urls[name] = url
+
+    if missing:
+        shared = cache.get_many([_shared_key(name) for name in missing])
+        for name in missing:
+            url = shared.get(_shared_key(name), {}).get(options_key)
+            if url is not None:
+                _local_set(name, options_key, url)
+                urls[name] = url
+    return urls
+
+
+def set_cached_url(source_name, options, url):
+    options_key = _options_key(options)
+    _local_set(source_name, options_key, url)
+    key = _shared_key(source_name)
+    # (If another process is doing the same thing for different options then
+    # one of the URLs may be lost, which just means it's looked up again)
+    urls = cache.get(key) or {}
+    urls[options_key] = url
+    cache.set(key, urls, SHARED_TIMEOUT)
+
+
+def get_thumbnail_url(field_file, alias, generate=True):
+    """Return the URL of the thumbnail for field_file (a FieldFile) using the
+    given thumbnail alias, generating the thumbnail if necessary (or, if
+    generate is False, returning None if the thumbnail doesn't exist yet)
+
+    Raises KeyError if there's no such alias"""
+    options = aliases.get(alias, target=field_file)
+    if not options:
+        raise KeyError(alias)
+    url = get_cached_urls([field_file.name], options).get(field_file.name)
+    if url is None:
+        thumbnail = get_thumbnailer(field_file).get_thumbnail(options, generate=generate)
+        if thumbnail is None:
+            return None
+        url = thumbnail.url
+        set_cached_url(field_file.name, options, url)
+    return url
+
+
+def invalidate(source_names):
+    """Throw away cached URLs for the given source files"""
+    source_names = [name for name in source_names if name]
+    if not source_names:
+        return
+    logger.debug(u"Invalidating thumbnail URLs for {0}".format(source_names))
+    with _local_lock:
+        for key in [key for key in _local if key[0] in source_names]:
+            del _local[key]
+    cache.delete_many([_shared_key(name) for name in source_names])
+
+
+def clear_local():
+    with _local_lock:
+        _local.clear()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def _file_owner_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    names = [getattr(instance, field.attname).name for field in sender._meta.fields
+             if isinstance(field, FileField)]
+    if names:
+        invalidate(names)
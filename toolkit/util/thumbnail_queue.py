@@ -0,0 +1,108 @@
+"""Generation of thumbnails in the background, by a celery task
+(tasks.generate_thumbnails), rather than in whichever request first needs them
+
+When a file is saved to a model field (e.g. a new MediaItem image, or a
+volunteer's portrait) easy_thumbnails sends its saved_file signal, and rather
+than connecting easy_thumbnails' own generate_aliases_global handler (which
+would decode the upload in the request that saved it) the handler below
+queues a task to generate all the aliases for that file.
+
+Until the thumbnails exist the thumbnail_url template filter (see
+templatetags/cached_thumbnail.py) shows the placeholder image for the alias
+(settings.THUMBNAIL_PLACEHOLDERS) instead of generating them, and queues them
+in case they were missed (e.g. images uploaded before this was set up). Once
+they've been generated the thumbnails_generated signal is sent, so that any
+cached pages showing the placeholder can be thrown away.
+
+Thumbnails are assumed to be of files in the default storage.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import Signal, receiver
+
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+from easy_thumbnails.signals import saved_file
+
+import toolkit.util.thumbnail_cache as thumbnail_cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'thumbnail_queued'
+
+# Number of seconds for which a file / set of options is considered queued,
+# and so isn't queued again (in case the task is lost):
+QUEUED_TIMEOUT = 10 * 60
+
+# Sent (with the name of the source file) by generate(), once the thumbnails
+# have been generated:
+thumbnails_generated = Signal(providing_args=['source_name'])
+
+
+def _queued_key(source_name, options_list):
+    raw_key = u"{0}|{1}".format(
+        source_name, repr([sorted(options.items()) for options in options_list]))
+    return u"{0}:{1}".format(
+        KEY_PREFIX, hashlib.md5(raw_key.encode("utf-8")).hexdigest())
+
+
+def placeholder_url(alias):
+    """Return URL of the image to show in place of a thumbnail with the given
+    alias which hasn't been generated yet"""
+    return settings.THUMBNAIL_PLACEHOLDERS.get(alias, u"")
+
+
+def queue(source_name, options_list):
+    """Queue generation of thumbnails of source_name (name of a file in the
+    default storage) with each of the given sets of options, unless they're
+    already queued"""
+    options_list = list(options_list)
+    if not source_name or not options_list:
+        return
+    if not cache.add(_queued_key(source_name, options_list), True, QUEUED_TIMEOUT):
+        return
+    logger.debug(u"Queueing thumbnails for {0}".format(source_name))
+    # Import here, as tasks imports this module:
+    from toolkit.util.tasks import generate_thumbnails
+    # The task is delayed slightly, so that the change that triggered it has
+    # (hopefully) been committed by the time thumbnails_generated is sent:
+    generate_thumbnails.apply_async(
+        args=[source_name, options_list],
+        countdown=settings.THUMBNAIL_GENERATE_DELAY)
+
+
+def queue_aliases(field_file):
+    """Queue generation of thumbnails of field_file (a FieldFile) for all the
+    thumbnail aliases that apply to it"""
+    queue(field_file.name, aliases.all(field_file, include_global=True).values())
+
+
+def generate(source_name, options_list):
+    """Generate thumbnails of source_name with each of the given sets of
+    options (called by tasks.generate_thumbnails). Returns the number of
+    thumbnails generated."""
+    cache.delete(_queued_key(source_name, options_list))
+    thumbnailer = get_thumbnailer(source_name)
+    generated = 0
+    for options in options_list:
+        try:
+            url = thumbnailer.get_thumbnail(options).url
+        except Exception:
+            # (Keep going with the other options; if the source is broken
+            # the placeholder will continue to be shown)
+            logger.exception(u"Failed generating thumbnail for {0}, {1}"
+                             .format(source_name, options))
+            continue
+        thumbnail_cache.set_cached_url(source_name, options, url)
+        generated += 1
+    if generated:
+        thumbnails_generated.send(sender=None, source_name=source_name)
+    return generated
+
+
+@receiver(saved_file)
+def _file_saved(sender, fieldfile, **kwargs):
+    queue_aliases(fieldfile)